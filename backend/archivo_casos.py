@@ -0,0 +1,228 @@
+"""
+Archivo frío de casos cerrados
+
+La gran mayoría de los casos están CERRADOS hace meses, pero siguen inflando
+los índices de `casos` y de sus tablas hijas, que recorren todas las consultas
+de casos abiertos. El proceso de archivo mueve los casos cerrados hace más de
+ARCHIVO_DIAS_CIERRE días, con sus interacciones, eventos, estados y alertas, a
+tablas `*_archivo` con la misma forma (models.CasoArchivado y compañía).
+
+Los casos conservan su id y su número RAD. Cada lote se mueve en una sola
+transacción (INSERT ... SELECT y DELETE), así que un caso está en las tablas
+calientes o en el archivo, nunca en ambas ni en ninguna. Los casos archivados
+son de solo lectura.
+
+Lectura transparente: el detalle de un caso, el historial del paciente, los
+reportes y las métricas leen también del archivo (ver `obtener_caso_archivado`,
+`casos_de_paciente` y `union_casos`).
+
+Uso:
+    python archivo_casos.py estado
+    python archivo_casos.py archivar
+    python archivo_casos.py archivar --dias 365 --lote 500
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session, joinedload
+
+from eventos_tiempo_real import bus_eventos
+from models import (
+    Alerta, AlertaArchivada, Caso, CasoArchivado, EstadoCasoEnum, HistorialEstado,
+    HistorialEstadoArchivado, HistorialEvento, HistorialEventoArchivado, Interaccion,
+    InteraccionArchivada
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_DIAS_CIERRE = int(os.environ.get('ARCHIVO_DIAS_CIERRE', '180'))
+ARCHIVO_LOTE = int(os.environ.get('ARCHIVO_LOTE', '1000'))
+
+# Tablas hijas de casos y su copia en el archivo; se copian después del caso
+# y se borran antes que él por las claves foráneas
+HIJAS_ARCHIVO = (
+    (Interaccion, InteraccionArchivada),
+    (HistorialEstado, HistorialEstadoArchivado),
+    (HistorialEvento, HistorialEventoArchivado),
+    (Alerta, AlertaArchivada),
+)
+
+# Modelo caliente -> modelo del archivo
+MODELOS_ARCHIVO = {Caso: CasoArchivado, **dict(HIJAS_ARCHIVO)}
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _copiar(db: Session, origen, destino, filtro, **extra):
+    """INSERT INTO destino SELECT ... FROM origen WHERE filtro, columna por columna"""
+    columnas = [c.name for c in origen.__table__.columns]
+    db.execute(insert(destino).from_select(
+        columnas + list(extra),
+        select(*[origen.__table__.c[c] for c in columnas], *[literal(v) for v in extra.values()]).where(filtro)
+    ))
+
+def archivar_lote(db: Session, limite_cierre: datetime, lote: int) -> int:
+    """Mueve al archivo hasta `lote` casos cerrados antes de `limite_cierre`; no hace commit"""
+    consulta = select(Caso.id).where(
+        Caso.estado == EstadoCasoEnum.CERRADO,
+        func.coalesce(Caso.fecha_cierre, Caso.fecha_actualizacion) < limite_cierre
+    ).order_by(Caso.id).limit(lote)
+    if db.get_bind().dialect.name == "postgresql":
+        # Los casos que otra transacción está modificando quedan para el siguiente ciclo
+        consulta = consulta.with_for_update(skip_locked=True)
+    ids = db.execute(consulta).scalars().all()
+    if not ids:
+        return 0
+
+    _copiar(db, Caso, CasoArchivado, Caso.id.in_(ids), fecha_archivo=_ahora())
+    for caliente, archivada in HIJAS_ARCHIVO:
+        _copiar(db, caliente, archivada, caliente.caso_id.in_(ids))
+    for caliente, _ in HIJAS_ARCHIVO:
+        db.execute(delete(caliente).where(caliente.caso_id.in_(ids)))
+    db.execute(delete(Caso).where(Caso.id.in_(ids)))
+    return len(ids)
+
+def archivar_casos(db: Session, dias: Optional[int] = None, lote: Optional[int] = None,
+                   maximo: Optional[int] = None) -> int:
+    """
+    Archiva por lotes (una transacción por lote) los casos cerrados hace más de
+    `dias` días. Devuelve la cantidad de casos archivados.
+    """
+    dias = ARCHIVO_DIAS_CIERRE if dias is None else dias
+    lote = lote or ARCHIVO_LOTE
+    limite_cierre = _ahora() - timedelta(days=dias)
+    total = 0
+    while maximo is None or total < maximo:
+        movidos = archivar_lote(db, limite_cierre, lote if maximo is None else min(lote, maximo - total))
+        db.commit()
+        if not movidos:
+            break
+        total += movidos
+        logger.info(f"Archivo: {total} casos movidos (cerrados antes de {limite_cierre:%Y-%m-%d})")
+
+    if total:
+        # Las alertas archivadas dejan de contar como no leídas
+        bus_eventos.publicar("casos_archivados", {"cantidad": total})
+    return total
+
+def tarea_archivo(db: Session) -> int:
+    """Tarea periódica del servidor; ARCHIVO_DIAS_CIERRE <= 0 la deshabilita"""
+    if ARCHIVO_DIAS_CIERRE <= 0:
+        return 0
+    return archivar_casos(db)
+
+# ==================== LECTURA DESDE EL ARCHIVO ====================
+
+def obtener_caso_archivado(db: Session, caso_id: int) -> Optional[CasoArchivado]:
+    """Caso archivado con las mismas relaciones que el detalle de un caso caliente"""
+    return db.query(CasoArchivado).options(
+        joinedload(CasoArchivado.paciente),
+        joinedload(CasoArchivado.motivo_obj),
+        joinedload(CasoArchivado.agente_creador),
+        joinedload(CasoArchivado.agente_asignado),
+        joinedload(CasoArchivado.interacciones),
+        joinedload(CasoArchivado.historial_estados),
+        joinedload(CasoArchivado.historial_eventos_new).joinedload(HistorialEventoArchivado.usuario)
+    ).filter(CasoArchivado.id == caso_id).first()
+
+def esta_archivado(db: Session, caso_id: Optional[int] = None, numero_caso: Optional[str] = None) -> bool:
+    consulta = db.query(CasoArchivado.id)
+    if caso_id is not None:
+        consulta = consulta.filter(CasoArchivado.id == caso_id)
+    if numero_caso is not None:
+        consulta = consulta.filter(CasoArchivado.numero_caso == numero_caso)
+    return consulta.first() is not None
+
+def casos_de_paciente(db: Session, paciente_id: int, incluir_archivados: bool = True) -> list:
+    """Casos calientes y archivados de un paciente, del más reciente al más antiguo"""
+    casos = db.query(Caso).filter(Caso.paciente_id == paciente_id).all()
+    if incluir_archivados:
+        casos += db.query(CasoArchivado).filter(CasoArchivado.paciente_id == paciente_id).all()
+    return sorted(casos, key=lambda c: c.fecha_creacion, reverse=True)
+
+def version_casos_paciente(db: Session, paciente_id: int, incluir_archivados: bool = True):
+    """(cantidad, última modificación) de los casos de un paciente, para su ETag"""
+    cantidad, ultima = db.query(
+        func.count(Caso.id), func.max(Caso.fecha_actualizacion)
+    ).filter(Caso.paciente_id == paciente_id).one()
+    if incluir_archivados:
+        cantidad_archivo, ultima_archivo = db.query(
+            func.count(CasoArchivado.id), func.max(CasoArchivado.fecha_archivo)
+        ).filter(CasoArchivado.paciente_id == paciente_id).one()
+        cantidad += cantidad_archivo
+        ultima = max((f for f in (ultima, ultima_archivo) if f is not None), default=None)
+    return cantidad, ultima
+
+def union_casos(columnas: Sequence[str], filtros: Callable[[type], List]):
+    """
+    Subconsulta `casos_y_archivo` con `columnas` de los casos calientes y
+    archivados que cumplen `filtros(modelo)`, para consultas de rango como
+    reportes o tiempos de resolución.
+    """
+    partes = [
+        select(*[getattr(modelo, c).label(c) for c in columnas]).where(*filtros(modelo))
+        for modelo in (Caso, CasoArchivado)
+    ]
+    return union_all(*partes).subquery('casos_y_archivo')
+
+def ultimo_numero_rad(db: Session, prefijo: str = "RAD-") -> int:
+    """Número del último caso archivado con el prefijo dado (0 si no hay)"""
+    numero = db.query(CasoArchivado.numero_caso).filter(
+        CasoArchivado.numero_caso.like(f"{prefijo}%")
+    ).order_by(CasoArchivado.id.desc()).limit(1).scalar()
+    return int(numero.split('-')[-1]) if numero else 0
+
+def estado_archivo(db: Session) -> dict:
+    """Filas calientes y archivadas por tabla, y casos listos para archivar"""
+    limite_cierre = _ahora() - timedelta(days=ARCHIVO_DIAS_CIERRE)
+    pendientes = db.query(func.count(Caso.id)).filter(
+        Caso.estado == EstadoCasoEnum.CERRADO,
+        func.coalesce(Caso.fecha_cierre, Caso.fecha_actualizacion) < limite_cierre
+    ).scalar()
+    return {
+        "dias_cierre": ARCHIVO_DIAS_CIERRE,
+        "casos_pendientes": pendientes,
+        "ultimo_archivo": db.query(func.max(CasoArchivado.fecha_archivo)).scalar(),
+        "tablas": {
+            caliente.__tablename__: {
+                "calientes": db.query(func.count(caliente.id)).scalar(),
+                "archivadas": db.query(func.count(archivada.id)).scalar(),
+            }
+            for caliente, archivada in MODELOS_ARCHIVO.items()
+        }
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Archivo de casos cerrados")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("estado", help="Filas calientes y archivadas por tabla")
+    archivar = sub.add_parser("archivar", help="Mover al archivo los casos cerrados antiguos")
+    archivar.add_argument("--dias", type=int, default=ARCHIVO_DIAS_CIERRE,
+                          help="Días desde el cierre (ARCHIVO_DIAS_CIERRE)")
+    archivar.add_argument("--lote", type=int, default=ARCHIVO_LOTE, help="Casos por transacción")
+    archivar.add_argument("--maximo", type=int, default=None, help="Tope de casos en esta ejecución")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        if args.comando == "archivar":
+            total = archivar_casos(db, args.dias, args.lote, args.maximo)
+            print(f"{total} casos archivados")
+        else:
+            estado = estado_archivo(db)
+            print(f"Casos cerrados hace más de {estado['dias_cierre']} días sin archivar: "
+                  f"{estado['casos_pendientes']:,}")
+            print(f"Último archivo: {estado['ultimo_archivo'] or 'nunca'}")
+            for tabla, filas in estado["tablas"].items():
+                print(f"  {tabla:<20}{filas['calientes']:>12,} calientes{filas['archivadas']:>12,} archivadas")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Asignación automática de casos por carga
+
+Mantiene en memoria la carga de cada agente activo: sus casos abiertos o en
+proceso, ponderados por prioridad (ALTA 3, MEDIA 2, BAJA 1). Un heap de
+mínimos entrega en O(log n) el agente con menos carga; a igual carga gana el
+que lleva más tiempo sin recibir un caso.
+
+La carga se calcula con una sola consulta agregada al arrancar y luego se
+mantiene con los eventos del bus (caso creado, cambio de estado, prioridad o
+agente) y con la reserva que hace `asignar`. El heap usa borrado perezoso:
+cada cambio de carga agrega una entrada nueva y las viejas se descartan al
+salir. Un cambio en el catálogo de usuarios o la tarea periódica reconstruyen
+todo desde la base de datos, lo que corrige cualquier desvío (p. ej. casos
+asignados por otro worker sin bus compartido).
+"""
+import heapq
+import itertools
+import logging
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from models import Caso, EstadoCasoEnum, PrioridadEnum, RolEnum, Usuario
+
+logger = logging.getLogger(__name__)
+
+PESOS_PRIORIDAD = {
+    PrioridadEnum.ALTA.value: 3,
+    PrioridadEnum.MEDIA.value: 2,
+    PrioridadEnum.BAJA.value: 1,
+}
+
+ESTADOS_ABIERTOS = (EstadoCasoEnum.ABIERTO.value, EstadoCasoEnum.EN_PROCESO.value)
+
+def _valor(v) -> Optional[str]:
+    return v.value if hasattr(v, "value") else v
+
+def peso(prioridad, estado=EstadoCasoEnum.ABIERTO) -> int:
+    """Carga que aporta un caso; los cerrados no cuentan"""
+    if _valor(estado) not in ESTADOS_ABIERTOS:
+        return 0
+    return PESOS_PRIORIDAD.get(_valor(prioridad), PESOS_PRIORIDAD[PrioridadEnum.MEDIA.value])
+
+class MotorAsignacion:
+    def __init__(self):
+        self._carga: Dict[int, int] = {}
+        self._heap: List[Tuple[int, int, int]] = []  # (carga, orden, agente_id)
+        self._orden = itertools.count()
+        self._vigente = False
+        self._lock = threading.Lock()
+        # Marca los eventos de casos asignados por este proceso, cuya carga ya se reservó
+        self.token = uuid.uuid4().hex
+
+    def reconstruir(self, db: Session) -> int:
+        """Carga de todos los agentes activos con una consulta agregada; devuelve cuántos hay"""
+        # Un agente sin casos abiertos tiene una fila del outer join sin caso: no suma
+        carga_caso = case(
+            (Caso.id.is_(None), 0),
+            *[(Caso.prioridad == PrioridadEnum(p), w) for p, w in PESOS_PRIORIDAD.items()],
+            else_=PESOS_PRIORIDAD[PrioridadEnum.MEDIA.value]
+        )
+        filas = db.query(
+            Usuario.id, func.coalesce(func.sum(carga_caso), 0)
+        ).outerjoin(
+            Caso,
+            (Caso.agente_asignado_id == Usuario.id) &
+            Caso.estado.in_([EstadoCasoEnum(e) for e in ESTADOS_ABIERTOS])
+        ).filter(
+            Usuario.rol == RolEnum.AGENTE, Usuario.activo == True
+        ).group_by(Usuario.id).order_by(Usuario.id).all()
+
+        with self._lock:
+            self._carga = {agente_id: int(carga) for agente_id, carga in filas}
+            self._reconstruir_heap()
+            self._vigente = True
+        return len(filas)
+
+    def _reconstruir_heap(self):
+        self._heap = [(carga, next(self._orden), agente_id) for agente_id, carga in self._carga.items()]
+        heapq.heapify(self._heap)
+
+    def _empujar(self, agente_id: int):
+        heapq.heappush(self._heap, (self._carga[agente_id], next(self._orden), agente_id))
+        # Demasiadas entradas obsoletas: se compacta en O(n)
+        if len(self._heap) > 4 * len(self._carga) + 64:
+            self._reconstruir_heap()
+
+    def _ajustar(self, agente_id: Optional[int], delta: int):
+        if agente_id is None or delta == 0 or agente_id not in self._carga:
+            return
+        self._carga[agente_id] = max(0, self._carga[agente_id] + delta)
+        self._empujar(agente_id)
+
+    def asignar(self, db: Session, prioridad=PrioridadEnum.MEDIA,
+                estado=EstadoCasoEnum.ABIERTO) -> Optional[int]:
+        """
+        Agente activo con menos carga, o None si no hay agentes. Reserva la
+        carga del caso; si el caso no llega a crearse hay que llamar a `liberar`.
+        """
+        if not self._vigente:
+            self.reconstruir(db)
+        with self._lock:
+            while self._heap:
+                carga, _, agente_id = heapq.heappop(self._heap)
+                if self._carga.get(agente_id) != carga:
+                    continue  # entrada obsoleta
+                self._carga[agente_id] = carga + peso(prioridad, estado)
+                self._empujar(agente_id)
+                return agente_id
+        return None
+
+    def liberar(self, agente_id: Optional[int], prioridad=PrioridadEnum.MEDIA,
+                estado=EstadoCasoEnum.ABIERTO):
+        """Deshace la reserva de `asignar`"""
+        with self._lock:
+            self._ajustar(agente_id, -peso(prioridad, estado))
+
+    def invalidar(self):
+        with self._lock:
+            self._vigente = False
+
+    def cargas(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._carga)
+
+    def aplicar_evento(self, tipo: str, datos: dict):
+        """Oyente del bus de eventos"""
+        if tipo == "caso_creado":
+            if datos.get("asignado_por") == self.token:
+                return
+            with self._lock:
+                self._ajustar(datos.get("agente_asignado_id"), peso(datos.get("prioridad"), datos.get("estado")))
+        elif tipo == "caso_actualizado":
+            agente_nuevo = datos.get("agente_asignado_id")
+            agente_anterior = datos.get("agente_anterior_id", agente_nuevo)
+            anterior = peso(datos.get("prioridad_anterior", datos.get("prioridad")),
+                            datos.get("estado_anterior", datos.get("estado")))
+            nuevo = peso(datos.get("prioridad"), datos.get("estado"))
+            with self._lock:
+                if agente_anterior == agente_nuevo:
+                    self._ajustar(agente_nuevo, nuevo - anterior)
+                else:
+                    self._ajustar(agente_anterior, -anterior)
+                    self._ajustar(agente_nuevo, nuevo)
+        elif tipo == "catalogo_actualizado" and datos.get("catalogo") == "usuarios":
+            # Altas, bajas o cambios de rol: se reconstruye en la siguiente asignación
+            self.invalidar()
+
+motor_asignacion = MotorAsignacion()
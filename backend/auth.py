@@ -33,6 +33,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Usuario:
+    return obtener_usuario_desde_token(token, db)
+
+def obtener_usuario_desde_token(token: str, db: Session) -> Usuario:
+    """Valida el JWT y devuelve el usuario activo (también para tokens fuera del header)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales",
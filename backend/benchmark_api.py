@@ -0,0 +1,232 @@
+"""
+Benchmark de la API LOGIFARMA PQR contra un servidor en ejecución
+
+Mide la latencia (p50/p95/p99) y el throughput de los flujos principales:
+login, screen-pop de OmniLeads, listado y detalle de casos, creación de
+casos, dashboard y reportes. Conviene correrlo contra una base llenada con
+generar_datos_sinteticos.py para que los números sean comparables.
+
+Los resultados se pueden guardar como línea base y comparar en corridas
+posteriores. Si el p95 de algún escenario empeora más que la tolerancia, el
+script termina con código 1, igual que perfil_arranque.py.
+
+Para carga sostenida con muchos usuarios está locustfile.py.
+
+Uso:
+    python benchmark_api.py --url http://localhost:8001 --guardar benchmark_base.json
+    python benchmark_api.py --url http://localhost:8001 --comparar benchmark_base.json
+    python benchmark_api.py --escenarios listado_casos,detalle_caso --peticiones 500 --concurrencia 20
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+TOLERANCIA_DEFECTO = 0.20  # 20% de empeoramiento del p95
+
+
+class ClienteBenchmark:
+    """Sesión HTTP por hilo con el token del usuario y datos de muestra"""
+
+    def __init__(self, url: str, usuario: str, clave: str, verificar_tls: bool = True):
+        self.url = url.rstrip("/")
+        self.usuario, self.clave = usuario, clave
+        self.verificar_tls = verificar_tls
+        self._local = threading.local()
+        self.token = self.login(self._nueva_sesion()).json()["access_token"]
+        self.identificaciones, self.ids_casos, self.ids_pacientes, self.ids_motivos = self._muestras()
+
+    def sesion(self) -> requests.Session:
+        sesion = getattr(self._local, "sesion", None)
+        if sesion is None:
+            sesion = self._local.sesion = self._nueva_sesion()
+            sesion.headers["Authorization"] = f"Bearer {self.token}"
+        return sesion
+
+    def _nueva_sesion(self) -> requests.Session:
+        sesion = requests.Session()
+        sesion.verify = self.verificar_tls
+        return sesion
+
+    def login(self, sesion=None):
+        sesion = sesion or self._nueva_sesion()
+        respuesta = sesion.post(f"{self.url}/api/auth/login",
+                                json={"username": self.usuario, "password": self.clave})
+        respuesta.raise_for_status()
+        return respuesta
+
+    def _muestras(self):
+        sesion = self.sesion()
+        pacientes = sesion.get(f"{self.url}/api/pacientes", params={"limit": 500}).json()
+        casos = sesion.get(f"{self.url}/api/casos", params={"limit": 500}).json()
+        motivos = sesion.get(f"{self.url}/api/motivos").json()
+        if not pacientes or not casos or not motivos:
+            raise SystemExit("La base no tiene pacientes, casos o motivos; use generar_datos_sinteticos.py")
+        return ([p["identificacion"] for p in pacientes], [c["id"] for c in casos],
+                [p["id"] for p in pacientes], [m["id"] for m in motivos])
+
+
+def _escenarios(cliente: ClienteBenchmark, con_escrituras: bool):
+    url = cliente.url
+    fin = date.today()
+    inicio = fin - timedelta(days=30)
+    rango = {"inicio": inicio.isoformat(), "fin": fin.isoformat()}
+
+    escenarios = {
+        "login": lambda: cliente.login(cliente.sesion()),
+        "screen_pop": lambda: cliente.sesion().get(
+            f"{url}/api/embedded/paciente/{random.choice(cliente.identificaciones)}"),
+        "historial_embebido": lambda: cliente.sesion().get(
+            f"{url}/api/embedded/paciente/{random.choice(cliente.identificaciones)}/historial"),
+        "listado_casos": lambda: cliente.sesion().get(f"{url}/api/casos", params={"limit": 50}),
+        "listado_casos_filtrado": lambda: cliente.sesion().get(
+            f"{url}/api/casos", params={"limit": 50, "estado": "ABIERTO", "prioridad": "ALTA"}),
+        "detalle_caso": lambda: cliente.sesion().get(f"{url}/api/casos/{random.choice(cliente.ids_casos)}"),
+        "dashboard": lambda: cliente.sesion().get(f"{url}/api/metricas/dashboard"),
+        "casos_por_motivo": lambda: cliente.sesion().get(f"{url}/api/metricas/casos-por-motivo", params=rango),
+        "tendencia_historica": lambda: cliente.sesion().get(
+            f"{url}/api/metricas/tendencia-historica", params={**rango, "agrupar_por": "dia"}),
+        "reporte_excel": lambda: cliente.sesion().post(f"{url}/api/reportes/generar", params={
+            "tipo_reporte": "casos_periodo", "formato": "excel",
+            "fecha_inicio": rango["inicio"], "fecha_fin": rango["fin"]}),
+    }
+    if con_escrituras:
+        escenarios["crear_caso"] = lambda: cliente.sesion().post(f"{url}/api/casos", json={
+            "paciente_id": random.choice(cliente.ids_pacientes),
+            "motivo_id": random.choice(cliente.ids_motivos),
+            "descripcion": "Caso creado por benchmark_api.py",
+            "origen": "web",
+        })
+    return escenarios
+
+
+def _percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def ejecutar(funcion, peticiones: int, concurrencia: int, calentamiento: int) -> dict:
+    for _ in range(calentamiento):
+        funcion()
+
+    duraciones, errores = [], [0]
+    lock = threading.Lock()
+
+    def una():
+        inicio = time.perf_counter()
+        try:
+            respuesta = funcion()
+            ok = respuesta.status_code < 400
+        except requests.RequestException:
+            ok = False
+        duracion = (time.perf_counter() - inicio) * 1000
+        with lock:
+            duraciones.append(duracion)
+            if not ok:
+                errores[0] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        for _ in range(peticiones):
+            ejecutor.submit(una)
+    total = time.perf_counter() - inicio
+
+    return {
+        "peticiones": peticiones,
+        "concurrencia": concurrencia,
+        "errores": errores[0],
+        "p50_ms": round(_percentil(duraciones, 50), 2),
+        "p95_ms": round(_percentil(duraciones, 95), 2),
+        "p99_ms": round(_percentil(duraciones, 99), 2),
+        "media_ms": round(statistics.fmean(duraciones), 2) if duraciones else 0.0,
+        "peticiones_por_segundo": round(peticiones / total, 1) if total else 0.0,
+    }
+
+
+def comparar(resultados: dict, linea_base: dict, tolerancia: float) -> list:
+    """Escenarios cuyo p95 empeoró más que la tolerancia respecto a la línea base"""
+    regresiones = []
+    print(f"\n{'Escenario':<24}{'p95 base':>10}{'p95 actual':>12}{'cambio':>9}")
+    for nombre, actual in resultados.items():
+        base = linea_base.get("escenarios", {}).get(nombre)
+        # Una línea base con errores no sirve de referencia para ese escenario
+        if not base or not base["p95_ms"] or base["errores"]:
+            continue
+        cambio = actual["p95_ms"] / base["p95_ms"] - 1
+        marca = "  REGRESIÓN" if cambio > tolerancia else ""
+        print(f"{nombre:<24}{base['p95_ms']:>10.1f}{actual['p95_ms']:>12.1f}{cambio:>+9.0%}{marca}")
+        if cambio > tolerancia:
+            regresiones.append(nombre)
+    return regresiones
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de la API LOGIFARMA PQR")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--sin-verificar-tls", action="store_true",
+                        help="Aceptar el certificado autofirmado del contenedor")
+    parser.add_argument("--usuario", default="admin")
+    parser.add_argument("--clave", default="admin123")
+    parser.add_argument("--escenarios", help="Lista separada por comas (por defecto todos)")
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones por escenario")
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--calentamiento", type=int, default=5, help="Peticiones previas sin medir")
+    parser.add_argument("--sin-escrituras", action="store_true", help="No ejecutar crear_caso")
+    parser.add_argument("--guardar", help="Archivo JSON donde guardar los resultados como línea base")
+    parser.add_argument("--comparar", help="Línea base JSON contra la cual comparar")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_DEFECTO,
+                        help="Empeoramiento máximo del p95 (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    if args.sin_verificar_tls:
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    cliente = ClienteBenchmark(args.url, args.usuario, args.clave, not args.sin_verificar_tls)
+    escenarios = _escenarios(cliente, not args.sin_escrituras)
+    if args.escenarios:
+        pedidos = [e.strip() for e in args.escenarios.split(",")]
+        desconocidos = set(pedidos) - set(escenarios)
+        if desconocidos:
+            parser.error(f"escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        escenarios = {nombre: escenarios[nombre] for nombre in pedidos}
+
+    print(f"{'Escenario':<24}{'p50':>8}{'p95':>8}{'p99':>8}{'req/s':>9}{'errores':>9}")
+    resultados = {}
+    for nombre, funcion in escenarios.items():
+        r = resultados[nombre] = ejecutar(funcion, args.peticiones, args.concurrencia, args.calentamiento)
+        print(f"{nombre:<24}{r['p50_ms']:>8.1f}{r['p95_ms']:>8.1f}{r['p99_ms']:>8.1f}"
+              f"{r['peticiones_por_segundo']:>9.1f}{r['errores']:>9}")
+
+    if args.guardar:
+        with open(args.guardar, "w") as f:
+            json.dump({
+                "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "url": args.url,
+                "escenarios": resultados,
+            }, f, indent=2)
+        print(f"\nLínea base guardada en {args.guardar}")
+
+    codigo = 0
+    if any(r["errores"] for r in resultados.values()):
+        print("\nHubo peticiones con error")
+        codigo = 1
+    if args.comparar:
+        with open(args.comparar) as f:
+            regresiones = comparar(resultados, json.load(f), args.tolerancia)
+        if regresiones:
+            print(f"\nRegresiones de p95 en: {', '.join(regresiones)}")
+            codigo = 1
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
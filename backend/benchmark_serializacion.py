@@ -0,0 +1,111 @@
+"""
+Benchmark del listado de casos: ruta ORM (/casos) contra modo ligero (/casos/lista)
+
+Atiende las peticiones en proceso con el TestClient y mide el tiempo de CPU
+del proceso por página (la base de datos corre en otro proceso, así que su
+tiempo no se cuenta). También mide por separado la serialización de la misma
+página y el tamaño de la respuesta con y sin gzip.
+
+Requiere datos: conviene llenar la base con generar_datos_sinteticos.py.
+
+Uso:
+    python benchmark_serializacion.py
+    python benchmark_serializacion.py --paginas 500 --limite 100
+"""
+import argparse
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+def _cpu_por_llamada(funcion, repeticiones: int, calentamiento: int = 10) -> float:
+    for _ in range(calentamiento):
+        funcion()
+    inicio = time.process_time()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.process_time() - inicio) / repeticiones * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CPU por página del listado de casos")
+    parser.add_argument("--paginas", type=int, default=200, help="Páginas medidas por variante")
+    parser.add_argument("--limite", type=int, default=100, help="Filas por página")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    from fastapi.testclient import TestClient
+    from pydantic import TypeAdapter
+    from sqlalchemy.orm import joinedload
+
+    import models
+    import schemas
+    import serializacion
+    import server
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        admin = db.query(models.Usuario).filter(
+            models.Usuario.rol == models.RolEnum.ADMINISTRADOR).first()
+        if admin is None or db.query(models.Caso.id).first() is None:
+            print("Se necesitan un administrador y casos; use generar_datos_sinteticos.py")
+            return 1
+        db.expunge(admin)
+    server.app.dependency_overrides[server.get_current_user] = lambda: admin
+    cliente = TestClient(server.app)
+    parametros = {"limit": args.limite}
+
+    print(f"CPU por página de {args.limite} filas ({args.paginas} páginas por variante)\n")
+    resultados = {}
+
+    # Petición completa: consulta, serialización y framework
+    for nombre, ruta in (("/api/casos", "/api/casos"), ("/api/casos/lista", "/api/casos/lista")):
+        resultados[nombre] = _cpu_por_llamada(
+            lambda: cliente.get(ruta, params=parametros, headers={"Accept-Encoding": "identity"}),
+            args.paginas)
+
+    # Solo la serialización de una página ya consultada
+    with SessionLocal() as db:
+        casos = db.query(models.Caso).options(
+            joinedload(models.Caso.paciente), joinedload(models.Caso.motivo_obj)
+        ).order_by(models.Caso.fecha_creacion.desc()).limit(args.limite).all()
+        filas = db.query(*server.COLUMNAS_LISTADO_CASOS).join(
+            models.Paciente, models.Paciente.id == models.Caso.paciente_id
+        ).join(
+            models.MotivoPQR, models.MotivoPQR.id == models.Caso.motivo_id
+        ).order_by(models.Caso.fecha_creacion.desc()).limit(args.limite).all()
+
+        # Lo que hace FastAPI con response_model=List[schemas.Caso]
+        adaptador_orm = TypeAdapter(List[schemas.Caso])
+
+        def serializar_orm():
+            validados = adaptador_orm.validate_python(casos, from_attributes=True)
+            return json.dumps(adaptador_orm.dump_python(validados, mode="json")).encode()
+
+        def serializar_ligero():
+            return serializacion.filas_a_json(server.adaptador_casos_listado, filas)
+
+        resultados["serialización ORM (response_model + json)"] = _cpu_por_llamada(serializar_orm, args.paginas)
+        motor = "orjson" if serializacion.orjson is not None else "TypeAdapter"
+        resultados[f"serialización ligera ({motor})"] = _cpu_por_llamada(serializar_ligero, args.paginas)
+        cuerpo_orm, cuerpo_ligero = serializar_orm(), serializar_ligero()
+
+    for nombre, ms in resultados.items():
+        print(f"  {nombre:<42}{ms:>8.2f} ms")
+    base, ligero = resultados["/api/casos"], resultados["/api/casos/lista"]
+    print(f"\nPetición completa: {base / ligero:.1f}x menos CPU en modo ligero")
+
+    print(f"\nTamaño de la página: {len(cuerpo_orm):,} bytes (ORM), {len(cuerpo_ligero):,} bytes (ligero), "
+          f"{len(gzip.compress(cuerpo_ligero, serializacion.GZIP_NIVEL)):,} bytes (ligero con gzip)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Caché de catálogos de referencia (motivos, departamentos, ciudades y nombres
+de usuarios)
+
+Los catálogos cambian muy poco y se leen en cada carga de formulario. Cada
+consulta se guarda ya serializada a JSON junto con su ETag, de modo que una
+petición con If-None-Match vigente se responde con 304 sin tocar la base de
+datos.
+
+La caché se invalida con `invalidar` desde los endpoints que modifican los
+catálogos; el evento `catalogo_actualizado` del bus propaga la invalidación a
+los demás workers. El TTL acota la desactualización de los catálogos que se
+cargan por fuera de la API (departamentos y ciudades vienen de init_db).
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import schemas
+from http_cache import etag_de
+from models import Ciudad, Departamento, MotivoPQR, Usuario
+
+CATALOGOS_TTL_SEGUNDOS = int(os.environ.get('CATALOGOS_TTL_SEGUNDOS', '3600'))
+
+CATALOGOS = ("motivos", "ubicaciones", "usuarios")
+
+class CacheCatalogos:
+    def __init__(self, ttl_segundos: int = CATALOGOS_TTL_SEGUNDOS):
+        self.ttl_segundos = ttl_segundos
+        # (catalogo, variante) -> (valor, expira)
+        self._datos: Dict[Tuple[str, Hashable], tuple] = {}
+        self._lock = threading.Lock()
+
+    def _obtener(self, catalogo: str, variante: Hashable, cargar: Callable[[], object]):
+        clave = (catalogo, variante)
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[1] > time.monotonic():
+                return entrada[0]
+        valor = cargar()
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl_segundos)
+        return valor
+
+    def _serializado(self, catalogo: str, variante: Hashable, consulta: Callable[[], list], esquema):
+        """(cuerpo JSON, ETag) de una consulta de catálogo"""
+        def cargar():
+            filas = [esquema.model_validate(fila).model_dump(mode="json") for fila in consulta()]
+            cuerpo = json.dumps(filas, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            return cuerpo, etag_de(cuerpo)
+        return self._obtener(catalogo, variante, cargar)
+
+    # ---------- catálogos ----------
+
+    def motivos(self, db: Session, activo: Optional[bool] = None):
+        def consulta():
+            query = db.query(MotivoPQR)
+            if activo is not None:
+                query = query.filter(MotivoPQR.activo == activo)
+            return query.order_by(MotivoPQR.orden).all()
+        return self._serializado("motivos", activo, consulta, schemas.MotivoPQR)
+
+    def departamentos(self, db: Session):
+        return self._serializado(
+            "ubicaciones", "departamentos",
+            lambda: db.query(Departamento).order_by(Departamento.nombre).all(),
+            schemas.Departamento
+        )
+
+    def ciudades(self, db: Session, departamento_id: Optional[int] = None):
+        def consulta():
+            query = db.query(Ciudad)
+            if departamento_id:
+                query = query.filter(Ciudad.departamento_id == departamento_id)
+            return query.order_by(Ciudad.nombre).all()
+        return self._serializado("ubicaciones", ("ciudades", departamento_id), consulta, schemas.Ciudad)
+
+    def nombres_usuarios(self, db: Session, ids: Iterable[Optional[int]]) -> Dict[int, str]:
+        """id -> nombre_completo de los usuarios indicados que existen"""
+        ids = {i for i in ids if i}
+        if not ids:
+            return {}
+
+        def cargar():
+            return dict(db.query(Usuario.id, Usuario.nombre_completo).all())
+
+        nombres = self._obtener("usuarios", "nombres", cargar)
+        faltantes = ids.difference(nombres)
+        if faltantes:
+            # Usuarios creados en otro worker cuyo evento aún no llega. Solo se
+            # consultan los que faltan: un id inexistente (p. ej. de un caso
+            # archivado o de la entrada de /casos/lote) no recarga la tabla
+            nuevos = dict(db.query(Usuario.id, Usuario.nombre_completo).filter(Usuario.id.in_(faltantes)).all())
+            if nuevos:
+                with self._lock:
+                    entrada = self._datos.get(("usuarios", "nombres"))
+                    if entrada is not None:
+                        self._datos[("usuarios", "nombres")] = ({**entrada[0], **nuevos}, entrada[1])
+                nombres = {**nombres, **nuevos}
+        return {i: nombres[i] for i in ids if i in nombres}
+
+    # ---------- invalidación ----------
+
+    def invalidar(self, catalogo: Optional[str] = None):
+        with self._lock:
+            if catalogo is None:
+                self._datos.clear()
+            else:
+                for clave in [c for c in self._datos if c[0] == catalogo]:
+                    del self._datos[clave]
+
+    def aplicar_evento(self, tipo: str, datos: dict):
+        """Oyente del bus de eventos"""
+        if tipo == "catalogo_actualizado":
+            self.invalidar(datos.get("catalogo"))
+
+cache_catalogos = CacheCatalogos()
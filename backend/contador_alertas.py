@@ -0,0 +1,69 @@
+"""
+Contador de alertas no leídas por usuario
+
+El valor se calcula una vez con un COUNT indexado y luego se mantiene con los
+eventos del bus (alerta creada/leída, reasignaciones, marcado masivo), así la
+campana de alertas no vuelve a consultar la base de datos en cada carga.
+Los administradores comparten la clave None (todas las alertas); cada agente
+tiene la suya (alertas de sus casos asignados).
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Alerta, Caso
+
+class ContadorAlertasNoLeidas:
+    def __init__(self, ttl_segundos: int = 300):
+        self.ttl_segundos = ttl_segundos
+        self._valores: Dict[Optional[int], Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, db: Session, agente_id: Optional[int]) -> int:
+        """No leídas de los casos de `agente_id`, o de todos los casos si es None"""
+        with self._lock:
+            entrada = self._valores.get(agente_id)
+            if entrada is not None and entrada[1] > time.monotonic():
+                return entrada[0]
+
+        consulta = db.query(func.count(Alerta.id)).filter(Alerta.leida == False)
+        if agente_id is not None:
+            consulta = consulta.join(Caso, Alerta.caso_id == Caso.id).filter(
+                Caso.agente_asignado_id == agente_id
+            )
+        valor = consulta.scalar()
+
+        with self._lock:
+            self._valores[agente_id] = (valor, time.monotonic() + self.ttl_segundos)
+        return valor
+
+    def invalidar(self):
+        with self._lock:
+            self._valores.clear()
+
+    def _ajustar(self, agente_id: Optional[int], delta: int):
+        entrada = self._valores.get(agente_id)
+        if entrada is not None:
+            self._valores[agente_id] = (max(0, entrada[0] + delta), entrada[1])
+
+    def aplicar_evento(self, tipo: str, datos: dict):
+        """Oyente del bus de eventos"""
+        if tipo in ("alerta_creada", "alerta_leida"):
+            delta = 1 if tipo == "alerta_creada" else -1
+            with self._lock:
+                self._ajustar(None, delta)
+                if datos.get("agente_asignado_id") is not None:
+                    self._ajustar(datos["agente_asignado_id"], delta)
+        elif tipo in ("alertas_leidas", "casos_archivados"):
+            self.invalidar()
+        elif tipo == "caso_actualizado" and "agente_anterior_id" in datos and \
+                datos["agente_anterior_id"] != datos.get("agente_asignado_id"):
+            # Las alertas del caso cambian de bandeja
+            with self._lock:
+                self._valores.pop(datos["agente_anterior_id"], None)
+                self._valores.pop(datos.get("agente_asignado_id"), None)
+
+contador_alertas = ContadorAlertasNoLeidas()
@@ -0,0 +1,239 @@
+"""
+Control de admisión de los endpoints embebidos (/api/embedded/*)
+
+Los endpoints de la vista embebida de OmniLeads no tienen autenticación. Una
+campaña mal configurada o una tormenta de reintentos podía agotar el pool de
+conexiones y dejar sin servicio a los agentes de la aplicación web.
+`MiddlewareAdmision` (ASGI puro) filtra esas peticiones antes del router:
+
+  - Cubos de tokens por IP de origen y por campaña (header
+    `X-Omnileads-Campana` o parámetro `campaign_id`). Cada cubo admite una
+    ráfaga de ADMISION_*_RAFAGA peticiones y se recarga a
+    ADMISION_*_POR_MINUTO. Una tasa en 0 desactiva ese límite. Si la campaña
+    rechaza la petición, el token de la IP se devuelve: una ráfaga de una
+    campaña no deja sin cupo al resto del tráfico de esa IP.
+  - Tope de peticiones embebidas en curso por proceso
+    (ADMISION_EMBEBIDO_CONCURRENCIA). Por defecto es la mitad de las
+    conexiones que puede abrir el pool, así que la otra mitad queda para las
+    rutas autenticadas aunque el tráfico embebido se dispare.
+
+Lo que no se admite recibe un 429 con Retry-After sin llegar a FastAPI ni a la
+base de datos. Los cubos viven en memoria; con ADMISION_REDIS_URL (requiere el
+paquete `redis`) se comparten entre workers y réplicas. Si Redis falla, se
+vuelve a los cubos en memoria. Los contadores se exponen en /metrics.
+
+El middleware corre en el event loop, así que el estado en memoria no necesita
+locks.
+"""
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+from database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+PREFIJO_EMBEBIDO = "/api/embedded/"
+
+ADMISION_IP_POR_MINUTO = float(os.environ.get('ADMISION_IP_POR_MINUTO', '300'))
+ADMISION_IP_RAFAGA = int(os.environ.get('ADMISION_IP_RAFAGA', '60'))
+ADMISION_CAMPANA_POR_MINUTO = float(os.environ.get('ADMISION_CAMPANA_POR_MINUTO', '600'))
+ADMISION_CAMPANA_RAFAGA = int(os.environ.get('ADMISION_CAMPANA_RAFAGA', '120'))
+ADMISION_EMBEBIDO_CONCURRENCIA = int(os.environ.get(
+    'ADMISION_EMBEBIDO_CONCURRENCIA', str(max(1, (DB_POOL_SIZE + DB_MAX_OVERFLOW) // 2))
+))  # 0 = sin tope
+# Header con la IP real cuando hay un proxy delante (p. ej. x-forwarded-for); vacío = IP de la conexión
+ADMISION_IP_HEADER = os.environ.get('ADMISION_IP_HEADER', '').strip().lower()
+ADMISION_MAX_CUBOS = int(os.environ.get('ADMISION_MAX_CUBOS', '10000'))
+ADMISION_REDIS_URL = os.environ.get('ADMISION_REDIS_URL') or None
+ADMISION_REDIS_TIMEOUT = float(os.environ.get('ADMISION_REDIS_TIMEOUT', '0.05'))
+
+HEADER_CAMPANA = b"x-omnileads-campana"
+
+class LimitadorMemoria:
+    """Cubos de tokens del proceso; se descartan los menos usados al pasar de `max_cubos`"""
+
+    def __init__(self, max_cubos: int = ADMISION_MAX_CUBOS):
+        self.max_cubos = max_cubos
+        self._cubos: "OrderedDict[str, list]" = OrderedDict()  # clave -> [tokens, instante]
+
+    def __len__(self):
+        return len(self._cubos)
+
+    async def tomar(self, clave: str, por_minuto: float, rafaga: int) -> float:
+        """Consume un token; devuelve 0 si lo había o los segundos hasta el siguiente"""
+        tasa = por_minuto / 60
+        ahora = time.monotonic()
+        cubo = self._cubos.get(clave)
+        if cubo is None:
+            # Un cubo descartado equivale a uno lleno, así que olvidarlo solo es más permisivo
+            cubo = self._cubos[clave] = [float(rafaga), ahora]
+            if len(self._cubos) > self.max_cubos:
+                self._cubos.popitem(last=False)
+        else:
+            self._cubos.move_to_end(clave)
+            cubo[0] = min(float(rafaga), cubo[0] + (ahora - cubo[1]) * tasa)
+            cubo[1] = ahora
+        if cubo[0] >= 1:
+            cubo[0] -= 1
+            return 0.0
+        return (1 - cubo[0]) / tasa
+
+    async def devolver(self, clave: str, rafaga: int):
+        """Devuelve el token de una petición que otro cubo rechazó"""
+        cubo = self._cubos.get(clave)
+        if cubo is not None:
+            cubo[0] = min(float(rafaga), cubo[0] + 1)
+
+# Mismo algoritmo que LimitadorMemoria, atómico en Redis
+_SCRIPT_CUBO = """
+local tasa, rafaga, ahora = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local cubo = redis.call('HMGET', KEYS[1], 't', 'i')
+local tokens = tonumber(cubo[1]) or rafaga
+local instante = tonumber(cubo[2]) or ahora
+tokens = math.min(rafaga, tokens + math.max(0, ahora - instante) * tasa)
+local espera = 0
+if tokens >= 1 then tokens = tokens - 1 else espera = (1 - tokens) / tasa end
+redis.call('HSET', KEYS[1], 't', tokens, 'i', ahora)
+redis.call('EXPIRE', KEYS[1], math.ceil(rafaga / tasa) + 1)
+return tostring(espera)
+"""
+
+_SCRIPT_DEVOLVER = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+if tokens then redis.call('HSET', KEYS[1], 't', math.min(tonumber(ARGV[1]), tokens + 1)) end
+return 0
+"""
+
+class LimitadorRedis:
+    """Cubos compartidos en Redis; ante un error usa los cubos en memoria del proceso"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis_asyncio
+        self._cliente = redis_asyncio.from_url(
+            url, socket_timeout=ADMISION_REDIS_TIMEOUT, socket_connect_timeout=ADMISION_REDIS_TIMEOUT
+        )
+        self._script = self._cliente.register_script(_SCRIPT_CUBO)
+        self._script_devolver = self._cliente.register_script(_SCRIPT_DEVOLVER)
+        self._local = LimitadorMemoria()
+        self._ultimo_aviso = 0.0
+
+    def __len__(self):
+        return len(self._local)
+
+    async def tomar(self, clave: str, por_minuto: float, rafaga: int) -> float:
+        try:
+            espera = await self._script(
+                keys=[f"logifarma:admision:{clave}"], args=[por_minuto / 60, rafaga, time.time()]
+            )
+            return float(espera)
+        except Exception as e:
+            estadisticas.errores_backend += 1
+            if time.monotonic() - self._ultimo_aviso > 60:
+                self._ultimo_aviso = time.monotonic()
+                logger.warning(f"Redis no disponible para el control de admisión, cubos en memoria: {e}")
+            return await self._local.tomar(clave, por_minuto, rafaga)
+
+    async def devolver(self, clave: str, rafaga: int):
+        try:
+            await self._script_devolver(keys=[f"logifarma:admision:{clave}"], args=[rafaga])
+        except Exception:
+            estadisticas.errores_backend += 1
+            await self._local.devolver(clave, rafaga)
+
+def _crear_limitador():
+    if ADMISION_REDIS_URL:
+        try:
+            return LimitadorRedis(ADMISION_REDIS_URL)
+        except ImportError:
+            logger.warning("ADMISION_REDIS_URL configurada pero el paquete redis no está instalado; "
+                           "cubos en memoria")
+    return LimitadorMemoria()
+
+class EstadisticasAdmision:
+    def __init__(self):
+        self.admitidas = 0
+        self.rechazos: Dict[str, int] = {"ip": 0, "campana": 0, "concurrencia": 0}
+        self.en_curso = 0
+        self.maximo_en_curso = 0
+        self.errores_backend = 0
+
+estadisticas = EstadisticasAdmision()
+limitador = _crear_limitador()
+
+def _ip_cliente(scope) -> str:
+    if ADMISION_IP_HEADER:
+        for nombre, valor in scope["headers"]:
+            if nombre == ADMISION_IP_HEADER.encode():
+                return valor.decode("latin-1").split(",")[0].strip()
+    cliente = scope.get("client")
+    return cliente[0] if cliente else "desconocida"
+
+def _campana(scope) -> Optional[str]:
+    for nombre, valor in scope["headers"]:
+        if nombre == HEADER_CAMPANA:
+            return valor.decode("latin-1").strip()[:100] or None
+    if scope.get("query_string"):
+        valores = parse_qs(scope["query_string"].decode("latin-1")).get("campaign_id")
+        if valores and valores[0].strip():
+            return valores[0].strip()[:100]
+    return None
+
+async def _rechazar(send, motivo: str, espera: float):
+    estadisticas.rechazos[motivo] += 1
+    cuerpo = json.dumps({"detail": "Demasiadas solicitudes, intente de nuevo en unos segundos"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(max(1, math.ceil(espera))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+class MiddlewareAdmision:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" \
+                or not scope["path"].startswith(PREFIJO_EMBEBIDO):
+            await self.app(scope, receive, send)
+            return
+
+        # El tope de concurrencia va primero: rechazar no consume tokens. El lugar
+        # se reserva antes de consultar los cubos, que pueden ceder el event loop
+        if 0 < ADMISION_EMBEBIDO_CONCURRENCIA <= estadisticas.en_curso:
+            await _rechazar(send, "concurrencia", 1)
+            return
+        estadisticas.en_curso += 1
+        try:
+            clave_ip = None
+            if ADMISION_IP_POR_MINUTO > 0:
+                clave_ip = f"ip:{_ip_cliente(scope)}"
+                espera = await limitador.tomar(clave_ip, ADMISION_IP_POR_MINUTO, ADMISION_IP_RAFAGA)
+                if espera:
+                    await _rechazar(send, "ip", espera)
+                    return
+            campana = _campana(scope)
+            if campana is not None and ADMISION_CAMPANA_POR_MINUTO > 0:
+                espera = await limitador.tomar(
+                    f"campana:{campana}", ADMISION_CAMPANA_POR_MINUTO, ADMISION_CAMPANA_RAFAGA)
+                if espera:
+                    if clave_ip is not None:
+                        await limitador.devolver(clave_ip, ADMISION_IP_RAFAGA)
+                    await _rechazar(send, "campana", espera)
+                    return
+
+            estadisticas.admitidas += 1
+            estadisticas.maximo_en_curso = max(estadisticas.maximo_en_curso, estadisticas.en_curso)
+            await self.app(scope, receive, send)
+        finally:
+            estadisticas.en_curso -= 1
@@ -0,0 +1,196 @@
+"""
+Bus de eventos en tiempo real para el stream SSE (/api/stream)
+
+Por defecto el bus es en memoria y solo reparte eventos dentro del proceso.
+Con EVENTOS_BACKEND=postgres los eventos se publican con NOTIFY y cada worker
+los recibe con LISTEN, de modo que un cliente conectado a cualquier worker
+ve los cambios hechos en los demás. El NOTIFY lo envía un hilo con su propia
+conexión, así que publicar desde un handler async no espera a la base de datos.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import select
+import threading
+from datetime import date, datetime
+from enum import Enum
+from typing import Callable, List, Optional, Set
+
+from sqlalchemy import text
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+EVENTOS_BACKEND = os.environ.get('EVENTOS_BACKEND', 'memoria')  # memoria o postgres
+CANAL_POSTGRES = "logifarma_eventos"
+
+# Eventos pendientes por cliente; si un cliente lento se llena, se descartan
+MAX_EVENTOS_POR_CLIENTE = 200
+
+def _serializar(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Enum):
+        return valor.value
+    raise TypeError(f"Tipo no serializable: {type(valor)}")
+
+class BusEventos:
+    def __init__(self, backend: str = EVENTOS_BACKEND):
+        self.backend = backend
+        self._suscriptores: Set[asyncio.Queue] = set()
+        self._oyentes: List[Callable[[str, dict], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._detener = threading.Event()
+        self._hilo_listen: Optional[threading.Thread] = None
+        self._hilo_notify: Optional[threading.Thread] = None
+        self._pendientes: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+
+    # ---------- ciclo de vida ----------
+
+    def iniciar(self):
+        """Debe llamarse desde el event loop (evento startup)"""
+        self._loop = asyncio.get_running_loop()
+        if self.backend == "postgres":
+            self._detener.clear()
+            self._hilo_listen = threading.Thread(target=self._escuchar_postgres, name="eventos-listen", daemon=True)
+            self._hilo_listen.start()
+            self._hilo_notify = threading.Thread(target=self._notificar_postgres, name="eventos-notify", daemon=True)
+            self._hilo_notify.start()
+        logger.info(f"Bus de eventos iniciado (backend: {self.backend})")
+
+    def detener(self):
+        self._detener.set()
+
+    # ---------- suscripción ----------
+
+    def suscribir(self) -> asyncio.Queue:
+        cola = asyncio.Queue(maxsize=MAX_EVENTOS_POR_CLIENTE)
+        self._suscriptores.add(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue):
+        self._suscriptores.discard(cola)
+
+    def agregar_oyente(self, oyente: Callable[[str, dict], None]):
+        """
+        Registra una función (tipo, datos) que recibe todos los eventos en el
+        event loop de este worker; con backend postgres incluye los de otros workers.
+        """
+        self._oyentes.append(oyente)
+
+    @property
+    def clientes_conectados(self) -> int:
+        return len(self._suscriptores)
+
+    # ---------- publicación ----------
+
+    def publicar(self, tipo: str, datos: dict):
+        """
+        Publica un evento; seguro desde el event loop o desde otros hilos. Con
+        backend postgres solo lo encola para el hilo de NOTIFY.
+        """
+        evento = json.dumps({"tipo": tipo, "datos": datos}, default=_serializar)
+        if self.backend == "postgres":
+            if self._hilo_notify is not None and self._hilo_notify.is_alive():
+                self._pendientes.put(evento)
+                return
+            # Fuera del servidor (scripts) no hay hilo: se notifica en línea
+            try:
+                with engine.connect() as conexion:
+                    conexion.execute(text("SELECT pg_notify(:canal, :evento)"),
+                                     {"canal": CANAL_POSTGRES, "evento": evento})
+                    conexion.commit()
+                return
+            except Exception as e:
+                # Sin NOTIFY se entrega al menos a los clientes de este worker
+                logger.error(f"Error publicando evento por NOTIFY: {e}")
+        self._entregar(evento)
+
+    def _entregar(self, evento: str):
+        if not self._suscriptores and not self._oyentes:
+            return
+        if self._loop is None:
+            # Fuera del servidor (scripts) no hay clientes, solo oyentes
+            self._encolar(evento)
+            return
+        if self._loop.is_closed():
+            # Eventos que llegan durante el apagado
+            return
+        self._loop.call_soon_threadsafe(self._encolar, evento)
+
+    def _encolar(self, evento: str):
+        if self._oyentes:
+            contenido = json.loads(evento)
+            for oyente in self._oyentes:
+                try:
+                    oyente(contenido["tipo"], contenido["datos"])
+                except Exception as e:
+                    logger.error(f"Error en oyente de eventos: {e}")
+        for cola in list(self._suscriptores):
+            try:
+                cola.put_nowait(evento)
+            except asyncio.QueueFull:
+                pass
+
+    # ---------- LISTEN/NOTIFY ----------
+
+    @staticmethod
+    def _conexion_dedicada():
+        conexion = engine.raw_connection()
+        driver = conexion.driver_connection
+        conexion.detach()  # conexión dedicada, fuera del pool
+        driver.autocommit = True
+        return driver
+
+    @staticmethod
+    def _cerrar(driver):
+        if driver is not None:
+            try:
+                driver.close()
+            except Exception:
+                pass
+
+    def _notificar_postgres(self):
+        """Envía los eventos encolados en orden; al detenerse vacía la cola"""
+        driver = None
+        while not (self._detener.is_set() and self._pendientes.empty()):
+            try:
+                evento = self._pendientes.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                if driver is None:
+                    driver = self._conexion_dedicada()
+                with driver.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_POSTGRES, evento))
+            except Exception as e:
+                # Sin NOTIFY se entrega al menos a los clientes de este worker
+                logger.error(f"Error publicando evento por NOTIFY: {e}")
+                self._entregar(evento)
+                self._cerrar(driver)
+                driver = None
+        self._cerrar(driver)
+
+    def _escuchar_postgres(self):
+        while not self._detener.is_set():
+            driver = None
+            try:
+                driver = self._conexion_dedicada()
+                with driver.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CANAL_POSTGRES}")
+                while not self._detener.is_set():
+                    if select.select([driver], [], [], 5.0) == ([], [], []):
+                        continue
+                    driver.poll()
+                    while driver.notifies:
+                        self._entregar(driver.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Conexión LISTEN perdida, reintentando: {e}")
+                self._detener.wait(5.0)
+            finally:
+                self._cerrar(driver)
+
+bus_eventos = BusEventos()
@@ -0,0 +1,363 @@
+"""
+Generador de datos sintéticos para pruebas de carga
+
+Llena la base con volúmenes realistas de pacientes, casos, interacciones y
+eventos de historial usando COPY de PostgreSQL. Las columnas se toman de las
+tablas de `models.py`. Las filas se generan en streaming, así que 20 millones
+de interacciones no se cargan en memoria.
+
+Los datos se agregan a los existentes: los ids continúan desde el máximo
+actual y los números RAD desde el último caso. Como los ids se asignan aquí y
+no con las secuencias, debe ejecutarse sin otras escrituras en la base. Se
+reutilizan los agentes y motivos que ya existen; si no hay, se crean unos
+sintéticos. Al terminar se ajustan las secuencias, se hace ANALYZE y se
+recalcula metricas_diarias.
+
+Uso:
+    python generar_datos_sinteticos.py --escala prueba
+    python generar_datos_sinteticos.py --escala completa      # 1M / 5M / 20M / 20M
+    python generar_datos_sinteticos.py --pacientes 1000 --casos 5000 --interacciones 0 --eventos 0
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import Integer, cast, func, text
+
+from database import SessionLocal, engine
+from archivo_casos import MODELOS_ARCHIVO
+from models import (
+    Caso, CasoArchivado, HistorialEvento, Interaccion, MarcaAgregacion, MotivoPQR, Paciente, RolEnum,
+    Usuario
+)
+
+ESCALAS = {
+    "prueba": {"pacientes": 10_000, "casos": 50_000, "interacciones": 200_000, "eventos": 200_000},
+    "mediana": {"pacientes": 100_000, "casos": 500_000, "interacciones": 2_000_000, "eventos": 2_000_000},
+    "completa": {"pacientes": 1_000_000, "casos": 5_000_000, "interacciones": 20_000_000, "eventos": 20_000_000},
+}
+
+NOMBRES = ("Ana", "Luis", "María", "Carlos", "Sofía", "Jorge", "Laura", "Andrés", "Diana", "Camilo",
+           "Valentina", "Julián", "Paula", "Santiago", "Natalia", "Felipe", "Carolina", "Diego")
+APELLIDOS = ("García", "Rodríguez", "Martínez", "López", "González", "Pérez", "Sánchez", "Ramírez",
+             "Torres", "Díaz", "Vargas", "Rojas", "Moreno", "Castro", "Ortiz", "Herrera", "Medina")
+UBICACIONES = (("Huila", "Neiva"), ("Huila", "Pitalito"), ("Tolima", "Ibagué"), ("Cundinamarca", "Bogotá"),
+               ("Antioquia", "Medellín"), ("Valle del Cauca", "Cali"), ("Caquetá", "Florencia"))
+MOTIVOS_SINTETICOS = ("Entrega de medicamentos", "Medicamento pendiente", "Cambio de dirección",
+                      "Autorización", "Queja por atención", "Información general")
+CAMPANAS = (("1", "Entrante PQR", "inbound"), ("2", "Seguimiento pendientes", "manual"),
+            ("3", "Encuesta satisfacción", "preview"))
+TIPOS_EVENTO = ("cambio_estado", "cambio_prioridad", "asignacion", "interaccion", "comentario")
+ESTADOS = ("ABIERTO", "EN_PROCESO", "CERRADO")
+PESOS_ESTADO = (20, 25, 55)
+PRIORIDADES = ("ALTA", "MEDIA", "BAJA")
+PESOS_PRIORIDAD = (15, 60, 25)
+
+FILAS_POR_REPORTE = 500_000
+
+
+class FlujoCopy:
+    """Archivo de solo lectura que entrega las líneas de un generador a COPY"""
+
+    def __init__(self, filas):
+        self._filas = filas
+        self._pendiente = b""
+
+    def read(self, tamano=-1):
+        partes = [self._pendiente]
+        largo = len(self._pendiente)
+        while tamano < 0 or largo < tamano:
+            try:
+                linea = next(self._filas)
+            except StopIteration:
+                break
+            partes.append(linea)
+            largo += len(linea)
+        datos = b"".join(partes)
+        if tamano < 0:
+            self._pendiente = b""
+            return datos
+        self._pendiente = datos[tamano:]
+        return datos[:tamano]
+
+
+def _linea(valores) -> bytes:
+    # Los valores generados no tienen tabs, saltos de línea ni barras invertidas
+    return ("\t".join("\\N" if v is None else str(v) for v in valores) + "\n").encode()
+
+
+def _fecha(segundos: float) -> str:
+    return datetime.fromtimestamp(segundos, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _copiar(conexion, modelo, columnas, filas, total: int):
+    """COPY de `filas` en la tabla del modelo, con progreso en consola"""
+    tabla = modelo.__table__
+    for columna in columnas:
+        tabla.c[columna]  # falla si la columna ya no existe en models.py
+    inicio = time.perf_counter()
+
+    def con_progreso():
+        for i, fila in enumerate(filas, 1):
+            if i % FILAS_POR_REPORTE == 0:
+                print(f"  {tabla.name}: {i:,}/{total:,} ({i / (time.perf_counter() - inicio):,.0f} filas/s)")
+            yield _linea(fila)
+
+    cursor = conexion.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {tabla.name} ({', '.join(columnas)}) FROM STDIN",
+            FlujoCopy(con_progreso()),
+            size=1 << 20,
+        )
+    finally:
+        cursor.close()
+    conexion.commit()
+    duracion = time.perf_counter() - inicio
+    print(f"{tabla.name}: {total:,} filas en {duracion:.1f}s ({total / max(duracion, 1e-9):,.0f} filas/s)")
+
+
+def _preparar_catalogos(db, agentes: int):
+    """Ids de agentes y motivos existentes; crea sintéticos si no hay"""
+    ids_agentes = [u.id for u in db.query(Usuario.id).filter(
+        Usuario.rol == RolEnum.AGENTE, Usuario.activo == True)]
+    if not ids_agentes:
+        for i in range(1, agentes + 1):
+            db.add(Usuario(
+                username=f"agente_sintetico_{i}", password_hash="!", nombre_completo=f"Agente Sintético {i}",
+                email=f"agente_sintetico_{i}@logifarma.local", rol=RolEnum.AGENTE, activo=True
+            ))
+        db.commit()
+        ids_agentes = [u.id for u in db.query(Usuario.id).filter(Usuario.username.like("agente_sintetico_%"))]
+
+    ids_motivos = [m.id for m in db.query(MotivoPQR.id).filter(MotivoPQR.activo == True)]
+    if not ids_motivos:
+        for orden, nombre in enumerate(MOTIVOS_SINTETICOS):
+            db.add(MotivoPQR(nombre=nombre, activo=True, orden=orden))
+        db.commit()
+        ids_motivos = [m.id for m in db.query(MotivoPQR.id)]
+    return ids_agentes, ids_motivos
+
+
+def _siguiente_id(db, modelo) -> int:
+    # Los ids archivados siguen ocupados
+    modelos = (modelo, MODELOS_ARCHIVO[modelo]) if modelo in MODELOS_ARCHIVO else (modelo,)
+    return max(db.query(func.max(m.id)).scalar() or 0 for m in modelos) + 1
+
+
+def _ultimo_rad(db) -> int:
+    return max(
+        db.query(func.max(cast(func.split_part(m.numero_caso, "-", 2), Integer))).filter(
+            m.numero_caso.op("~")("^RAD-[0-9]+$")
+        ).scalar() or 0
+        for m in (Caso, CasoArchivado)
+    )
+
+
+def generar(args):
+    rnd = random.Random(args.semilla)
+    ahora = time.time()
+    desde = ahora - args.dias * 86400
+
+    with SessionLocal() as db:
+        ids_agentes, ids_motivos = _preparar_catalogos(db, args.agentes)
+        primer_paciente = _siguiente_id(db, Paciente)
+        primer_caso = _siguiente_id(db, Caso)
+        primera_interaccion = _siguiente_id(db, Interaccion)
+        primer_evento = _siguiente_id(db, HistorialEvento)
+        primer_rad = _ultimo_rad(db) + 1
+
+    print(f"Agentes: {len(ids_agentes)}, motivos: {len(ids_motivos)}")
+
+    conexion = engine.raw_connection()
+    try:
+        def pacientes():
+            for i in range(args.pacientes):
+                departamento, ciudad = rnd.choice(UBICACIONES)
+                nombre, apellido = rnd.choice(NOMBRES), rnd.choice(APELLIDOS)
+                yield (
+                    primer_paciente + i, f"SIN{primer_paciente + i:010d}", nombre,
+                    f"{apellido} {rnd.choice(APELLIDOS)}", f"3{rnd.randrange(10**9):09d}",
+                    f"{nombre.lower()}.{primer_paciente + i}@correo.local" if rnd.random() < 0.4 else None,
+                    f"Calle {rnd.randint(1, 120)} # {rnd.randint(1, 99)}-{rnd.randint(1, 99)}",
+                    departamento, ciudad, _fecha(rnd.uniform(desde, ahora)),
+                )
+
+        _copiar(conexion, Paciente, ("id", "identificacion", "nombre", "apellidos", "celular", "email",
+                                     "direccion", "departamento", "ciudad", "fecha_registro"),
+                pacientes(), args.pacientes)
+
+        # Los casos se reparten entre los pacientes existentes y los nuevos
+        ids_pacientes = array("q")
+        cursor = conexion.cursor(name="ids_pacientes")
+        cursor.itersize = 100_000
+        cursor.execute("SELECT id FROM pacientes")
+        for (paciente_id,) in cursor:
+            ids_pacientes.append(paciente_id)
+        cursor.close()
+        conexion.commit()
+
+        # Fecha de creación de cada caso (segundos), para fechar interacciones y eventos
+        fechas_casos = array("d")
+
+        def casos():
+            # Se reparten en orden cronológico, como llegan en producción
+            paso = (ahora - desde) / max(args.casos, 1)
+            for i in range(args.casos):
+                creacion = desde + i * paso + rnd.uniform(0, paso)
+                fechas_casos.append(creacion)
+                estado = rnd.choices(ESTADOS, PESOS_ESTADO)[0]
+                cierre = horas = None
+                actualizacion = creacion + rnd.uniform(0, 3600)
+                if estado == "CERRADO":
+                    horas = rnd.expovariate(1 / 36)
+                    cierre = min(creacion + horas * 3600, ahora)
+                    horas = round((cierre - creacion) / 3600, 2)
+                    actualizacion = cierre
+                yield (
+                    primer_caso + i, f"RAD-{primer_rad + i}",
+                    ids_pacientes[rnd.randrange(len(ids_pacientes))],
+                    rnd.choice(ids_motivos), rnd.choices(PRIORIDADES, PESOS_PRIORIDAD)[0], estado,
+                    "Caso sintético para pruebas de carga", rnd.choice(ids_agentes),
+                    rnd.choice(ids_agentes) if rnd.random() < 0.9 else None,
+                    _fecha(creacion), _fecha(actualizacion), _fecha(cierre) if cierre else None, horas,
+                    "call" if rnd.random() < 0.6 else "web",
+                )
+
+        _copiar(conexion, Caso, ("id", "numero_caso", "paciente_id", "motivo_id", "prioridad", "estado",
+                                 "descripcion", "agente_creador_id", "agente_asignado_id", "fecha_creacion",
+                                 "fecha_actualizacion", "fecha_cierre", "tiempo_resolucion_horas", "origen"),
+                casos(), args.casos)
+
+        def caso_y_fecha():
+            i = rnd.randrange(len(fechas_casos))
+            fecha = fechas_casos[i] + rnd.expovariate(1 / 86400)
+            return primer_caso + i, min(fecha, ahora)
+
+        def interacciones():
+            for i in range(args.interacciones):
+                caso_id, fecha = caso_y_fecha()
+                campana_id, campana, tipo = rnd.choice(CAMPANAS)
+                agente = rnd.randrange(1, 50)
+                yield (
+                    primera_interaccion + i, caso_id, f"call-{primera_interaccion + i}", campana_id, campana, tipo,
+                    str(agente), f"agente{agente}", f"Agente {agente}", f"3{rnd.randrange(10**9):09d}",
+                    _fecha(fecha), f"rec-{primera_interaccion + i}.wav", None, _fecha(fecha),
+                )
+
+        if args.interacciones and fechas_casos:
+            _copiar(conexion, Interaccion, (
+                "id", "caso_id", "omnileads_call_id", "omnileads_campaign_id", "omnileads_campaign_name",
+                "omnileads_campaign_type", "agent_id", "agent_username", "agent_name", "telefono_contacto",
+                "datetime_llamada", "rec_filename", "observaciones", "fecha_registro"),
+                interacciones(), args.interacciones)
+
+        def eventos():
+            for i in range(args.eventos):
+                caso_id, fecha = caso_y_fecha()
+                tipo = rnd.choice(TIPOS_EVENTO)
+                anterior = nuevo = campo = datos = None
+                if tipo == "cambio_estado":
+                    campo, anterior, nuevo = "estado", "ABIERTO", rnd.choice(ESTADOS[1:])
+                elif tipo == "cambio_prioridad":
+                    campo, anterior, nuevo = "prioridad", "MEDIA", rnd.choice(PRIORIDADES)
+                elif tipo == "asignacion":
+                    campo, nuevo = "agente_asignado_id", str(rnd.choice(ids_agentes))
+                elif tipo == "interaccion":
+                    # Mismas claves que registra la vista embebida; sin escapes para COPY
+                    agente = rnd.randrange(1, 50)
+                    campo, nuevo = "llamada", f"Llamada Agente {agente}"
+                    datos = json.dumps({
+                        "agent_name": f"Agente {agente}", "campaign_name": rnd.choice(CAMPANAS)[1],
+                        "telefono": f"3{rnd.randrange(10**9):09d}",
+                    }, ensure_ascii=False)
+                yield (
+                    primer_evento + i, caso_id, rnd.choice(ids_agentes), tipo, campo, anterior, nuevo,
+                    "Evento sintético", _fecha(fecha), datos,
+                )
+
+        if args.eventos and fechas_casos:
+            _copiar(conexion, HistorialEvento, (
+                "id", "caso_id", "usuario_id", "tipo_evento", "campo_modificado", "valor_anterior",
+                "valor_nuevo", "comentario", "fecha_evento", "datos_adicionales"),
+                eventos(), args.eventos)
+    finally:
+        conexion.close()
+
+    with engine.begin() as con:
+        for modelo in (Paciente, Caso, Interaccion, HistorialEvento):
+            tabla = modelo.__table__.name
+            con.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {tabla}))"
+            ))
+    if args.interacciones and args.casos:
+        # COPY no pasa por registrar_interaccion: se calcula el resumen de los casos nuevos
+        import interacciones_caso
+        with SessionLocal() as db:
+            inicio = time.perf_counter()
+            corregidos = interacciones_caso.recalcular(db, desde_id=primer_caso)["casos"]
+            print(f"Resumen de interacciones: {corregidos} casos en {time.perf_counter() - inicio:.1f}s")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as con:
+        for modelo in (Paciente, Caso, Interaccion, HistorialEvento):
+            con.execute(text(f"ANALYZE {modelo.__table__.name}"))
+
+    if not args.sin_rollup:
+        # Los casos se insertan con fechas pasadas: el refresco incremental no
+        # los vería, así que se borra la marca y se recalcula todo
+        import rollup_metricas
+        with SessionLocal() as db:
+            db.query(MarcaAgregacion).filter(
+                MarcaAgregacion.nombre == rollup_metricas.MARCA_METRICAS_DIARIAS).delete()
+            db.commit()
+            inicio = time.perf_counter()
+            dias = rollup_metricas.refrescar_metricas_diarias(db)
+            print(f"metricas_diarias: {dias} días recalculados en {time.perf_counter() - inicio:.1f}s")
+        if args.interacciones:
+            import rollup_llamadas
+            with SessionLocal() as db:
+                db.query(MarcaAgregacion).filter(
+                    MarcaAgregacion.nombre == rollup_llamadas.MARCA_METRICAS_LLAMADAS).delete()
+                db.commit()
+                inicio = time.perf_counter()
+                dias = rollup_llamadas.refrescar_metricas_llamadas(db)
+                print(f"metricas_llamadas: {dias} días recalculados en {time.perf_counter() - inicio:.1f}s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos con COPY para pruebas de carga")
+    parser.add_argument("--escala", choices=sorted(ESCALAS), default="prueba",
+                        help="Volúmenes predefinidos (los argumentos explícitos tienen prioridad)")
+    for nombre in ("pacientes", "casos", "interacciones", "eventos"):
+        parser.add_argument(f"--{nombre}", type=int, help=f"Cantidad de {nombre} a generar")
+    parser.add_argument("--agentes", type=int, default=20, help="Agentes sintéticos si no hay ninguno")
+    parser.add_argument("--dias", type=int, default=730, help="Días de historia que cubren los casos")
+    parser.add_argument("--semilla", type=int, default=2024)
+    parser.add_argument("--sin-rollup", action="store_true", help="No recalcular metricas_diarias ni metricas_llamadas")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        parser.error("el generador usa COPY y requiere PostgreSQL")
+    for nombre, valor in ESCALAS[args.escala].items():
+        if getattr(args, nombre) is None:
+            setattr(args, nombre, valor)
+    if args.casos and not args.pacientes:
+        with SessionLocal() as db:
+            if not db.query(Paciente.id).first():
+                parser.error("no hay pacientes para asociar los casos; use --pacientes")
+
+    inicio = time.perf_counter()
+    generar(args)
+    print(f"\nDatos sintéticos generados en {time.perf_counter() - inicio:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
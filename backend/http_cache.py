@@ -0,0 +1,86 @@
+"""
+Validación condicional HTTP (ETag / If-None-Match, Last-Modified / If-Modified-Since)
+
+Las respuestas se sirven con `Cache-Control: no-cache`: el navegador guarda la
+copia pero la revalida en cada uso, y si el ETag no cambió recibe un 304 sin
+cuerpo.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+CACHE_CONTROL_REVALIDAR = "private, no-cache"
+
+def etag_de(contenido: bytes) -> str:
+    """ETag fuerte a partir del hash del contenido"""
+    return '"' + hashlib.sha1(contenido).hexdigest() + '"'
+
+def etag_de_version(*partes) -> str:
+    """ETag débil a partir de los valores que identifican la versión de un recurso"""
+    texto = "|".join("" if p is None else (p.isoformat() if isinstance(p, datetime) else str(p)) for p in partes)
+    return 'W/"' + hashlib.sha1(texto.encode("utf-8")).hexdigest() + '"'
+
+def coincide_etag(request: Request, etag: str) -> bool:
+    """True si el If-None-Match de la petición incluye el ETag (comparación débil)"""
+    encabezado = request.headers.get("if-none-match")
+    if not encabezado:
+        return False
+    if encabezado.strip() == "*":
+        return True
+    valor = etag.removeprefix("W/")
+    return any(
+        candidato.strip().removeprefix("W/") == valor
+        for candidato in encabezado.split(",")
+    )
+
+def respuesta_json(
+    request: Request,
+    cuerpo: bytes,
+    etag: Optional[str] = None,
+    cache_control: str = CACHE_CONTROL_REVALIDAR
+) -> Response:
+    """JSON ya serializado con ETag; 304 si el cliente tiene la misma versión"""
+    etag = etag or etag_de(cuerpo)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if coincide_etag(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+def _a_utc(fecha: datetime) -> datetime:
+    # Las fechas de la base de datos son UTC sin zona horaria
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.astimezone(timezone.utc)
+
+def no_modificado(request: Request, etag: str, ultima_modificacion: Optional[datetime] = None) -> bool:
+    """
+    True si la copia del cliente sigue vigente. If-Modified-Since solo se
+    evalúa cuando la petición no trae If-None-Match.
+    """
+    if "if-none-match" in request.headers:
+        return coincide_etag(request, etag)
+    encabezado = request.headers.get("if-modified-since")
+    if not encabezado or ultima_modificacion is None:
+        return False
+    try:
+        desde = parsedate_to_datetime(encabezado)
+    except (TypeError, ValueError):
+        return False
+    if desde.tzinfo is None:
+        desde = desde.replace(tzinfo=timezone.utc)
+    # HTTP-date tiene resolución de segundos
+    return _a_utc(ultima_modificacion).replace(microsecond=0) <= desde
+
+def validadores(etag: str, ultima_modificacion: Optional[datetime] = None,
+                cache_control: str = CACHE_CONTROL_REVALIDAR) -> dict:
+    """Headers ETag, Last-Modified y Cache-Control de una respuesta"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if ultima_modificacion is not None:
+        headers["Last-Modified"] = format_datetime(_a_utc(ultima_modificacion), usegmt=True)
+    return headers
+
+def respuesta_no_modificado(etag: str, ultima_modificacion: Optional[datetime] = None) -> Response:
+    return Response(status_code=304, headers=validadores(etag, ultima_modificacion))
@@ -0,0 +1,316 @@
+"""
+Claves de idempotencia (header `Idempotency-Key`) para las altas
+
+Cuando OmniLeads o el navegador agotan su timeout y reintentan `POST
+/api/casos`, `/api/embedded/caso` o `/api/interacciones`, el reintento creaba
+un caso duplicado: otro radicado, otro historial, otros eventos y alertas.
+`MiddlewareIdempotencia` (ASGI puro) atiende esas rutas cuando la petición trae
+el header:
+
+  - La primera petición con una clave la reserva en `claves_idempotencia`
+    (estado en_curso) en una transacción corta propia y se ejecuta. La ruta
+    llama a `confirmar` antes de su commit: la clave pasa a confirmada en la
+    misma transacción que el alta, así que nunca queda un alta hecha con la
+    clave libre. Si responde 2xx, el código y el cuerpo se guardan (completada)
+    antes de enviarlos. Si falla antes del commit, la reserva se borra y el
+    cliente puede reintentar con la misma clave.
+  - Una petición repetida recibe la respuesta guardada con el header
+    `Idempotent-Replayed: true`, sin volver a ejecutar la transacción del alta.
+  - Si la primera sigue en curso, la repetición recibe 409 con Retry-After.
+    Si el proceso murió entre el commit del alta y el guardado de la respuesta
+    (confirmada sin respuesta), recibe 409 sin Retry-After: el alta existe y no
+    se repite.
+  - Si la clave ya se usó con otra petición (otro cuerpo o URL), 422.
+
+La clave vale por ruta y por usuario (el `sub` del token; vacío en la vista
+embebida). Las claves completadas vencen a las IDEMPOTENCIA_TTL_HORAS y una
+reserva en curso a los IDEMPOTENCIA_EN_CURSO_SEGUNDOS (proceso caído); una clave
+vencida se puede volver a usar; una reserva que venció sin confirmarse
+corresponde a una petición que no hizo commit, así que repetirla es seguro. La
+tabla se comparte entre workers y réplicas; `purgar_expiradas` la mantiene
+compacta desde una tarea periódica. Los contadores se exponen en /metrics, y las
+respuestas que da el middleware se etiquetan con la ruta de la petición.
+"""
+import hashlib
+import json
+import logging
+import os
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from jose import JWTError, jwt
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from auth import ALGORITHM, SECRET_KEY
+from database import SessionLocal, engine
+from models import ClaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+RUTAS_IDEMPOTENTES = {
+    ("POST", "/api/casos"),
+    ("POST", "/api/embedded/caso"),
+    ("POST", "/api/interacciones"),
+}
+
+IDEMPOTENCIA_TTL_HORAS = int(os.environ.get('IDEMPOTENCIA_TTL_HORAS', '24'))
+# Debe superar la duración de la petición más lenta: al vencer, otra petición puede tomar la clave
+IDEMPOTENCIA_EN_CURSO_SEGUNDOS = int(os.environ.get('IDEMPOTENCIA_EN_CURSO_SEGUNDOS', '120'))
+
+HEADER_CLAVE = b"idempotency-key"
+MAX_LARGO_CLAVE = 255
+
+EN_CURSO = "en_curso"
+CONFIRMADA = "confirmada"  # el alta hizo commit; falta guardar la respuesta
+COMPLETADA = "completada"
+
+# (alcance, clave) reservados por la petición en curso, para `confirmar`
+_reserva: ContextVar[Optional[Tuple[str, str]]] = ContextVar("idempotencia_reserva", default=None)
+
+class EstadisticasIdempotencia:
+    def __init__(self):
+        # ejecutada: primera petición; repetida: respuesta guardada; en_curso: 409; distinta: 422
+        self.peticiones: Dict[str, int] = {"ejecutada": 0, "repetida": 0, "en_curso": 0, "distinta": 0}
+
+estadisticas = EstadisticasIdempotencia()
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _insert():
+    return pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+
+def reservar(alcance: str, clave: str, huella: str) -> Optional[ClaveIdempotencia]:
+    """
+    Reserva la clave para esta petición y devuelve None, o devuelve la fila
+    vigente de la petición que la usó antes.
+    """
+    with SessionLocal() as db:
+        for _ in range(3):
+            ahora = _ahora()
+            valores = {
+                "alcance": alcance, "clave": clave, "huella": huella, "estado": EN_CURSO,
+                "codigo_estado": None, "tipo_contenido": None, "respuesta": None, "fecha_creacion": ahora,
+                "fecha_expiracion": ahora + timedelta(seconds=IDEMPOTENCIA_EN_CURSO_SEGUNDOS),
+            }
+            sentencia = _insert()(ClaveIdempotencia).values(**valores)
+            # Una clave vencida (completada o reserva abandonada) se reemplaza
+            sentencia = sentencia.on_conflict_do_update(
+                index_elements=["alcance", "clave"],
+                set_={c: sentencia.excluded[c] for c in valores if c not in ("alcance", "clave")},
+                where=ClaveIdempotencia.fecha_expiracion <= ahora,
+            ).returning(ClaveIdempotencia.clave)
+            reservada = db.execute(sentencia).first() is not None
+            db.commit()
+            if reservada:
+                return None
+            fila = db.get(ClaveIdempotencia, (alcance, clave))
+            if fila is not None:
+                db.expunge(fila)
+                return fila
+            # La purga la borró entre las dos sentencias: se intenta de nuevo
+        raise RuntimeError("No se pudo reservar la clave de idempotencia")
+
+def confirmar(db: Session):
+    """
+    Marca la clave de la petición en curso como confirmada en la transacción de
+    `db`; las rutas idempotentes la llaman justo antes de su commit. Sin
+    Idempotency-Key no hace nada.
+    """
+    reserva = _reserva.get()
+    if reserva is None:
+        return
+    alcance, clave = reserva
+    db.execute(update(ClaveIdempotencia).where(
+        ClaveIdempotencia.alcance == alcance, ClaveIdempotencia.clave == clave
+    ).values(estado=CONFIRMADA, fecha_expiracion=_ahora() + timedelta(hours=IDEMPOTENCIA_TTL_HORAS)))
+
+def guardar(alcance: str, clave: str, codigo_estado: int, tipo_contenido: Optional[str], respuesta: bytes):
+    """Completa la reserva con la respuesta que recibirán las repeticiones"""
+    with SessionLocal() as db:
+        db.execute(update(ClaveIdempotencia).where(
+            ClaveIdempotencia.alcance == alcance, ClaveIdempotencia.clave == clave
+        ).values(
+            estado=COMPLETADA, codigo_estado=codigo_estado, tipo_contenido=tipo_contenido,
+            respuesta=respuesta, fecha_expiracion=_ahora() + timedelta(hours=IDEMPOTENCIA_TTL_HORAS)
+        ))
+        db.commit()
+
+def liberar(alcance: str, clave: str):
+    """Borra la reserva de una petición que no llegó a confirmarse"""
+    with SessionLocal() as db:
+        db.execute(delete(ClaveIdempotencia).where(
+            ClaveIdempotencia.alcance == alcance, ClaveIdempotencia.clave == clave,
+            ClaveIdempotencia.estado == EN_CURSO
+        ))
+        db.commit()
+
+def purgar_expiradas(db: Session) -> int:
+    """Borra las claves vencidas; para la tarea periódica"""
+    borradas = db.execute(delete(ClaveIdempotencia).where(
+        ClaveIdempotencia.fecha_expiracion < _ahora()
+    )).rowcount
+    db.commit()
+    if borradas:
+        logger.info(f"claves_idempotencia: {borradas} claves vencidas borradas")
+    return borradas
+
+def _usuario(scope) -> str:
+    """`sub` del token Bearer, sin consultar la base; vacío si no hay o no es válido"""
+    for nombre, valor in scope["headers"]:
+        if nombre == b"authorization":
+            partes = valor.decode("latin-1").split(" ", 1)
+            if len(partes) == 2 and partes[0].lower() == "bearer":
+                try:
+                    return str(jwt.decode(partes[1], SECRET_KEY, algorithms=[ALGORITHM]).get("sub") or "")
+                except JWTError:
+                    # La ruta responde 401 y la reserva se libera
+                    return ""
+    return ""
+
+def _clave(scope) -> Optional[str]:
+    for nombre, valor in scope["headers"]:
+        if nombre == HEADER_CLAVE:
+            return valor.decode("latin-1").strip()
+    return None
+
+def _huella(scope, cuerpo: bytes) -> str:
+    digesto = hashlib.sha256()
+    for parte in (scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), cuerpo):
+        digesto.update(parte)
+        digesto.update(b"\0")
+    return digesto.hexdigest()
+
+def _etiquetar_ruta(scope):
+    """Deja la ruta en el scope, como el router, para /metrics y el perfilado"""
+    app = scope.get("app")
+    if app is None or "route" in scope:
+        return
+    for ruta in app.router.routes:
+        if getattr(ruta, "path", None) == scope["path"] and scope["method"] in getattr(ruta, "methods", ()):
+            scope["route"] = ruta
+            return
+
+async def _responder(send, status: int, cuerpo: bytes, tipo_contenido: str = "application/json", extra=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", tipo_contenido.encode("latin-1")),
+            (b"content-length", str(len(cuerpo)).encode()),
+            *extra,
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+async def _error(send, status: int, detalle: str, extra=()):
+    await _responder(send, status, json.dumps({"detail": detalle}).encode(), extra=extra)
+
+class MiddlewareIdempotencia:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in RUTAS_IDEMPOTENTES:
+            await self.app(scope, receive, send)
+            return
+        clave = _clave(scope)
+        if clave is None:
+            await self.app(scope, receive, send)
+            return
+        if not clave or len(clave) > MAX_LARGO_CLAVE:
+            _etiquetar_ruta(scope)
+            await _error(send, 400, f"Idempotency-Key inválida: debe tener entre 1 y {MAX_LARGO_CLAVE} caracteres")
+            return
+
+        # El cuerpo completo entra en la huella; luego se le entrega a la ruta tal cual
+        partes = []
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "http.disconnect":
+                return
+            partes.append(mensaje.get("body", b""))
+            if not mensaje.get("more_body"):
+                break
+        cuerpo = b"".join(partes)
+
+        alcance = f"{scope['method']} {scope['path']} {_usuario(scope)}"[:150]
+        huella = _huella(scope, cuerpo)
+        anterior = await run_in_threadpool(reservar, alcance, clave, huella)
+        if anterior is not None:
+            _etiquetar_ruta(scope)
+            if anterior.huella != huella:
+                estadisticas.peticiones["distinta"] += 1
+                await _error(send, 422, "La Idempotency-Key ya se usó con una petición distinta")
+            elif anterior.estado == EN_CURSO or (
+                    anterior.estado == CONFIRMADA
+                    and anterior.fecha_creacion > _ahora() - timedelta(seconds=IDEMPOTENCIA_EN_CURSO_SEGUNDOS)):
+                estadisticas.peticiones["en_curso"] += 1
+                await _error(send, 409, "Hay una petición en curso con esta Idempotency-Key",
+                             extra=[(b"retry-after", b"1")])
+            elif anterior.estado == CONFIRMADA:
+                estadisticas.peticiones["en_curso"] += 1
+                await _error(send, 409, "La petición con esta Idempotency-Key ya se procesó, "
+                                        "pero su respuesta no está disponible")
+            else:
+                estadisticas.peticiones["repetida"] += 1
+                await _responder(send, anterior.codigo_estado, anterior.respuesta,
+                                 anterior.tipo_contenido or "application/json",
+                                 extra=[(b"idempotent-replayed", b"true")])
+            return
+        estadisticas.peticiones["ejecutada"] += 1
+
+        entregado = False
+
+        async def recibir():
+            nonlocal entregado
+            if not entregado:
+                entregado = True
+                return {"type": "http.request", "body": cuerpo, "more_body": False}
+            return await receive()
+
+        # La respuesta se retiene hasta guardarla: un cliente que ya se fue la recibe al reintentar
+        inicio = None
+        respuesta = []
+
+        async def capturar(mensaje):
+            nonlocal inicio
+            if mensaje["type"] == "http.response.start":
+                inicio = mensaje
+            elif mensaje["type"] == "http.response.body":
+                respuesta.append(mensaje.get("body", b""))
+
+        token = _reserva.set((alcance, clave))
+        try:
+            await self.app(scope, recibir, capturar)
+        except Exception:
+            await self._liberar(alcance, clave)
+            raise
+        finally:
+            _reserva.reset(token)
+
+        codigo = inicio["status"]
+        contenido = b"".join(respuesta)
+        try:
+            if 200 <= codigo < 300:
+                tipo = dict(inicio.get("headers", [])).get(b"content-type", b"").decode("latin-1") or None
+                await run_in_threadpool(guardar, alcance, clave, codigo, tipo, contenido)
+            else:
+                await run_in_threadpool(liberar, alcance, clave)
+        except Exception as e:
+            # Una reserva sin confirmar vence a los IDEMPOTENCIA_EN_CURSO_SEGUNDOS
+            logger.error(f"No se pudo guardar la clave de idempotencia {clave}: {e}")
+        await send(inicio)
+        await send({"type": "http.response.body", "body": contenido})
+
+    @staticmethod
+    async def _liberar(alcance: str, clave: str):
+        try:
+            await run_in_threadpool(liberar, alcance, clave)
+        except Exception as e:
+            logger.error(f"No se pudo liberar la clave de idempotencia {clave}: {e}")
@@ -0,0 +1,579 @@
+"""
+Importación masiva del histórico de PQR (pacientes y casos)
+
+Carga archivos CSV o XLSX con una fila por caso y los datos del paciente en la
+misma fila. El encabezado se reconoce sin importar mayúsculas ni tildes:
+
+    identificacion*, nombre, apellidos, celular, email, direccion, departamento,
+    ciudad, motivo*, fecha_creacion*, fecha_cierre, estado, prioridad,
+    descripcion, origen, agente, radicado_anterior
+
+Las fechas se interpretan en hora local (ZONA_HORARIA). El motivo se busca por
+nombre y el agente asignado por username, sin importar mayúsculas ni tildes; un
+agente desconocido deja el caso sin asignar. Las filas con motivo desconocido o
+datos inválidos se rechazan y se informan, sin detener la carga.
+
+El archivo se lee en streaming y se procesa por lotes de IMPORTACION_LOTE
+filas, cada uno en una transacción:
+
+  1. COPY de las filas validadas a una tabla temporal.
+  2. Upsert de pacientes por identificación en una sola sentencia. Los
+     existentes solo completan los datos vacíos: los del sistema son más
+     recientes que los del histórico.
+  3. Bloque de números RAD reservado bajo el advisory lock de numeración
+     (ver numeracion.py), el mismo que toma `generar_numero_caso` en cada alta.
+  4. INSERT ... SELECT de casos, historial_estados y el evento de creación
+     (con la fila y el radicado anterior en datos_adicionales).
+  5. Avance guardado en `importaciones` en la misma transacción.
+
+Volver a cargar el mismo archivo (misma huella SHA-256) reanuda una
+importación interrumpida desde la última fila confirmada; un archivo ya
+importado no se vuelve a cargar salvo con --forzar. Antes de cada lote se crean
+las particiones mensuales de historial_eventos que falten y al terminar se
+recalculan los días afectados de metricas_diarias; el evento del bus descarta
+esos días de la caché de tendencia de los workers (entre procesos, con
+EVENTOS_BACKEND=postgres; si no, vencen con CACHE_TENDENCIA_TTL). Los casos cerrados antiguos
+pasan al archivo en la siguiente ejecución de archivo_casos.
+
+Requiere PostgreSQL.
+
+Uso:
+    python importar_historico.py historico.csv
+    python importar_historico.py historico.xlsx --hoja PQR --usuario admin
+    python importar_historico.py historico.csv --separador ";" --codificacion latin-1 --lote 20000
+"""
+import argparse
+import codecs
+import csv
+import hashlib
+import io
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import (
+    Column, DateTime, Float, Integer, MetaData, String, Table, Text, and_, cast, func, insert, literal,
+    literal_column, or_, select, text, update
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database import engine
+from models import (
+    Caso, EstadoCasoEnum, HistorialEstado, HistorialEvento, Importacion, MotivoPQR, Paciente, PrioridadEnum,
+    Usuario
+)
+import numeracion
+import particiones
+import periodos
+import rollup_metricas
+
+logger = logging.getLogger(__name__)
+
+IMPORTACION_LOTE = int(os.environ.get('IMPORTACION_LOTE', '10000'))
+
+# Filas rechazadas que se guardan con su motivo en importaciones.errores
+MAX_ERRORES_GUARDADOS = 100
+
+# pg_try_advisory_lock: una sola importación a la vez
+CLAVE_BLOQUEO_IMPORTACION = 7301004
+
+COLUMNAS_PACIENTE = ("nombre", "apellidos", "celular", "email", "direccion", "departamento", "ciudad")
+
+COLUMNAS = (
+    "identificacion", *COLUMNAS_PACIENTE, "motivo", "fecha_creacion", "fecha_cierre", "estado", "prioridad",
+    "descripcion", "origen", "agente", "radicado_anterior",
+)
+OBLIGATORIAS = ("identificacion", "motivo", "fecha_creacion")
+
+# Encabezados habituales en las exportaciones del sistema anterior
+ALIAS = {
+    "cedula": "identificacion",
+    "documento": "identificacion",
+    "apellido": "apellidos",
+    "telefono": "celular",
+    "correo": "email",
+    "motivo_pqr": "motivo",
+    "fecha": "fecha_creacion",
+    "agente_asignado": "agente",
+    "radicado": "radicado_anterior",
+    "numero_caso": "radicado_anterior",
+}
+
+# dd/mm/aaaa [hh:mm[:ss]], el formato de las exportaciones en español; ISO se lee con fromisoformat
+FECHA_DMA = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+
+ORIGENES = ("web", "call")
+
+# Largo de las columnas de texto de pacientes; los valores más largos se recortan
+LARGOS_PACIENTE = {
+    c.name: getattr(c.type, "length", None) for c in Paciente.__table__.columns if c.name in COLUMNAS
+}
+
+# Filas del lote en curso; ON COMMIT DELETE ROWS la vacía al confirmar cada lote
+filas_importacion = Table(
+    "importacion_filas", MetaData(),
+    Column("fila", Integer, primary_key=True),
+    *[Column(c, Text) for c in ("identificacion", *COLUMNAS_PACIENTE, "estado", "prioridad", "descripcion",
+                                "origen", "radicado_anterior")],
+    Column("fecha_creacion", DateTime),
+    Column("fecha_cierre", DateTime),
+    Column("fecha_actualizacion", DateTime),
+    Column("tiempo_resolucion_horas", Float),
+    Column("motivo_id", Integer),
+    Column("agente_id", Integer),
+    Column("paciente_id", Integer),
+    Column("numero_caso", String(50)),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DELETE ROWS",
+)
+
+COLUMNAS_COPY = (
+    "fila", "identificacion", *COLUMNAS_PACIENTE, "estado", "prioridad", "descripcion", "origen",
+    "radicado_anterior", "fecha_creacion", "fecha_cierre", "fecha_actualizacion", "tiempo_resolucion_horas",
+    "motivo_id", "agente_id",
+)
+
+class ImportacionEnCurso(Exception):
+    """Otra importación tiene el lock"""
+
+# ==================== LECTURA DEL ARCHIVO ====================
+
+def _clave(texto) -> str:
+    """Texto sin tildes, en minúsculas y con los espacios normalizados, para comparar nombres"""
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode()
+    return " ".join(texto.lower().split())
+
+def _normalizar_encabezado(nombre) -> str:
+    nombre = _clave(nombre).replace(" ", "_")
+    return ALIAS.get(nombre, nombre)
+
+def _filas_csv(archivo: BinaryIO, separador: Optional[str], codificacion: str) -> Iterator[list]:
+    if separador is None:
+        muestra = archivo.read(64 * 1024).decode(codificacion, errors="ignore")
+        archivo.seek(0)
+        try:
+            separador = csv.Sniffer().sniff(muestra, delimiters=",;\t|").delimiter
+        except csv.Error:
+            separador = ","
+    # codecs y no TextIOWrapper, que cierra el archivo de quien lo abrió al liberarse
+    return csv.reader(codecs.getreader(codificacion)(archivo), delimiter=separador)
+
+def _filas_xlsx(archivo: BinaryIO, hoja: Optional[str]) -> Iterator[tuple]:
+    # Importación diferida, como en reportes_service (ver perfil_arranque.py)
+    from openpyxl import load_workbook
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        if hoja and hoja not in libro.sheetnames:
+            raise ValueError(f"El libro no tiene la hoja {hoja}")
+        yield from (libro[hoja] if hoja else libro.active).iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+def leer_registros(archivo: BinaryIO, nombre_archivo: str, hoja: Optional[str] = None,
+                   separador: Optional[str] = None, codificacion: str = "utf-8-sig") -> Iterator[Dict[str, object]]:
+    """
+    Registros del archivo (columna -> valor) en streaming; omite las filas
+    vacías. El encabezado se valida al llamarla.
+    """
+    extension = Path(nombre_archivo).suffix.lower()
+    if extension in (".xlsx", ".xlsm"):
+        filas = _filas_xlsx(archivo, hoja)
+    elif extension in (".csv", ".txt"):
+        filas = _filas_csv(archivo, separador, codificacion)
+    else:
+        raise ValueError("Formato no soportado: use CSV o XLSX")
+
+    encabezado = [_normalizar_encabezado(c) for c in next(filas, [])]
+    faltantes = [c for c in OBLIGATORIAS if c not in encabezado]
+    if faltantes:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+    return (
+        {c: v for c, v in zip(encabezado, valores) if c in COLUMNAS}
+        for valores in filas
+        if any(v is not None and str(v).strip() != "" for v in valores)
+    )
+
+def _texto(valor, largo: Optional[int] = None) -> Optional[str]:
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        # Celdas numéricas de Excel (cédulas, celulares)
+        valor = int(valor)
+    texto = str(valor).strip()
+    if not texto:
+        return None
+    return texto[:largo] if largo else texto
+
+def _fecha(valor, campo: str) -> Optional[datetime]:
+    """Fecha local del archivo -> UTC sin zona"""
+    if valor is None or str(valor).strip() == "":
+        return None
+    if isinstance(valor, datetime):
+        fecha = valor
+    elif isinstance(valor, date):
+        fecha = datetime.combine(valor, datetime.min.time())
+    else:
+        texto = str(valor).strip()
+        # Sin strptime, que es lo más lento de preparar cada fila
+        partes = FECHA_DMA.fullmatch(texto)
+        try:
+            if partes:
+                dia, mes, anio, hora, minuto, segundo = (int(p or 0) for p in partes.groups())
+                fecha = datetime(anio, mes, dia, hora, minuto, segundo)
+            else:
+                fecha = datetime.fromisoformat(texto)
+        except ValueError:
+            raise ValueError(f"{campo} no válida: {texto}")
+    return periodos.local_a_utc(fecha)
+
+def catalogos(db: Session) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Ids de motivos por nombre y de agentes por username, con las claves de _clave"""
+    motivos = {_clave(m.nombre): m.id for m in db.query(MotivoPQR.id, MotivoPQR.nombre)}
+    agentes = {_clave(u.username): u.id for u in db.query(Usuario.id, Usuario.username)}
+    return motivos, agentes
+
+def preparar_registro(registro: Dict[str, object], fila: int, motivos: Dict[str, int],
+                      agentes: Dict[str, int]) -> dict:
+    """Valida y normaliza un registro; ValueError con el motivo si se rechaza"""
+    identificacion = _texto(registro.get("identificacion"))
+    if not identificacion:
+        raise ValueError("Falta la identificación")
+    if len(identificacion) > LARGOS_PACIENTE["identificacion"]:
+        raise ValueError("La identificación es demasiado larga")
+    motivo = _texto(registro.get("motivo"))
+    if not motivo:
+        raise ValueError("Falta el motivo")
+    motivo_id = motivos.get(_clave(motivo))
+    if motivo_id is None:
+        raise ValueError(f"Motivo no encontrado: {motivo}")
+    creacion = _fecha(registro.get("fecha_creacion"), "Fecha de creación")
+    if creacion is None:
+        raise ValueError("Falta la fecha de creación")
+    cierre = _fecha(registro.get("fecha_cierre"), "Fecha de cierre")
+
+    estado = (_texto(registro.get("estado")) or ("CERRADO" if cierre else "ABIERTO")).upper().replace(" ", "_")
+    if estado not in EstadoCasoEnum.__members__:
+        raise ValueError(f"Estado no válido: {estado}")
+    if estado != EstadoCasoEnum.CERRADO.value:
+        cierre = None
+    elif cierre is not None and cierre < creacion:
+        raise ValueError("La fecha de cierre es anterior a la de creación")
+    prioridad = (_texto(registro.get("prioridad")) or PrioridadEnum.MEDIA.value).upper()
+    if prioridad not in PrioridadEnum.__members__:
+        raise ValueError(f"Prioridad no válida: {prioridad}")
+    origen = (_texto(registro.get("origen")) or "web").lower()
+    if origen not in ORIGENES:
+        raise ValueError(f"Origen no válido: {origen}")
+
+    return {
+        "fila": fila,
+        "identificacion": identificacion,
+        **{c: _texto(registro.get(c), LARGOS_PACIENTE[c]) for c in COLUMNAS_PACIENTE},
+        "estado": estado,
+        "prioridad": prioridad,
+        "descripcion": _texto(registro.get("descripcion")) or "Caso importado del histórico sin descripción",
+        "origen": origen,
+        "radicado_anterior": _texto(registro.get("radicado_anterior"), 100),
+        "fecha_creacion": creacion,
+        "fecha_cierre": cierre,
+        "fecha_actualizacion": cierre or creacion,
+        "tiempo_resolucion_horas": (cierre - creacion).total_seconds() / 3600 if cierre else None,
+        "motivo_id": motivo_id,
+        "agente_id": agentes.get(_clave(registro.get("agente"))),
+    }
+
+def _lotes(registros: Iterator[Dict[str, object]], saltar: int, lote: int, motivos: Dict[str, int],
+           agentes: Dict[str, int]) -> Iterator[Tuple[List[dict], List[dict], int]]:
+    """(filas válidas, rechazadas, filas leídas) por lote, desde la fila `saltar` + 1"""
+    validas, rechazadas, leidas = [], [], 0
+    for fila, registro in enumerate(registros, 1):
+        if fila <= saltar:
+            continue
+        try:
+            validas.append(preparar_registro(registro, fila, motivos, agentes))
+        except ValueError as e:
+            rechazadas.append({"fila": fila, "error": str(e)})
+        leidas += 1
+        if leidas == lote:
+            yield validas, rechazadas, leidas
+            validas, rechazadas, leidas = [], [], 0
+    if leidas:
+        yield validas, rechazadas, leidas
+
+# ==================== CARGA POR LOTES ====================
+
+def _asegurar_particiones(db: Session, validas: List[dict], meses: set):
+    """Meses de historial_eventos que necesita el lote; en su propia transacción, antes del lote"""
+    faltantes = {particiones.inicio_mes(f["fecha_creacion"].date()) for f in validas} - meses
+    if not faltantes:
+        return
+    conexion = db.connection()
+    if particiones.es_particionada(conexion, "historial_eventos"):
+        conexion.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": particiones.CLAVE_BLOQUEO_PARTICIONES})
+        particiones.crear_particiones(
+            conexion, "historial_eventos", min(faltantes), particiones.sumar_meses(max(faltantes), 1)
+        )
+    db.commit()
+    meses.update(faltantes)
+
+def _copiar(db: Session, validas: List[dict]):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for f in validas:
+        escritor.writerow(["" if f[c] is None else f[c] for c in COLUMNAS_COPY])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        # En formato CSV un campo vacío sin comillas es NULL
+        cursor.copy_expert(
+            f"COPY {filas_importacion.name} ({', '.join(COLUMNAS_COPY)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+def _cargar_lote(db: Session, importacion: Importacion, validas: List[dict]) -> dict:
+    """Pacientes, casos e historial de las filas válidas del lote; no hace commit"""
+    f = filas_importacion.c
+    _copiar(db, validas)
+    db.execute(text(f"ANALYZE {filas_importacion.name}"))
+
+    # Pacientes: los datos del caso más reciente de cada identificación; la
+    # fecha de registro es la de su primer caso
+    origen_pacientes = select(
+        f.identificacion,
+        *[(f[c] if c == "email" else func.coalesce(f[c], "")).label(c) for c in COLUMNAS_PACIENTE],
+        func.min(f.fecha_creacion).over(partition_by=f.identificacion),
+        literal(importacion.usuario_id),
+    ).distinct(f.identificacion).order_by(f.identificacion, f.fecha_creacion.desc())
+    upsert = pg_insert(Paciente).from_select(
+        ["identificacion", *COLUMNAS_PACIENTE, "fecha_registro", "actualizado_por"], origen_pacientes
+    )
+    pacientes = Paciente.__table__.c
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[Paciente.identificacion],
+        set_={c: func.coalesce(func.nullif(pacientes[c], ""), upsert.excluded[c]) for c in COLUMNAS_PACIENTE},
+        where=or_(*[
+            and_(func.coalesce(pacientes[c], "") == "", func.coalesce(upsert.excluded[c], "") != "")
+            for c in COLUMNAS_PACIENTE
+        ])
+    ).returning(literal_column("xmax = 0"))
+    insertados = db.execute(upsert).scalars().all()
+    db.execute(update(filas_importacion).values(paciente_id=Paciente.id).where(
+        Paciente.identificacion == f.identificacion))
+
+    # Bloque de números RAD: las altas esperan el lock hasta el commit del lote
+    numeracion.bloquear_numeracion(db)
+    ultimo = numeracion.ultimo_numero_rad(db)
+    orden = select(f.fila, func.row_number().over(order_by=f.fila).label("n")).subquery()
+    db.execute(update(filas_importacion).values(
+        numero_caso=func.concat("RAD-", orden.c.n + ultimo)
+    ).where(f.fila == orden.c.fila))
+
+    casos_creados = db.execute(insert(Caso).from_select(
+        ["numero_caso", "paciente_id", "motivo_id", "prioridad", "estado", "descripcion", "agente_creador_id",
+         "agente_asignado_id", "fecha_creacion", "fecha_actualizacion", "fecha_cierre", "tiempo_resolucion_horas",
+         "origen"],
+        select(
+            f.numero_caso, f.paciente_id, f.motivo_id, cast(f.prioridad, Caso.prioridad.type),
+            cast(f.estado, Caso.estado.type), f.descripcion, literal(importacion.usuario_id), f.agente_id,
+            f.fecha_creacion, f.fecha_actualizacion, f.fecha_cierre, f.tiempo_resolucion_horas, f.origen
+        ).order_by(f.fila)
+    )).rowcount
+
+    # Historial de creación, como en crear_caso, con la fecha original
+    creados = select(Caso.id, filas_importacion).join_from(
+        filas_importacion, Caso, Caso.numero_caso == f.numero_caso).subquery()
+    db.execute(insert(HistorialEstado).from_select(
+        ["caso_id", "estado_nuevo", "usuario_id", "comentario", "fecha_cambio"],
+        select(creados.c.id, creados.c.estado, literal(importacion.usuario_id), literal("Caso importado"),
+               creados.c.fecha_creacion)
+    ))
+    db.execute(insert(HistorialEvento).from_select(
+        ["caso_id", "usuario_id", "tipo_evento", "valor_nuevo", "comentario", "fecha_evento", "datos_adicionales"],
+        select(
+            creados.c.id, literal(importacion.usuario_id), literal("creacion"),
+            func.concat("Caso ", creados.c.numero_caso, " creado"), literal("Caso importado desde histórico"),
+            creados.c.fecha_creacion,
+            func.jsonb_strip_nulls(func.jsonb_build_object(
+                literal_column("'importacion_id'"), importacion.id,
+                literal_column("'fila'"), creados.c.fila,
+                literal_column("'radicado_anterior'"), creados.c.radicado_anterior,
+            ))
+        )
+    ))
+
+    return {
+        "pacientes_nuevos": sum(insertados),
+        "pacientes_actualizados": len(insertados) - sum(insertados),
+        "casos_creados": casos_creados,
+    }
+
+def _registrar_rechazos(importacion: Importacion, rechazadas: List[dict]):
+    importacion.filas_rechazadas += len(rechazadas)
+    errores = list(importacion.errores or [])
+    if len(errores) < MAX_ERRORES_GUARDADOS:
+        importacion.errores = errores + rechazadas[:MAX_ERRORES_GUARDADOS - len(errores)]
+
+def _dias_importados(db: Session, importacion: Importacion) -> List[date]:
+    """Días locales de los casos de la importación, por su evento de creación"""
+    dia = func.date(periodos.hora_local(HistorialEvento.fecha_evento))
+    return [r.dia for r in db.query(dia.label("dia")).filter(
+        HistorialEvento.tipo_evento == "creacion",
+        HistorialEvento.datos_adicionales.contains({"importacion_id": importacion.id})
+    ).distinct()]
+
+def resumen(importacion: Importacion) -> dict:
+    return {
+        "id": importacion.id,
+        "nombre_archivo": importacion.nombre_archivo,
+        "estado": importacion.estado,
+        "filas_procesadas": importacion.filas_procesadas,
+        "filas_rechazadas": importacion.filas_rechazadas,
+        "pacientes_nuevos": importacion.pacientes_nuevos,
+        "pacientes_actualizados": importacion.pacientes_actualizados,
+        "casos_creados": importacion.casos_creados,
+        "segundos": round(importacion.segundos, 1),
+        "filas_por_segundo": round(importacion.filas_procesadas / importacion.segundos) if importacion.segundos else 0,
+        "errores": importacion.errores or [],
+        "fecha_inicio": importacion.fecha_inicio,
+        "fecha_fin": importacion.fecha_fin,
+    }
+
+def _huella(archivo: BinaryIO) -> str:
+    sha = hashlib.sha256()
+    for bloque in iter(lambda: archivo.read(1 << 20), b""):
+        sha.update(bloque)
+    archivo.seek(0)
+    return sha.hexdigest()
+
+def importar(archivo: BinaryIO, nombre_archivo: str, usuario_id: int, hoja: Optional[str] = None,
+             separador: Optional[str] = None, codificacion: str = "utf-8-sig", lote: Optional[int] = None,
+             forzar: bool = False) -> dict:
+    """
+    Importa `archivo` (binario y con seek) y devuelve el resumen de la
+    importación. ValueError si el archivo no se puede leer; ImportacionEnCurso
+    si ya hay otra en curso.
+    """
+    if engine.dialect.name != "postgresql":
+        raise ValueError("La importación de histórico requiere PostgreSQL")
+    lote = lote or IMPORTACION_LOTE
+    huella = _huella(archivo)
+
+    # Una sola conexión: la tabla temporal y el lock de sesión viven en ella
+    with engine.connect() as conexion, Session(bind=conexion) as db:
+        if not db.execute(text("SELECT pg_try_advisory_lock(:clave)"), {"clave": CLAVE_BLOQUEO_IMPORTACION}).scalar():
+            raise ImportacionEnCurso()
+        db.commit()
+        importacion = None
+        try:
+            importacion = db.query(Importacion).filter(Importacion.huella == huella).order_by(
+                Importacion.id.desc()).first()
+            if importacion is not None and importacion.estado == "completada" and not forzar:
+                logger.info(f"{nombre_archivo} ya se importó (importación {importacion.id}); se omite")
+                return resumen(importacion)
+            # Un archivo ilegible o sin las columnas obligatorias no deja registro
+            registros = leer_registros(archivo, nombre_archivo, hoja, separador, codificacion)
+            if importacion is None or importacion.estado == "completada":
+                importacion = Importacion(nombre_archivo=nombre_archivo[:255], huella=huella, usuario_id=usuario_id)
+                db.add(importacion)
+            elif importacion.filas_procesadas:
+                logger.info(f"Reanudando la importación {importacion.id} desde la fila {importacion.filas_procesadas + 1}")
+            importacion.estado = "en_curso"
+            filas_importacion.create(db.connection(), checkfirst=True)
+            db.commit()
+
+            _importar(db, importacion, registros, lote)
+            rollup_metricas.recalcular_dias(db, _dias_importados(db, importacion))
+            return resumen(importacion)
+        except Exception:
+            db.rollback()
+            if importacion is not None and importacion.id is not None:
+                importacion.estado = "fallida"
+                db.commit()
+            raise
+        finally:
+            db.execute(text(f"DROP TABLE IF EXISTS pg_temp.{filas_importacion.name}"))
+            db.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": CLAVE_BLOQUEO_IMPORTACION})
+            db.commit()
+
+def _importar(db: Session, importacion: Importacion, registros: Iterator[Dict[str, object]], lote: int):
+    inicio = time.perf_counter()
+    filas_sesion = 0
+    meses = set()
+    motivos, agentes = catalogos(db)
+    for validas, rechazadas, leidas in _lotes(registros, importacion.filas_procesadas, lote, motivos, agentes):
+        inicio_lote = time.perf_counter()
+        _asegurar_particiones(db, validas, meses)
+        if validas:
+            resultado = _cargar_lote(db, importacion, validas)
+            importacion.pacientes_nuevos += resultado["pacientes_nuevos"]
+            importacion.pacientes_actualizados += resultado["pacientes_actualizados"]
+            importacion.casos_creados += resultado["casos_creados"]
+        _registrar_rechazos(importacion, rechazadas)
+        importacion.filas_procesadas += leidas
+        importacion.segundos += time.perf_counter() - inicio_lote
+        db.commit()
+
+        filas_sesion += leidas
+        logger.info(
+            f"Importación {importacion.id}: {importacion.filas_procesadas:,} filas "
+            f"({filas_sesion / (time.perf_counter() - inicio):,.0f} filas/s), "
+            f"{importacion.casos_creados:,} casos, {importacion.filas_rechazadas:,} rechazadas"
+        )
+
+    importacion.estado = "completada"
+    importacion.fecha_fin = datetime.now(timezone.utc)
+    db.commit()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Importa histórico de pacientes y casos desde CSV o XLSX")
+    parser.add_argument("archivo", type=Path, help="Archivo .csv o .xlsx")
+    parser.add_argument("--usuario", default="admin", help="Username que figura como creador de los casos")
+    parser.add_argument("--hoja", help="Hoja del libro XLSX (por defecto la activa)")
+    parser.add_argument("--separador", help="Separador del CSV (por defecto se detecta)")
+    parser.add_argument("--codificacion", default="utf-8-sig", help="Codificación del CSV")
+    parser.add_argument("--lote", type=int, default=IMPORTACION_LOTE, help="Filas por transacción")
+    parser.add_argument("--forzar", action="store_true", help="Importar aunque el archivo ya se haya importado")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        usuario_id = db.query(Usuario.id).filter(Usuario.username == args.usuario).scalar()
+    if usuario_id is None:
+        parser.error(f"no existe el usuario {args.usuario}")
+
+    try:
+        with open(args.archivo, "rb") as archivo:
+            r = importar(archivo, args.archivo.name, usuario_id, hoja=args.hoja, separador=args.separador,
+                         codificacion=args.codificacion, lote=args.lote, forzar=args.forzar)
+    except ImportacionEnCurso:
+        print("Ya hay una importación en curso")
+        return 1
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"Importación {r['id']} ({r['estado']}): {r['filas_procesadas']:,} filas en {r['segundos']}s "
+          f"({r['filas_por_segundo']:,} filas/s)")
+    print(f"  {r['casos_creados']:>12,} casos creados")
+    print(f"  {r['pacientes_nuevos']:>12,} pacientes nuevos")
+    print(f"  {r['pacientes_actualizados']:>12,} pacientes completados")
+    print(f"  {r['filas_rechazadas']:>12,} filas rechazadas")
+    for error in r["errores"][:20]:
+        print(f"    fila {error['fila']}: {error['error']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 from database import engine, Base, SessionLocal
 from models import Usuario, Departamento, Ciudad, MotivoPQR, RolEnum
+import particiones
 from passlib.context import CryptContext
 import logging
 
@@ -11,6 +12,8 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 def init_database():
     logger.info("Creando tablas...")
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conexion:
+        particiones.asegurar_particiones(conexion)
     logger.info("Tablas creadas exitosamente")
     
     db = SessionLocal()
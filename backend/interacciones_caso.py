@@ -0,0 +1,156 @@
+"""
+Resumen de interacciones por caso
+
+`casos.num_interacciones`, `primera_interaccion` y `ultima_interaccion` evitan
+agrupar la tabla de interacciones para saber cuántas tiene cada caso. La
+resolución en primera llamada (casos cerrados con una sola interacción) pasa a
+ser un conteo sobre el índice (estado, num_interacciones).
+
+Los endpoints que registran interacciones actualizan el resumen en la misma
+transacción (`registrar_interaccion`). Las cargas masivas que insertan
+interacciones directamente (datos sintéticos, importaciones) lo recalculan con
+`recalcular`, que también corrige cualquier desvío. Los casos archivados
+conservan su resumen.
+
+Uso:
+    python interacciones_caso.py verificar
+    python interacciones_caso.py recalcular
+    python interacciones_caso.py recalcular --lote 20000
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from models import Caso, CasoArchivado, Interaccion, InteraccionArchivada
+
+logger = logging.getLogger(__name__)
+
+RESUMEN_LOTE = int(os.environ.get('RESUMEN_INTERACCIONES_LOTE', '50000'))
+
+# Casos calientes y archivados con la tabla de sus interacciones
+FUENTES = ((Caso, Interaccion), (CasoArchivado, InteraccionArchivada))
+
+def registrar_interaccion(db: Session, caso_id: int, fecha: datetime) -> bool:
+    """
+    Suma una interacción del `caso_id` con fecha `fecha` a su resumen; no hace
+    commit. Devuelve False si el caso no existe entre los casos calientes.
+    """
+    resultado = db.execute(
+        update(Caso).where(Caso.id == caso_id).values(
+            num_interacciones=Caso.num_interacciones + 1,
+            primera_interaccion=case(
+                (or_(Caso.primera_interaccion.is_(None), Caso.primera_interaccion > fecha), fecha),
+                else_=Caso.primera_interaccion
+            ),
+            ultima_interaccion=case(
+                (or_(Caso.ultima_interaccion.is_(None), Caso.ultima_interaccion < fecha), fecha),
+                else_=Caso.ultima_interaccion
+            ),
+        ).execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount == 1
+
+def _diferencias(modelo_caso, modelo_interaccion, desde: int, hasta: int):
+    """Casos con id en [desde, hasta) cuyo resumen no coincide con sus interacciones"""
+    agregado = select(
+        modelo_interaccion.caso_id,
+        func.count().label("cantidad"),
+        func.min(modelo_interaccion.fecha_registro).label("primera"),
+        func.max(modelo_interaccion.fecha_registro).label("ultima"),
+    ).where(
+        modelo_interaccion.caso_id >= desde, modelo_interaccion.caso_id < hasta
+    ).group_by(modelo_interaccion.caso_id).subquery("agregado")
+
+    cantidad = func.coalesce(agregado.c.cantidad, 0)
+    return select(
+        modelo_caso.id.label("caso_id"),
+        cantidad.label("cantidad"),
+        agregado.c.primera,
+        agregado.c.ultima,
+    ).outerjoin(agregado, agregado.c.caso_id == modelo_caso.id).where(
+        modelo_caso.id >= desde, modelo_caso.id < hasta,
+        or_(
+            modelo_caso.num_interacciones != cantidad,
+            modelo_caso.primera_interaccion.is_distinct_from(agregado.c.primera),
+            modelo_caso.ultima_interaccion.is_distinct_from(agregado.c.ultima),
+        )
+    ).subquery("diferencias")
+
+def _rangos(db: Session, modelo_caso, lote: int, desde_id: Optional[int] = None):
+    consulta = db.query(func.min(modelo_caso.id), func.max(modelo_caso.id))
+    if desde_id is not None:
+        consulta = consulta.filter(modelo_caso.id >= desde_id)
+    minimo, maximo = consulta.one()
+    if minimo is None:
+        return
+    for desde in range(minimo, maximo + 1, lote):
+        yield desde, desde + lote
+
+def verificar(db: Session, lote: Optional[int] = None) -> Dict[str, int]:
+    """Casos con el resumen desactualizado, por tabla"""
+    lote = lote or RESUMEN_LOTE
+    resultado = {}
+    for modelo_caso, modelo_interaccion in FUENTES:
+        resultado[modelo_caso.__table__.name] = sum(
+            db.execute(select(func.count()).select_from(
+                _diferencias(modelo_caso, modelo_interaccion, desde, hasta)
+            )).scalar()
+            for desde, hasta in _rangos(db, modelo_caso, lote)
+        )
+    return resultado
+
+def recalcular(db: Session, lote: Optional[int] = None, desde_id: Optional[int] = None) -> Dict[str, int]:
+    """
+    Reescribe el resumen de los casos que no coinciden con sus interacciones,
+    por lotes de ids (un commit por lote), opcionalmente solo desde `desde_id`.
+    Devuelve los casos corregidos por tabla.
+    """
+    lote = lote or RESUMEN_LOTE
+    resultado = {}
+    for modelo_caso, modelo_interaccion in FUENTES:
+        corregidos = 0
+        for desde, hasta in _rangos(db, modelo_caso, lote, desde_id):
+            diferencias = _diferencias(modelo_caso, modelo_interaccion, desde, hasta)
+            corregidos += db.execute(
+                update(modelo_caso).where(modelo_caso.id == diferencias.c.caso_id).values(
+                    num_interacciones=diferencias.c.cantidad,
+                    primera_interaccion=diferencias.c.primera,
+                    ultima_interaccion=diferencias.c.ultima,
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+        if corregidos:
+            logger.info(f"Resumen de interacciones: {corregidos} casos corregidos en {modelo_caso.__table__.name}")
+        resultado[modelo_caso.__table__.name] = corregidos
+    return resultado
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Resumen de interacciones por caso")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    for nombre, ayuda in (("verificar", "Contar casos con el resumen desactualizado"),
+                          ("recalcular", "Corregir el resumen a partir de las interacciones")):
+        comando = sub.add_parser(nombre, help=ayuda)
+        comando.add_argument("--lote", type=int, default=RESUMEN_LOTE, help="Casos por consulta")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        if args.comando == "recalcular":
+            for tabla, corregidos in recalcular(db, args.lote).items():
+                print(f"  {tabla:<16}{corregidos:>12,} casos corregidos")
+            return 0
+        desactualizados = verificar(db, args.lote)
+        for tabla, cantidad in desactualizados.items():
+            print(f"  {tabla:<16}{cantidad:>12,} casos con el resumen desactualizado")
+        return 1 if any(desactualizados.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Escenario de carga sostenida con Locust
+
+Simula agentes del call center: la mayoría del tráfico es screen-pop y
+consulta de casos, con algo de creación de casos, dashboard y reportes.
+Locust no es dependencia del backend; se instala aparte:
+
+    pip install locust
+    locust -f locustfile.py --host http://localhost:8001 --users 100 --spawn-rate 10
+
+Usuario y contraseña se toman de BENCHMARK_USUARIO y BENCHMARK_CLAVE; con
+BENCHMARK_VERIFICAR_TLS=false se acepta el certificado autofirmado del backend.
+"""
+import os
+import random
+from datetime import date, timedelta
+
+from locust import HttpUser, between, task
+
+USUARIO = os.environ.get("BENCHMARK_USUARIO", "admin")
+CLAVE = os.environ.get("BENCHMARK_CLAVE", "admin123")
+VERIFICAR_TLS = os.environ.get("BENCHMARK_VERIFICAR_TLS", "true").lower() == "true"
+
+
+class AgenteCallCenter(HttpUser):
+    wait_time = between(1, 5)
+
+    def on_start(self):
+        self.client.verify = VERIFICAR_TLS
+        respuesta = self.client.post("/api/auth/login", json={"username": USUARIO, "password": CLAVE})
+        respuesta.raise_for_status()
+        self.client.headers["Authorization"] = f"Bearer {respuesta.json()['access_token']}"
+
+        pacientes = self.client.get("/api/pacientes", params={"limit": 200}).json()
+        casos = self.client.get("/api/casos", params={"limit": 200}).json()
+        self.identificaciones = [p["identificacion"] for p in pacientes]
+        self.ids_pacientes = [p["id"] for p in pacientes]
+        self.ids_casos = [c["id"] for c in casos]
+        self.ids_motivos = [m["id"] for m in self.client.get("/api/motivos").json()]
+
+    @task(6)
+    def screen_pop(self):
+        identificacion = random.choice(self.identificaciones)
+        self.client.get(f"/api/embedded/paciente/{identificacion}", name="/api/embedded/paciente/[id]")
+        self.client.get(f"/api/embedded/paciente/{identificacion}/historial",
+                        name="/api/embedded/paciente/[id]/historial")
+
+    @task(4)
+    def listado_casos(self):
+        self.client.get("/api/casos", params={"limit": 50})
+
+    @task(4)
+    def detalle_caso(self):
+        self.client.get(f"/api/casos/{random.choice(self.ids_casos)}", name="/api/casos/[id]")
+
+    @task(1)
+    def crear_caso(self):
+        self.client.post("/api/casos", json={
+            "paciente_id": random.choice(self.ids_pacientes),
+            "motivo_id": random.choice(self.ids_motivos),
+            "descripcion": "Caso creado por locust",
+            "origen": "call",
+        })
+
+    @task(2)
+    def dashboard(self):
+        self.client.get("/api/metricas/dashboard")
+
+    @task(1)
+    def reportes(self):
+        fin = date.today()
+        inicio = fin - timedelta(days=30)
+        self.client.get("/api/metricas/casos-por-motivo",
+                        params={"inicio": inicio.isoformat(), "fin": fin.isoformat()})
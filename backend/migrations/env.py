@@ -0,0 +1,39 @@
+"""
+Entorno de Alembic: usa el engine y los modelos del backend
+
+    alembic upgrade head
+    alembic revision -m "descripción"
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from database import Base, DATABASE_URL, engine
+import models  # noqa: F401  (registra las tablas en Base.metadata)
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online() -> None:
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,35 @@
+"""Esquema inicial
+
+Antes de Alembic el esquema se creaba con Base.metadata.create_all al
+arrancar el servidor. Esta revisión crea las tablas que falten con esa misma
+definición: en una base existente no cambia nada y en una nueva deja el
+esquema completo. Las revisiones siguientes usan operaciones explícitas.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from database import Base
+import models  # noqa: F401
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    Base.metadata.create_all(bind=op.get_bind(), checkfirst=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # No se borra el esquema base
+    pass
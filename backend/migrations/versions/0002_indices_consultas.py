@@ -0,0 +1,45 @@
+"""Índices de alertas y casos por paciente
+
+create_all no agrega índices a tablas que ya existen, así que las bases
+creadas antes de declararlos en models.py no los tienen. Se crean con
+CONCURRENTLY para no bloquear escrituras.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# nombre -> (tabla, columna); mismos nombres que genera create_all
+INDICES = {
+    "ix_casos_paciente_id": ("casos", "paciente_id"),
+    "ix_alertas_caso_id": ("alertas", "caso_id"),
+    "ix_alertas_fecha_creacion": ("alertas", "fecha_creacion"),
+    "ix_alertas_leida": ("alertas", "leida"),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != "postgresql":
+        for nombre, (tabla, columna) in INDICES.items():
+            op.create_index(nombre, tabla, [columna], if_not_exists=True)
+        return
+    with op.get_context().autocommit_block():
+        for nombre, (tabla, columna) in INDICES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla} ({columna})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for nombre, (tabla, _) in INDICES.items():
+        op.drop_index(nombre, table_name=tabla, if_exists=True)
@@ -0,0 +1,146 @@
+"""Particionar interacciones e historial_eventos por mes
+
+Convierte cada tabla en una tabla particionada por rango mensual de su fecha
+de registro y copia los datos. La clave primaria pasa a ser (id, fecha),
+porque PostgreSQL exige que incluya la clave de partición. Se crean los
+meses desde la fila más antigua hasta PARTICIONES_MESES_ADELANTE meses en el
+futuro, más una partición default. La tarea de particiones.py crea los meses
+siguientes.
+
+La copia reescribe las tablas con un lock exclusivo: en bases grandes debe
+correrse en una ventana de mantenimiento. Si la tabla ya es particionada
+(por ejemplo, la creó create_all con los modelos actuales), solo se crean
+las particiones que falten.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+"""
+import os
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MESES_ADELANTE = int(os.environ.get('PARTICIONES_MESES_ADELANTE', '3'))
+
+# tabla -> (columna de partición, claves foráneas, índices)
+TABLAS = {
+    "interacciones": (
+        "fecha_registro",
+        {"caso_id": "casos(id)"},
+        {"ix_interacciones_id": "id", "ix_interacciones_caso_id": "caso_id"},
+    ),
+    "historial_eventos": (
+        "fecha_evento",
+        {"caso_id": "casos(id)", "usuario_id": "usuarios(id)"},
+        {
+            "ix_historial_eventos_id": "id",
+            "ix_historial_eventos_caso_id": "caso_id",
+            "ix_historial_eventos_fecha_evento": "fecha_evento",
+        },
+    ),
+}
+
+
+def _sumar_meses(mes: date, meses: int) -> date:
+    total = mes.year * 12 + mes.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _es_particionada(bind, tabla: str) -> bool:
+    return bool(bind.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :tabla AND pg_table_is_visible(c.oid))"
+    ), {"tabla": tabla}).scalar())
+
+
+def _crear_meses(bind, tabla: str, desde: date):
+    hoy = datetime.now(timezone.utc).date()
+    hasta = _sumar_meses(date(hoy.year, hoy.month, 1), MESES_ADELANTE + 1)
+    op.execute(f"CREATE TABLE IF NOT EXISTS {tabla}_default PARTITION OF {tabla} DEFAULT")
+    mes = date(desde.year, desde.month, 1)
+    while mes < hasta:
+        siguiente = _sumar_meses(mes, 1)
+        nombre = f"{tabla}_{mes:%Y_%m}"
+        existe = bind.execute(sa.text("SELECT to_regclass(:n)"), {"n": nombre}).scalar()
+        if existe is None:
+            op.execute(
+                f"CREATE TABLE {nombre} PARTITION OF {tabla} "
+                f"FOR VALUES FROM ('{mes.isoformat()}') TO ('{siguiente.isoformat()}')"
+            )
+        mes = siguiente
+
+
+def _columnas(bind, tabla: str):
+    return [c for (c,) in bind.execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = :tabla AND table_schema = current_schema() ORDER BY ordinal_position"
+    ), {"tabla": tabla})]
+
+
+def _restricciones_e_indices(tabla: str, clave_primaria: str):
+    _, foraneas, indices = TABLAS[tabla]
+    op.execute(f"ALTER TABLE {tabla} ADD PRIMARY KEY ({clave_primaria})")
+    for columna, referencia in foraneas.items():
+        op.execute(f"ALTER TABLE {tabla} ADD FOREIGN KEY ({columna}) REFERENCES {referencia}")
+    for nombre, columna in indices.items():
+        op.execute(f"CREATE INDEX {nombre} ON {tabla} ({columna})")
+
+
+def _convertir(bind, tabla: str, particionar: bool):
+    """Copia la tabla a una nueva, particionada o no, y reemplaza la original"""
+    columna_fecha = TABLAS[tabla][0]
+    anterior = f"{tabla}_anterior"
+    secuencia = bind.execute(sa.text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": tabla}).scalar()
+    columnas = _columnas(bind, tabla)
+
+    op.execute(f"ALTER TABLE {tabla} RENAME TO {anterior}")
+    if particionar:
+        op.execute(f"CREATE TABLE {tabla} (LIKE {anterior} INCLUDING DEFAULTS) PARTITION BY RANGE ({columna_fecha})")
+        op.execute(f"ALTER TABLE {tabla} ALTER COLUMN {columna_fecha} SET NOT NULL")
+        minima = bind.execute(sa.text(f"SELECT min({columna_fecha}) FROM {anterior}")).scalar()
+        _crear_meses(bind, tabla, (minima or datetime.now(timezone.utc)).date())
+    else:
+        op.execute(f"CREATE TABLE {tabla} (LIKE {anterior} INCLUDING DEFAULTS)")
+    # La secuencia del id pertenece a la tabla anterior; sin esto se borraría con ella
+    op.execute(f"ALTER SEQUENCE {secuencia} OWNED BY {tabla}.id")
+
+    lista = ", ".join(columnas)
+    origen = ", ".join(
+        f"COALESCE({c}, now() AT TIME ZONE 'utc')" if c == columna_fecha else c for c in columnas
+    )
+    op.execute(f"INSERT INTO {tabla} ({lista}) SELECT {origen} FROM {anterior}")
+    op.execute(f"DROP TABLE {anterior} CASCADE")
+    _restricciones_e_indices(tabla, f"id, {columna_fecha}" if particionar else "id")
+    op.execute(f"ANALYZE {tabla}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    for tabla in TABLAS:
+        if _es_particionada(bind, tabla):
+            _crear_meses(bind, tabla, datetime.now(timezone.utc).date())
+        else:
+            _convertir(bind, tabla, particionar=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    for tabla in TABLAS:
+        if _es_particionada(bind, tabla):
+            _convertir(bind, tabla, particionar=False)
@@ -0,0 +1,77 @@
+"""Tablas de archivo para casos cerrados
+
+Crea casos_archivo y las copias de interacciones, historial_estados,
+historial_eventos y alertas (ver archivo_casos.py). Cada tabla se crea con
+LIKE a partir de la tabla caliente, con clave primaria solo en `id`, las
+mismas claves foráneas (las que apuntan a casos pasan a casos_archivo) e
+índices únicamente en caso_id, paciente_id y las fechas de casos_archivo.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# tabla caliente -> (tabla del archivo, columnas indexadas); casos va primero
+TABLAS = {
+    "casos": ("casos_archivo", ["paciente_id", "fecha_creacion", "fecha_cierre"]),
+    "interacciones": ("interacciones_archivo", ["caso_id"]),
+    "historial_estados": ("historial_estados_archivo", ["caso_id"]),
+    "historial_eventos": ("historial_eventos_archivo", ["caso_id"]),
+    "alertas": ("alertas_archivo", ["caso_id"]),
+}
+
+
+def _existe(bind, tabla: str) -> bool:
+    return bind.execute(sa.text("SELECT to_regclass(:t)"), {"t": tabla}).scalar() is not None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        import models
+        models.Base.metadata.create_all(
+            bind, tables=[models.Base.metadata.tables[a] for a, _ in TABLAS.values()], checkfirst=True
+        )
+        return
+
+    for tabla, (archivo, indexadas) in TABLAS.items():
+        if _existe(bind, archivo):
+            continue
+        op.execute(f"CREATE TABLE {archivo} (LIKE {tabla})")
+        op.execute(f"ALTER TABLE {archivo} ADD PRIMARY KEY (id)")
+        if tabla == "casos":
+            op.execute(f"ALTER TABLE {archivo} ADD COLUMN fecha_archivo TIMESTAMP WITHOUT TIME ZONE NOT NULL")
+            op.execute(f"ALTER TABLE {archivo} ADD UNIQUE (numero_caso)")
+
+        foraneas = bind.execute(sa.text(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:t AS regclass) AND contype = 'f' ORDER BY conname"
+        ), {"t": tabla}).scalars().all()
+        for definicion in foraneas:
+            definicion = definicion.replace("REFERENCES casos(", "REFERENCES casos_archivo(")
+            op.execute(f"ALTER TABLE {archivo} ADD {definicion}")
+
+        for columna in indexadas:
+            op.execute(f"CREATE INDEX ix_{archivo}_{columna} ON {archivo} ({columna})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table("casos_archivo") and \
+            bind.execute(sa.text("SELECT EXISTS (SELECT 1 FROM casos_archivo)")).scalar():
+        raise RuntimeError("casos_archivo tiene casos; borrar las tablas de archivo perdería datos")
+    for archivo, _ in reversed(list(TABLAS.values())):
+        op.execute(f"DROP TABLE IF EXISTS {archivo}")
@@ -0,0 +1,67 @@
+"""Resumen de interacciones en casos
+
+Agrega num_interacciones, primera_interaccion y ultima_interaccion a casos y
+casos_archivo (ver interacciones_caso.py), los calcula a partir de las
+interacciones existentes y crea los índices para contar la resolución en
+primera llamada.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# tabla de casos -> (tabla de interacciones, índice, columnas del índice)
+TABLAS = {
+    "casos": ("interacciones", "ix_casos_estado_num_interacciones", ["estado", "num_interacciones"]),
+    "casos_archivo": ("interacciones_archivo", "ix_casos_archivo_num_interacciones", ["num_interacciones"]),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for tabla, (interacciones, indice, columnas) in TABLAS.items():
+        existentes = {c["name"] for c in inspector.get_columns(tabla)}
+        if "num_interacciones" not in existentes:
+            op.add_column(tabla, sa.Column("num_interacciones", sa.Integer(), server_default="0", nullable=False))
+            if tabla == "casos_archivo" and bind.dialect.name == "postgresql":
+                # Como el resto de las columnas del archivo, sin valor por defecto
+                op.alter_column(tabla, "num_interacciones", server_default=None)
+        for columna in ("primera_interaccion", "ultima_interaccion"):
+            if columna not in existentes:
+                op.add_column(tabla, sa.Column(columna, sa.DateTime(), nullable=True))
+
+        op.execute(f"""
+            UPDATE {tabla} SET
+                num_interacciones = i.cantidad,
+                primera_interaccion = i.primera,
+                ultima_interaccion = i.ultima
+            FROM (
+                SELECT caso_id, count(*) AS cantidad,
+                       min(fecha_registro) AS primera, max(fecha_registro) AS ultima
+                FROM {interacciones}
+                GROUP BY caso_id
+            ) AS i
+            WHERE {tabla}.id = i.caso_id
+        """)
+        op.create_index(indice, tabla, columnas, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for tabla, (_, indice, _) in TABLAS.items():
+        op.drop_index(indice, table_name=tabla, if_exists=True)
+        for columna in ("ultima_interaccion", "primera_interaccion", "num_interacciones"):
+            op.drop_column(tabla, columna)
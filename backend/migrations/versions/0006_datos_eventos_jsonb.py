@@ -0,0 +1,87 @@
+"""datos_adicionales de historial_eventos como JSONB
+
+Convierte historial_eventos.datos_adicionales (y su copia en el archivo) de
+texto con JSON a JSONB y crea en la tabla particionada el índice GIN y los de
+expresión sobre las claves de OmniLeads (ver models.CLAVES_DATOS_EVENTO). El
+texto que no es JSON válido se conserva como string JSON; el vacío pasa a NULL.
+
+La conversión reescribe todas las particiones con un bloqueo exclusivo, así
+que conviene aplicarla fuera del horario de atención. Las particiones ya
+desacopladas (particiones.py desacoplar) no se tocan.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLAS = ("historial_eventos", "historial_eventos_archivo")
+
+CLAVES = ("agent_name", "campaign_name", "telefono")
+
+# nombre -> definición sobre historial_eventos; mismos nombres que models.py
+INDICES = {
+    "ix_historial_eventos_datos_adicionales": "USING gin (datos_adicionales jsonb_path_ops)",
+    **{f"ix_historial_eventos_{clave}": f"((datos_adicionales ->> '{clave}'))" for clave in CLAVES},
+}
+
+
+def _tipo(bind, tabla: str) -> str:
+    return bind.execute(sa.text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :t AND column_name = 'datos_adicionales'"
+    ), {"t": tabla}).scalar()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        # En SQLite el tipo JSON se guarda como texto: no hay nada que convertir
+        return
+
+    op.execute("""
+        CREATE FUNCTION pg_temp.texto_a_jsonb(valor text) RETURNS jsonb
+        LANGUAGE plpgsql IMMUTABLE AS $$
+        BEGIN
+            IF valor IS NULL OR btrim(valor) = '' THEN
+                RETURN NULL;
+            END IF;
+            RETURN valor::jsonb;
+        EXCEPTION WHEN others THEN
+            RETURN to_jsonb(valor);
+        END
+        $$
+    """)
+    for tabla in TABLAS:
+        if _tipo(bind, tabla) != "jsonb":
+            op.execute(
+                f"ALTER TABLE {tabla} ALTER COLUMN datos_adicionales "
+                f"TYPE jsonb USING pg_temp.texto_a_jsonb(datos_adicionales)"
+            )
+    # En la tabla particionada: PostgreSQL crea el índice en cada partición
+    for nombre, definicion in INDICES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON historial_eventos {definicion}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    for nombre in INDICES:
+        op.execute(f"DROP INDEX IF EXISTS {nombre}")
+    for tabla in TABLAS:
+        op.execute(
+            f"ALTER TABLE {tabla} ALTER COLUMN datos_adicionales TYPE text USING datos_adicionales::text"
+        )
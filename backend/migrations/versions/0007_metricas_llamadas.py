@@ -0,0 +1,59 @@
+"""Agregado de llamadas e índices de interacciones por campaña y agente
+
+Crea metricas_llamadas (ver rollup_llamadas.py) y los índices de interacciones
+para los tramos crudos de /metricas/llamadas: fecha_registro, y
+(campaña, fecha_registro) y (agente, fecha_registro) para los filtros. En la
+tabla particionada PostgreSQL los crea en cada partición. El agregado se llena
+en el primer refresco de la tarea periódica.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# nombre -> (tabla, columnas); mismos nombres que models.py
+INDICES = {
+    "ix_interacciones_fecha_registro": ("interacciones", ["fecha_registro"]),
+    "ix_interacciones_campana_fecha": ("interacciones", ["omnileads_campaign_id", "fecha_registro"]),
+    "ix_interacciones_agente_fecha": ("interacciones", ["agent_username", "fecha_registro"]),
+    "ix_interacciones_archivo_fecha_registro": ("interacciones_archivo", ["fecha_registro"]),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("metricas_llamadas"):
+        op.create_table(
+            "metricas_llamadas",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("dia", sa.Date(), nullable=False),
+            sa.Column("hora", sa.Integer(), nullable=False),
+            sa.Column("omnileads_campaign_id", sa.String(length=100), nullable=True),
+            sa.Column("omnileads_campaign_name", sa.String(length=200), nullable=True),
+            sa.Column("omnileads_campaign_type", sa.String(length=50), nullable=True),
+            sa.Column("agent_username", sa.String(length=100), nullable=True),
+            sa.Column("agent_name", sa.String(length=200), nullable=True),
+            sa.Column("cantidad", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+    op.create_index("ix_metricas_llamadas_dia", "metricas_llamadas", ["dia"], if_not_exists=True)
+    for nombre, (tabla, columnas) in INDICES.items():
+        op.create_index(nombre, tabla, columnas, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for nombre, (tabla, _) in INDICES.items():
+        op.drop_index(nombre, table_name=tabla, if_exists=True)
+    op.drop_table("metricas_llamadas")
@@ -0,0 +1,52 @@
+"""Avance de las importaciones de histórico
+
+Crea la tabla importaciones, donde importar_historico.py guarda la huella del
+archivo, las filas confirmadas y los contadores de cada carga para reanudarla.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("importaciones"):
+        op.create_table(
+            "importaciones",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("nombre_archivo", sa.String(length=255), nullable=False),
+            sa.Column("huella", sa.String(length=64), nullable=False),
+            sa.Column("estado", sa.String(length=20), nullable=False),
+            sa.Column("filas_procesadas", sa.Integer(), nullable=False),
+            sa.Column("filas_rechazadas", sa.Integer(), nullable=False),
+            sa.Column("pacientes_nuevos", sa.Integer(), nullable=False),
+            sa.Column("pacientes_actualizados", sa.Integer(), nullable=False),
+            sa.Column("casos_creados", sa.Integer(), nullable=False),
+            sa.Column("segundos", sa.Float(), nullable=False),
+            sa.Column("errores", sa.JSON(), nullable=True),
+            sa.Column("usuario_id", sa.Integer(), nullable=False),
+            sa.Column("fecha_inicio", sa.DateTime(), nullable=True),
+            sa.Column("fecha_actualizacion", sa.DateTime(), nullable=True),
+            sa.Column("fecha_fin", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["usuario_id"], ["usuarios.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+    op.create_index("ix_importaciones_id", "importaciones", ["id"], if_not_exists=True)
+    op.create_index("ix_importaciones_huella", "importaciones", ["huella"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("importaciones")
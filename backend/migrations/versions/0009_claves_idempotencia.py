@@ -0,0 +1,47 @@
+"""Claves de idempotencia de las altas
+
+Crea la tabla claves_idempotencia, donde idempotencia.py reserva cada header
+Idempotency-Key de POST /casos, /embedded/caso e /interacciones y guarda la
+respuesta que reciben los reintentos.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, Sequence[str], None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("claves_idempotencia"):
+        op.create_table(
+            "claves_idempotencia",
+            sa.Column("alcance", sa.String(length=150), nullable=False),
+            sa.Column("clave", sa.String(length=255), nullable=False),
+            sa.Column("huella", sa.String(length=64), nullable=False),
+            sa.Column("estado", sa.String(length=20), nullable=False),
+            sa.Column("codigo_estado", sa.Integer(), nullable=True),
+            sa.Column("tipo_contenido", sa.String(length=100), nullable=True),
+            sa.Column("respuesta", sa.LargeBinary(), nullable=True),
+            sa.Column("fecha_creacion", sa.DateTime(), nullable=True),
+            sa.Column("fecha_expiracion", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("alcance", "clave"),
+        )
+    op.create_index(
+        "ix_claves_idempotencia_fecha_expiracion", "claves_idempotencia", ["fecha_expiracion"], if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("claves_idempotencia")
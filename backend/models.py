@@ -1,4 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum, Boolean, Float
+from sqlalchemy import (
+    Column, Integer, String, Text, DateTime, Date, ForeignKey, Enum, Boolean, Float, Identity, Index, JSON,
+    LargeBinary, PrimaryKeyConstraint, Table, text
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime, timezone
@@ -22,6 +27,20 @@ class TipoAlertaEnum(str, enum.Enum):
     SLA_5_DIAS = "SLA_5_DIAS"
     PRIORIDAD_ALTA = "PRIORIDAD_ALTA"
 
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _clave_primaria_sqlite(restriccion, compilador, **kw):
+    """
+    Las tablas particionadas llevan la clave de partición en la clave primaria
+    solo en PostgreSQL. En SQLite la clave es el id, que así es alias del rowid
+    y se autoincrementa (IDENTITY no existe allí); igual que en una base creada
+    con las migraciones, que solo particionan en PostgreSQL.
+    """
+    tabla = restriccion.table
+    if tabla is not None and tabla.dialect_options["postgresql"].get("partition_by") \
+            and "id" in restriccion.columns:
+        return "PRIMARY KEY (id)"
+    return compilador.visit_primary_key_constraint(restriccion, **kw)
+
 class Usuario(Base):
     __tablename__ = "usuarios"
     
@@ -89,7 +108,7 @@ class Caso(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     numero_caso = Column(String(50), unique=True, index=True, nullable=False)
-    paciente_id = Column(Integer, ForeignKey("pacientes.id"), nullable=False)
+    paciente_id = Column(Integer, ForeignKey("pacientes.id"), nullable=False, index=True)
     motivo_id = Column(Integer, ForeignKey("motivos_pqr.id"), nullable=False)
     prioridad = Column(Enum(PrioridadEnum), default=PrioridadEnum.MEDIA)
     estado = Column(Enum(EstadoCasoEnum), default=EstadoCasoEnum.ABIERTO)
@@ -101,6 +120,15 @@ class Caso(Base):
     fecha_cierre = Column(DateTime, nullable=True)
     tiempo_resolucion_horas = Column(Float, nullable=True)
     origen = Column(String(20), default='web', nullable=False)  # 'call' o 'web'
+    # Resumen de las interacciones del caso (ver interacciones_caso.py)
+    num_interacciones = Column(Integer, default=0, server_default="0", nullable=False)
+    primera_interaccion = Column(DateTime, nullable=True)
+    ultima_interaccion = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Resolución en primera llamada: casos cerrados con una sola interacción
+        Index("ix_casos_estado_num_interacciones", "estado", "num_interacciones"),
+    )
 
     paciente = relationship("Paciente", back_populates="casos")
     motivo_obj = relationship("MotivoPQR", back_populates="casos")
@@ -112,10 +140,22 @@ class Caso(Base):
     alertas = relationship("Alerta", back_populates="caso")
 
 class Interaccion(Base):
+    """Particionada por mes en PostgreSQL (ver particiones.py)"""
     __tablename__ = "interacciones"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    caso_id = Column(Integer, ForeignKey("casos.id"), nullable=False)
+    # La clave de partición debe formar parte de la clave primaria en PostgreSQL;
+    # el id usa IDENTITY porque no admite autoincrement en claves compuestas
+    # (en SQLite la clave es solo el id, ver _clave_primaria_sqlite)
+    __table_args__ = (
+        # Métricas de llamadas (ver rollup_llamadas.py): tramos del día en curso
+        # y filtros por campaña o agente de OmniLeads dentro de un rango
+        Index("ix_interacciones_fecha_registro", "fecha_registro"),
+        Index("ix_interacciones_campana_fecha", "omnileads_campaign_id", "fecha_registro"),
+        Index("ix_interacciones_agente_fecha", "agent_username", "fecha_registro"),
+        {'postgresql_partition_by': 'RANGE (fecha_registro)'}
+    )
+
+    id = Column(Integer, Identity(), primary_key=True, index=True)
+    caso_id = Column(Integer, ForeignKey("casos.id"), nullable=False, index=True)
     omnileads_call_id = Column(String(100), nullable=True)
     omnileads_campaign_id = Column(String(100), nullable=True)
     omnileads_campaign_name = Column(String(200), nullable=True)
@@ -127,7 +167,7 @@ class Interaccion(Base):
     datetime_llamada = Column(DateTime, nullable=True)
     rec_filename = Column(String(200), nullable=True)
     observaciones = Column(Text, nullable=True)
-    fecha_registro = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    fecha_registro = Column(DateTime, primary_key=True, default=lambda: datetime.now(timezone.utc))
     
     caso = relationship("Caso", back_populates="interacciones")
 
@@ -144,19 +184,39 @@ class HistorialEstado(Base):
     
     caso = relationship("Caso", back_populates="historial_estados")
 
+# Claves de datos_adicionales con índice propio (datos de la llamada de OmniLeads)
+CLAVES_DATOS_EVENTO = ("agent_name", "campaign_name", "telefono")
+
 class HistorialEvento(Base):
+    """Particionada por mes en PostgreSQL (ver particiones.py)"""
     __tablename__ = "historial_eventos"
+    __table_args__ = (
+        # datos_adicionales: GIN para búsquedas por contenido (@>) y un índice de
+        # expresión por cada clave de OmniLeads. No son parciales: PostgreSQL solo
+        # usa las estadísticas de la expresión de los índices sin WHERE
+        Index(
+            "ix_historial_eventos_datos_adicionales", "datos_adicionales",
+            postgresql_using="gin", postgresql_ops={"datos_adicionales": "jsonb_path_ops"}
+        ).ddl_if(dialect="postgresql"),
+        *[
+            Index(
+                f"ix_historial_eventos_{clave}", text(f"(datos_adicionales ->> '{clave}')")
+            ).ddl_if(dialect="postgresql")
+            for clave in CLAVES_DATOS_EVENTO
+        ],
+        {'postgresql_partition_by': 'RANGE (fecha_evento)'}
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    caso_id = Column(Integer, ForeignKey("casos.id"), nullable=False)
+    id = Column(Integer, Identity(), primary_key=True, index=True)
+    caso_id = Column(Integer, ForeignKey("casos.id"), nullable=False, index=True)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
     tipo_evento = Column(String(50), nullable=False)  # cambio_estado, cambio_prioridad, asignacion, interaccion, etc
     campo_modificado = Column(String(100), nullable=True)
     valor_anterior = Column(Text, nullable=True)
     valor_nuevo = Column(Text, nullable=True)
     comentario = Column(Text, nullable=True)
-    fecha_evento = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
-    datos_adicionales = Column(Text, nullable=True)  # JSON como string para datos extra
+    fecha_evento = Column(DateTime, primary_key=True, default=lambda: datetime.now(timezone.utc), index=True)
+    datos_adicionales = Column(JSONB().with_variant(JSON(), "sqlite"), nullable=True)  # datos extra del evento
 
     caso = relationship("Caso", back_populates="historial_eventos_new")
     usuario = relationship("Usuario")
@@ -165,10 +225,144 @@ class Alerta(Base):
     __tablename__ = "alertas"
 
     id = Column(Integer, primary_key=True, index=True)
-    caso_id = Column(Integer, ForeignKey("casos.id"), nullable=False)
+    caso_id = Column(Integer, ForeignKey("casos.id"), nullable=False, index=True)
     tipo_alerta = Column(Enum(TipoAlertaEnum), nullable=False)
-    fecha_creacion = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    leida = Column(Boolean, default=False)
+    fecha_creacion = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    leida = Column(Boolean, default=False, index=True)
     usuario_notificado_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
 
     caso = relationship("Caso", back_populates="alertas")
+
+class MetricaDiaria(Base):
+    """Agregado de casos por día/hora local y dimensiones, mantenido por rollup_metricas"""
+    __tablename__ = "metricas_diarias"
+
+    id = Column(Integer, primary_key=True)
+    dia = Column(Date, nullable=False, index=True)
+    hora = Column(Integer, nullable=False)
+    motivo_id = Column(Integer, ForeignKey("motivos_pqr.id"), nullable=False)
+    agente_asignado_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
+    prioridad = Column(Enum(PrioridadEnum), nullable=True)
+    estado = Column(Enum(EstadoCasoEnum), nullable=True)
+    origen = Column(String(20), nullable=False)
+    cantidad = Column(Integer, nullable=False, default=0)
+    suma_resolucion_horas = Column(Float, nullable=False, default=0)
+    casos_con_resolucion = Column(Integer, nullable=False, default=0)
+
+class MetricaLlamada(Base):
+    """Agregado de interacciones por día/hora local, campaña y agente de OmniLeads, mantenido por rollup_llamadas"""
+    __tablename__ = "metricas_llamadas"
+
+    id = Column(Integer, primary_key=True)
+    dia = Column(Date, nullable=False, index=True)
+    hora = Column(Integer, nullable=False)
+    omnileads_campaign_id = Column(String(100), nullable=True)
+    omnileads_campaign_name = Column(String(200), nullable=True)
+    omnileads_campaign_type = Column(String(50), nullable=True)
+    agent_username = Column(String(100), nullable=True)
+    agent_name = Column(String(200), nullable=True)
+    cantidad = Column(Integer, nullable=False, default=0)
+
+class MarcaAgregacion(Base):
+    """Marca de agua de los procesos de agregación incremental"""
+    __tablename__ = "marcas_agregacion"
+
+    nombre = Column(String(100), primary_key=True)
+    ultima_fecha = Column(DateTime, nullable=True)
+    ultimo_id = Column(Integer, nullable=True)
+    fecha_actualizacion = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+class Importacion(Base):
+    """Carga de histórico (ver importar_historico.py); guarda el avance para reanudarla"""
+    __tablename__ = "importaciones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    nombre_archivo = Column(String(255), nullable=False)
+    huella = Column(String(64), nullable=False, index=True)  # SHA-256 del archivo
+    estado = Column(String(20), nullable=False, default="en_curso")  # en_curso, completada, fallida
+    filas_procesadas = Column(Integer, nullable=False, default=0)
+    filas_rechazadas = Column(Integer, nullable=False, default=0)
+    pacientes_nuevos = Column(Integer, nullable=False, default=0)
+    pacientes_actualizados = Column(Integer, nullable=False, default=0)
+    casos_creados = Column(Integer, nullable=False, default=0)
+    segundos = Column(Float, nullable=False, default=0)
+    errores = Column(JSON, nullable=True)  # primeras filas rechazadas: [{"fila", "error"}]
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    fecha_inicio = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    fecha_actualizacion = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    fecha_fin = Column(DateTime, nullable=True)
+
+class ClaveIdempotencia(Base):
+    """Respuesta guardada para un header Idempotency-Key (ver idempotencia.py)"""
+    __tablename__ = "claves_idempotencia"
+
+    alcance = Column(String(150), primary_key=True)  # ruta y usuario que usaron la clave
+    clave = Column(String(255), primary_key=True)
+    huella = Column(String(64), nullable=False)  # SHA-256 de la petición
+    estado = Column(String(20), nullable=False, default="en_curso")  # en_curso, confirmada, completada
+    codigo_estado = Column(Integer, nullable=True)
+    tipo_contenido = Column(String(100), nullable=True)
+    respuesta = Column(LargeBinary, nullable=True)
+    fecha_creacion = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Fin del plazo de la petición en curso y, una vez completada, de la clave
+    fecha_expiracion = Column(DateTime, nullable=False, index=True)
+
+# ==================== ARCHIVO DE CASOS CERRADOS ====================
+# Tablas frías con la misma forma que las calientes (ver archivo_casos.py)
+
+def tabla_archivo(tabla: Table, nombre: str, *extra) -> Table:
+    """
+    Copia de `tabla` para el archivo: mismas columnas y tipos, clave primaria
+    solo `id` (sin secuencia: se conserva el id original), sin valores por
+    defecto ni partición. Las claves foráneas a casos apuntan a casos_archivo
+    y solo se indexan caso_id y paciente_id, más los índices de `extra`.
+    """
+    columnas = []
+    for c in tabla.columns:
+        foraneas = [
+            ForeignKey(fk.target_fullname.replace("casos.", "casos_archivo.", 1)
+                       if fk.target_fullname.startswith("casos.") else fk.target_fullname)
+            for fk in c.foreign_keys
+        ]
+        columnas.append(Column(
+            c.name, c.type, *foraneas,
+            primary_key=c.name == "id", autoincrement=False, nullable=c.nullable or c.name == "id",
+            index=c.name in ("caso_id", "paciente_id"), unique=c.unique
+        ))
+    return Table(nombre, Base.metadata, *columnas, *extra)
+
+class CasoArchivado(Base):
+    """Caso cerrado movido al archivo; conserva su id y es de solo lectura"""
+    __table__ = tabla_archivo(
+        Caso.__table__, "casos_archivo",
+        Column("fecha_archivo", DateTime, nullable=False),
+        Index("ix_casos_archivo_fecha_creacion", "fecha_creacion"),
+        Index("ix_casos_archivo_fecha_cierre", "fecha_cierre"),
+        Index("ix_casos_archivo_num_interacciones", "num_interacciones")
+    )
+
+    paciente = relationship("Paciente")
+    motivo_obj = relationship("MotivoPQR")
+    agente_creador = relationship("Usuario", foreign_keys="CasoArchivado.agente_creador_id")
+    agente_asignado = relationship("Usuario", foreign_keys="CasoArchivado.agente_asignado_id")
+    interacciones = relationship("InteraccionArchivada")
+    historial_estados = relationship("HistorialEstadoArchivado")
+    historial_eventos_new = relationship("HistorialEventoArchivado")
+    alertas = relationship("AlertaArchivada")
+
+class InteraccionArchivada(Base):
+    __table__ = tabla_archivo(
+        Interaccion.__table__, "interacciones_archivo",
+        Index("ix_interacciones_archivo_fecha_registro", "fecha_registro")
+    )
+
+class HistorialEstadoArchivado(Base):
+    __table__ = tabla_archivo(HistorialEstado.__table__, "historial_estados_archivo")
+
+class HistorialEventoArchivado(Base):
+    __table__ = tabla_archivo(HistorialEvento.__table__, "historial_eventos_archivo")
+
+    usuario = relationship("Usuario")
+
+class AlertaArchivada(Base):
+    __table__ = tabla_archivo(Alerta.__table__, "alertas_archivo")
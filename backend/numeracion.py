@@ -0,0 +1,30 @@
+"""
+Numeración RAD de los casos
+
+Las altas (web y vista embebida) toman el siguiente número y las importaciones
+de histórico (importar_historico.py) reservan bloques contiguos. Ambas toman el
+mismo advisory lock de transacción antes de leer el último número, así que un
+alta no puede usar un número de un bloque en curso ni viceversa.
+"""
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import archivo_casos
+from models import Caso
+
+# Identificador del advisory lock de la numeración
+CLAVE_BLOQUEO_RAD = 7301003
+
+def bloquear_numeracion(db: Session):
+    """Serializa la asignación de números RAD hasta el fin de la transacción"""
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": CLAVE_BLOQUEO_RAD})
+
+def ultimo_numero_rad(db: Session, prefijo: str = "RAD-") -> int:
+    """Número del último caso con el prefijo dado, caliente o archivado (0 si no hay)"""
+    numero = db.query(Caso.numero_caso).filter(
+        Caso.numero_caso.like(f"{prefijo}%")
+    ).order_by(Caso.id.desc()).limit(1).scalar()
+    ultimo = int(numero.split('-')[-1]) if numero else 0
+    # El caso más reciente puede estar en el archivo (p. ej. si se archivaron todos)
+    return max(ultimo, archivo_casos.ultimo_numero_rad(db, prefijo))
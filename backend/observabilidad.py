@@ -0,0 +1,255 @@
+"""
+Métricas de la API en formato de texto de Prometheus (/metrics)
+
+`MiddlewareMetricas` es un middleware ASGI puro que registra por ruta (la
+plantilla, p. ej. /api/casos/{caso_id}) la cantidad de peticiones, la latencia
+y la cantidad y el tiempo de las consultas SQL de cada petición. Las consultas
+se cuentan con los eventos before/after_cursor_execute del engine y se
+asocian a la petición con una ContextVar.
+
+Los histogramas solo se actualizan desde el middleware, que corre en el event
+loop, así que no necesitan locks.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+import control_admision
+import idempotencia
+from database import estados_pools, guardia_replica, read_engine
+
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100)
+LIMITES_TIEMPO_SQL = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# Rutas que no se miden: la propia exposición y el stream SSE (conexiones de horas)
+RUTAS_EXCLUIDAS = {"/metrics", "/api/stream"}
+
+# [cantidad de consultas, segundos en la base de datos] de la petición en curso
+_sql_peticion: ContextVar[Optional[list]] = ContextVar("sql_peticion", default=None)
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str]):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def incrementar(self, valores: Tuple[str, ...], cantidad: float = 1):
+        self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for valores, total in sorted(self._valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}")
+        return lineas
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str], limites: Sequence[float]):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.limites = tuple(limites)
+        # valores de etiquetas -> [conteo por bucket..., +Inf, suma]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, valores: Tuple[str, ...], valor: float):
+        serie = self._series.get(valores)
+        if serie is None:
+            serie = self._series[valores] = [0] * (len(self.limites) + 1) + [0.0]
+        serie[bisect_left(self.limites, valor)] += 1
+        serie[-1] += valor
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, serie in sorted(self._series.items()):
+            acumulado = 0
+            for limite, cantidad in zip(self.limites, serie):
+                acumulado += cantidad
+                le = 'le="%s"' % limite
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}")
+            acumulado += serie[len(self.limites)]
+            le = 'le="+Inf"'
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {serie[-1]}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {acumulado}")
+        return lineas
+
+peticiones = Contador(
+    "logifarma_http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status"))
+latencia = Histograma(
+    "logifarma_http_request_duration_seconds", "Duración de las peticiones HTTP",
+    ("method", "route"), LIMITES_LATENCIA)
+consultas_sql = Histograma(
+    "logifarma_http_request_db_queries", "Consultas SQL ejecutadas por petición",
+    ("method", "route"), LIMITES_CONSULTAS)
+tiempo_sql = Histograma(
+    "logifarma_http_request_db_seconds", "Tiempo en la base de datos por petición",
+    ("method", "route"), LIMITES_TIEMPO_SQL)
+en_curso = 0
+
+class MiddlewareMetricas:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in RUTAS_EXCLUIDAS:
+            await self.app(scope, receive, send)
+            return
+
+        global en_curso
+        estado = [500]  # si la app falla antes de responder
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+            await send(mensaje)
+
+        sql = [0, 0.0]
+        token = _sql_peticion.set(sql)
+        en_curso += 1
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            en_curso -= 1
+            _sql_peticion.reset(token)
+            # El router deja en el scope la ruta que atendió la petición
+            ruta = scope.get("route")
+            etiquetas = (scope["method"], ruta.path if ruta is not None else "sin_ruta")
+            peticiones.incrementar(etiquetas + (str(estado[0]),))
+            latencia.observar(etiquetas, duracion)
+            consultas_sql.observar(etiquetas, sql[0])
+            tiempo_sql.observar(etiquetas, sql[1])
+
+def instrumentar_engine(motor):
+    """Cuenta las consultas de `motor` en la petición HTTP en curso"""
+
+    @event.listens_for(motor, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("inicios_consulta", []).append(time.perf_counter())
+
+    @event.listens_for(motor, "after_cursor_execute")
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        inicio = conn.info["inicios_consulta"].pop()
+        sql = _sql_peticion.get()
+        if sql is not None:
+            sql[0] += 1
+            sql[1] += time.perf_counter() - inicio
+
+    @event.listens_for(motor, "handle_error")
+    def _error(contexto):
+        # Una consulta fallida no llega a after_cursor_execute
+        inicios = contexto.connection.info.get("inicios_consulta") if contexto.connection is not None else None
+        if inicios:
+            inicios.pop()
+
+def _metricas_pool() -> List[str]:
+    estados = estados_pools()
+    lineas = []
+
+    def metrica(nombre, tipo, ayuda, clave):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for estado in estados:
+            lineas.append(f'{nombre}{{pool="{estado["nombre"]}"}} {estado[clave]}')
+
+    metrica("logifarma_db_pool_size", "gauge", "Tamaño configurado del pool", "tamano")
+    metrica("logifarma_db_pool_max_overflow", "gauge", "Conexiones extra permitidas sobre el pool", "max_overflow")
+    metrica("logifarma_db_pool_checked_out", "gauge", "Conexiones en uso", "en_uso")
+    metrica("logifarma_db_pool_checked_in", "gauge", "Conexiones libres en el pool", "disponibles")
+    metrica("logifarma_db_pool_overflow", "gauge", "Conexiones abiertas por encima del tamaño del pool", "overflow")
+    metrica("logifarma_db_pool_timeouts_total", "counter", "Esperas por conexión que terminaron en timeout", "timeouts")
+    metrica("logifarma_db_pool_invalidated_total", "counter", "Conexiones descartadas por error o pre-ping", "invalidadas")
+
+    nombre = "logifarma_db_pool_wait_seconds"
+    lineas.append(f"# HELP {nombre} Espera para obtener una conexión del pool, incluida la apertura de conexiones nuevas")
+    lineas.append(f"# TYPE {nombre} histogram")
+    for estado in estados:
+        etiqueta_pool = f'pool="{estado["nombre"]}"'
+        for limite, cantidad in estado["buckets_espera"]:
+            lineas.append(f'{nombre}_bucket{{{etiqueta_pool},le="{limite}"}} {cantidad}')
+        lineas.append(f'{nombre}_bucket{{{etiqueta_pool},le="+Inf"}} {estado["solicitudes"]}')
+        lineas.append(f"{nombre}_sum{{{etiqueta_pool}}} {estado['espera_total_segundos']}")
+        lineas.append(f"{nombre}_count{{{etiqueta_pool}}} {estado['solicitudes']}")
+
+    if read_engine is not None:
+        lineas.append("# HELP logifarma_db_replica_lag_seconds Último retraso medido de la réplica")
+        lineas.append("# TYPE logifarma_db_replica_lag_seconds gauge")
+        lineas.append(f"logifarma_db_replica_lag_seconds {guardia_replica.ultimo_lag}")
+        lineas.append("# HELP logifarma_db_read_sessions_total Sesiones de lectura por destino")
+        lineas.append("# TYPE logifarma_db_read_sessions_total counter")
+        lineas.append(f'logifarma_db_read_sessions_total{{destino="replica"}} {guardia_replica.lecturas_replica}')
+        lineas.append(f'logifarma_db_read_sessions_total{{destino="primaria"}} {guardia_replica.lecturas_primaria}')
+    return lineas
+
+def _metricas_admision() -> List[str]:
+    estadisticas = control_admision.estadisticas
+    nombre = "logifarma_admision_rechazos_total"
+    lineas = [
+        "# HELP logifarma_admision_admitidas_total Peticiones embebidas admitidas",
+        "# TYPE logifarma_admision_admitidas_total counter",
+        f"logifarma_admision_admitidas_total {estadisticas.admitidas}",
+        f"# HELP {nombre} Peticiones embebidas rechazadas con 429, por motivo",
+        f"# TYPE {nombre} counter",
+    ]
+    lineas += [f'{nombre}{{motivo="{motivo}"}} {total}' for motivo, total in sorted(estadisticas.rechazos.items())]
+    lineas += [
+        "# HELP logifarma_admision_en_curso Peticiones embebidas en curso",
+        "# TYPE logifarma_admision_en_curso gauge",
+        f"logifarma_admision_en_curso {estadisticas.en_curso}",
+        "# HELP logifarma_admision_maximo_en_curso Máximo de peticiones embebidas simultáneas desde el arranque",
+        "# TYPE logifarma_admision_maximo_en_curso gauge",
+        f"logifarma_admision_maximo_en_curso {estadisticas.maximo_en_curso}",
+        "# HELP logifarma_admision_limite_concurrencia Tope de peticiones embebidas simultáneas (0 = sin tope)",
+        "# TYPE logifarma_admision_limite_concurrencia gauge",
+        f"logifarma_admision_limite_concurrencia {control_admision.ADMISION_EMBEBIDO_CONCURRENCIA}",
+        "# HELP logifarma_admision_cubos Cubos de tokens en memoria",
+        "# TYPE logifarma_admision_cubos gauge",
+        f"logifarma_admision_cubos {len(control_admision.limitador)}",
+        "# HELP logifarma_admision_errores_backend_total Fallos del backend compartido (Redis)",
+        "# TYPE logifarma_admision_errores_backend_total counter",
+        f"logifarma_admision_errores_backend_total {estadisticas.errores_backend}",
+    ]
+    return lineas
+
+def _metricas_idempotencia() -> List[str]:
+    nombre = "logifarma_idempotencia_peticiones_total"
+    lineas = [
+        f"# HELP {nombre} Altas con Idempotency-Key, por resultado (ejecutada, repetida, en_curso, distinta)",
+        f"# TYPE {nombre} counter",
+    ]
+    lineas += [
+        f'{nombre}{{resultado="{resultado}"}} {total}'
+        for resultado, total in sorted(idempotencia.estadisticas.peticiones.items())
+    ]
+    return lineas
+
+def exponer(clientes_sse: int = 0) -> str:
+    """Todas las métricas en formato de texto de Prometheus"""
+    lineas = []
+    lineas += peticiones.exponer()
+    lineas += latencia.exponer()
+    lineas += consultas_sql.exponer()
+    lineas += tiempo_sql.exponer()
+    lineas += [
+        "# HELP logifarma_http_requests_in_flight Peticiones HTTP en curso",
+        "# TYPE logifarma_http_requests_in_flight gauge",
+        f"logifarma_http_requests_in_flight {en_curso}",
+        "# HELP logifarma_sse_clients Clientes conectados al stream de eventos",
+        "# TYPE logifarma_sse_clients gauge",
+        f"logifarma_sse_clients {clientes_sse}",
+    ]
+    lineas += _metricas_pool()
+    lineas += _metricas_admision()
+    lineas += _metricas_idempotencia()
+    return "\n".join(lineas) + "\n"
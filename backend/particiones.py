@@ -0,0 +1,269 @@
+"""
+Particiones mensuales de interacciones e historial_eventos (PostgreSQL)
+
+Las dos tablas son de solo inserción y crecen sin límite, así que se
+particionan por rango mensual de su fecha de registro. Con eso, las consultas
+por rango de fechas leen solo los meses que tocan (partition pruning) y los
+meses viejos se retiran con DETACH PARTITION, sin DELETE ni VACUUM.
+
+`casos` no se particiona: lo referencian alertas, interacciones e historiales
+por id, y tanto la clave primaria como numero_caso tendrían que incluir
+fecha_creacion. Sus consultas por fecha usan el índice de fecha_creacion y el
+agregado metricas_diarias.
+
+Los límites de cada partición son meses UTC, porque las fechas se guardan en
+UTC sin zona horaria. La partición `<tabla>_default` recibe filas fuera de
+los meses creados. Debe quedar vacía: no se puede crear un mes para el que
+ya hay filas en la default.
+
+La tarea periódica crea las particiones de los próximos
+PARTICIONES_MESES_ADELANTE meses. Si PARTICIONES_RETENCION_MESES > 0, además
+desacopla los meses más antiguos; las tablas desacopladas quedan como tablas
+normales, sin claves foráneas, para archivarlas (pg_dump) y borrarlas a mano.
+
+Uso:
+    python particiones.py estado
+    python particiones.py crear --desde 2023-01 --hasta 2025-12
+    python particiones.py desacoplar --antes 2024-01
+    python particiones.py verificar-poda
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# tabla -> columna de partición
+TABLAS_PARTICIONADAS: Dict[str, str] = {
+    "interacciones": "fecha_registro",
+    "historial_eventos": "fecha_evento",
+}
+
+PARTICIONES_MESES_ADELANTE = int(os.environ.get('PARTICIONES_MESES_ADELANTE', '3'))
+PARTICIONES_RETENCION_MESES = int(os.environ.get('PARTICIONES_RETENCION_MESES', '0'))  # 0 = no desacoplar
+
+# pg_advisory_xact_lock: un solo worker crea o desacopla particiones a la vez
+CLAVE_BLOQUEO_PARTICIONES = 7310042
+
+LIMITES_PARTICION = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def inicio_mes(dia: date) -> date:
+    return date(dia.year, dia.month, 1)
+
+def sumar_meses(mes: date, meses: int) -> date:
+    total = mes.year * 12 + mes.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+def nombre_particion(tabla: str, mes: date) -> str:
+    return f"{tabla}_{mes:%Y_%m}"
+
+def _mes_actual() -> date:
+    return inicio_mes(datetime.now(timezone.utc).date())
+
+def _es_postgres(conexion) -> bool:
+    return conexion.dialect.name == "postgresql"
+
+def es_particionada(conexion, tabla: str) -> bool:
+    return bool(conexion.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = :tabla AND pg_table_is_visible(c.oid)
+        )
+    """), {"tabla": tabla}).scalar())
+
+def listar_particiones(conexion, tabla: str) -> List[Tuple[str, Optional[date], Optional[date], int]]:
+    """(nombre, desde, hasta, filas estimadas) de cada partición; la default sin límites"""
+    filas = conexion.execute(text("""
+        SELECT hija.relname, pg_get_expr(hija.relpartbound, hija.oid), hija.reltuples::bigint
+        FROM pg_inherits i
+        JOIN pg_class padre ON padre.oid = i.inhparent
+        JOIN pg_class hija ON hija.oid = i.inhrelid
+        WHERE padre.relname = :tabla AND pg_table_is_visible(padre.oid)
+        ORDER BY hija.relname
+    """), {"tabla": tabla}).all()
+    resultado = []
+    for nombre, limites, filas_estimadas in filas:
+        m = LIMITES_PARTICION.search(limites)
+        desde = datetime.fromisoformat(m.group(1)).date() if m else None
+        hasta = datetime.fromisoformat(m.group(2)).date() if m else None
+        resultado.append((nombre, desde, hasta, max(filas_estimadas, 0)))
+    return resultado
+
+def crear_particiones(conexion, tabla: str, desde: date, hasta: date) -> List[str]:
+    """Crea los meses de [desde, hasta) que falten, más la partición default"""
+    columna = TABLAS_PARTICIONADAS[tabla]
+    existentes = {nombre for nombre, *_ in listar_particiones(conexion, tabla)}
+    creadas = []
+    if f"{tabla}_default" not in existentes:
+        conexion.execute(text(f"CREATE TABLE {tabla}_default PARTITION OF {tabla} DEFAULT"))
+        creadas.append(f"{tabla}_default")
+
+    mes = inicio_mes(desde)
+    while mes < hasta:
+        siguiente = sumar_meses(mes, 1)
+        nombre = nombre_particion(tabla, mes)
+        if nombre not in existentes and conexion.execute(text("SELECT to_regclass(:n)"), {"n": nombre}).scalar():
+            logger.warning(f"{nombre} existe como tabla independiente (desacoplada); no se crea el mes")
+        elif nombre not in existentes:
+            conexion.execute(text(
+                f"CREATE TABLE {nombre} PARTITION OF {tabla} "
+                f"FOR VALUES FROM ('{mes.isoformat()}') TO ('{siguiente.isoformat()}')"
+            ))
+            creadas.append(nombre)
+        mes = siguiente
+
+    for nombre in creadas:
+        logger.info(f"Partición creada: {nombre} ({columna})")
+    return creadas
+
+def soltar_claves_foraneas(conexion, tabla: str):
+    """Quita las claves foráneas de una tabla desacoplada, que si no impedirían borrar o archivar casos"""
+    restricciones = conexion.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:tabla AS regclass) AND contype = 'f'"
+    ), {"tabla": tabla}).scalars().all()
+    for restriccion in restricciones:
+        conexion.execute(text(f'ALTER TABLE {tabla} DROP CONSTRAINT "{restriccion}"'))
+
+def desacoplar_particiones(conexion, tabla: str, antes_de: date) -> List[str]:
+    """
+    DETACH de los meses que terminan en o antes de `antes_de`. Solo toma un
+    lock breve sobre la tabla padre y no mueve datos.
+    """
+    desacopladas = []
+    for nombre, _, hasta, _ in listar_particiones(conexion, tabla):
+        if hasta is not None and hasta <= antes_de:
+            conexion.execute(text(f"ALTER TABLE {tabla} DETACH PARTITION {nombre}"))
+            soltar_claves_foraneas(conexion, nombre)
+            desacopladas.append(nombre)
+            logger.info(f"Partición desacoplada: {nombre}; queda como tabla independiente")
+    return desacopladas
+
+def asegurar_particiones(conexion, meses_adelante: int = None) -> List[str]:
+    """Particiones desde el mes actual hasta `meses_adelante` meses en el futuro"""
+    if not _es_postgres(conexion):
+        return []
+    meses_adelante = PARTICIONES_MESES_ADELANTE if meses_adelante is None else meses_adelante
+    conexion.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": CLAVE_BLOQUEO_PARTICIONES})
+    mes = _mes_actual()
+    creadas = []
+    for tabla in TABLAS_PARTICIONADAS:
+        if es_particionada(conexion, tabla):
+            creadas += crear_particiones(conexion, tabla, mes, sumar_meses(mes, meses_adelante + 1))
+    return creadas
+
+def mantener_particiones(db: Session) -> int:
+    """Tarea periódica: crea los meses siguientes y aplica la retención"""
+    conexion = db.connection()
+    if not _es_postgres(conexion):
+        return 0
+    cambios = len(asegurar_particiones(conexion))
+    if PARTICIONES_RETENCION_MESES > 0:
+        limite = sumar_meses(_mes_actual(), -PARTICIONES_RETENCION_MESES)
+        for tabla in TABLAS_PARTICIONADAS:
+            if es_particionada(conexion, tabla):
+                cambios += len(desacoplar_particiones(conexion, tabla, limite))
+    db.commit()
+    return cambios
+
+def _relaciones_del_plan(nodo: dict) -> List[str]:
+    relaciones = [nodo["Relation Name"]] if "Relation Name" in nodo else []
+    for hijo in nodo.get("Plans", []):
+        relaciones += _relaciones_del_plan(hijo)
+    return relaciones
+
+def verificar_poda(conexion, mes: date = None) -> List[dict]:
+    """
+    EXPLAIN de consultas por rango de un mes sobre cada tabla particionada:
+    el plan solo debe leer la partición de ese mes.
+    """
+    mes = mes or _mes_actual()
+    siguiente = sumar_meses(mes, 1)
+    resultados = []
+    for tabla, columna in TABLAS_PARTICIONADAS.items():
+        consultas = {
+            "conteo_por_rango": f"SELECT count(*) FROM {tabla} WHERE {columna} >= :desde AND {columna} < :hasta",
+            "casos_del_rango": (
+                f"SELECT c.estado, count(*) FROM casos c JOIN {tabla} t ON t.caso_id = c.id "
+                f"WHERE t.{columna} >= :desde AND t.{columna} < :hasta GROUP BY c.estado"
+            ),
+        }
+        for nombre, sql in consultas.items():
+            plan = conexion.execute(
+                text("EXPLAIN (FORMAT JSON) " + sql), {"desde": mes, "hasta": siguiente}
+            ).scalar()
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            leidas = sorted({r for r in _relaciones_del_plan(plan[0]["Plan"]) if r.startswith(tabla)})
+            esperada = nombre_particion(tabla, mes)
+            resultados.append({
+                "tabla": tabla,
+                "consulta": nombre,
+                "particiones_leidas": leidas,
+                "ok": leidas == [esperada],
+            })
+    return resultados
+
+def main() -> int:
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent))
+    from database import engine
+
+    def mes_arg(valor: str) -> date:
+        return datetime.strptime(valor, "%Y-%m").date()
+
+    parser = argparse.ArgumentParser(description="Particiones mensuales de interacciones e historial_eventos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("estado", help="Lista las particiones y sus filas estimadas")
+    crear = sub.add_parser("crear", help="Crea los meses de un rango (p. ej. antes de importar histórico)")
+    crear.add_argument("--desde", type=mes_arg, required=True, help="AAAA-MM")
+    crear.add_argument("--hasta", type=mes_arg, required=True, help="AAAA-MM, inclusive")
+    desacoplar = sub.add_parser("desacoplar", help="DETACH de los meses anteriores a uno dado")
+    desacoplar.add_argument("--antes", type=mes_arg, required=True, help="AAAA-MM, exclusivo")
+    verificar = sub.add_parser("verificar-poda", help="Comprueba con EXPLAIN que se lee un solo mes")
+    verificar.add_argument("--mes", type=mes_arg, help="AAAA-MM (por defecto el actual)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if engine.dialect.name != "postgresql":
+        parser.error("las particiones requieren PostgreSQL")
+
+    with engine.begin() as conexion:
+        tablas = [t for t in TABLAS_PARTICIONADAS if es_particionada(conexion, t)]
+        faltantes = set(TABLAS_PARTICIONADAS) - set(tablas)
+        if faltantes:
+            print(f"Sin particionar (falta `alembic upgrade head`): {', '.join(sorted(faltantes))}")
+
+        if args.comando == "estado":
+            for tabla in tablas:
+                print(f"\n{tabla}:")
+                for nombre, desde, hasta, filas in listar_particiones(conexion, tabla):
+                    rango = f"{desde} a {hasta}" if desde else "default"
+                    print(f"  {nombre:<32}{rango:<26}{filas:>12,} filas (estimado)")
+        elif args.comando == "crear":
+            conexion.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": CLAVE_BLOQUEO_PARTICIONES})
+            for tabla in tablas:
+                creadas = crear_particiones(conexion, tabla, args.desde, sumar_meses(args.hasta, 1))
+                print(f"{tabla}: {len(creadas)} particiones creadas")
+        elif args.comando == "desacoplar":
+            conexion.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": CLAVE_BLOQUEO_PARTICIONES})
+            for tabla in tablas:
+                desacopladas = desacoplar_particiones(conexion, tabla, args.antes)
+                print(f"{tabla}: {len(desacopladas)} particiones desacopladas {desacopladas}")
+        else:
+            fallos = 0
+            for r in verificar_poda(conexion, args.mes):
+                estado = "OK " if r["ok"] else "FALLA"
+                print(f"[{estado}] {r['tabla']} / {r['consulta']}: {', '.join(r['particiones_leidas']) or '-'}")
+                fallos += not r["ok"]
+            return 1 if fallos else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Perfil de arranque en frío de la API LOGIFARMA PQR
+
+Mide tres cosas:
+  1. Tiempo de importación de `server` con `python -X importtime`
+  2. Tiempo hasta la primera petición atendida por uvicorn
+  3. Memoria residente (RSS) del proceso maestro y de cada worker
+
+Si se supera alguno de los presupuestos, o si un módulo pesado de reportes
+(reportlab, openpyxl, matplotlib) se carga durante el arranque, el script
+termina con código 1 para que la regresión falle en CI.
+
+Uso:
+    python perfil_arranque.py                  # perfil completo (requiere BD)
+    python perfil_arranque.py --solo-import    # solo tiempos de importación
+"""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+
+# Módulos que no deben cargarse al arrancar un worker
+MODULOS_DIFERIDOS = ("reportlab", "openpyxl", "matplotlib", "reportes_service")
+
+LINEA_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def medir_importacion(modulo: str = "server"):
+    """Importa el módulo en un intérprete nuevo y devuelve (total_ms, filas)"""
+    resultado = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {modulo}:\n{resultado.stderr[-2000:]}")
+
+    filas = []
+    for linea in resultado.stderr.splitlines():
+        m = LINEA_IMPORTTIME.match(linea)
+        if m:
+            propio_us, acumulado_us, sangria, nombre = m.groups()
+            filas.append({
+                "modulo": nombre,
+                "propio_ms": int(propio_us) / 1000,
+                "acumulado_ms": int(acumulado_us) / 1000,
+                "nivel": (len(sangria) - 1) // 2,
+            })
+
+    # El tiempo total es la suma de los módulos de primer nivel
+    total_ms = sum(f["acumulado_ms"] for f in filas if f["nivel"] == 0)
+    return total_ms, filas
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> float:
+    """Lee VmRSS de /proc (Linux); devuelve 0 si no está disponible"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _workers(pid: int):
+    """PIDs de los workers de uvicorn (hijos lanzados con multiprocessing.spawn)"""
+    workers = []
+    for entrada in Path("/proc").iterdir():
+        if not entrada.name.isdigit():
+            continue
+        try:
+            stat = (entrada / "stat").read_text()
+            cmdline = (entrada / "cmdline").read_bytes()
+        except OSError:
+            continue
+        # El campo 4 es el PPID; el nombre (campo 2) puede contener espacios
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        # Se descarta el resource_tracker de multiprocessing
+        if ppid == pid and b"spawn_main" in cmdline:
+            workers.append(int(entrada.name))
+    return workers
+
+
+def medir_servidor(workers: int, timeout_s: float = 60.0):
+    """Levanta uvicorn y mide el tiempo hasta la primera respuesta y la RSS por worker"""
+    puerto = _puerto_libre()
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app",
+         "--host", "127.0.0.1", "--port", str(puerto),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+    )
+    try:
+        primera_peticion_ms = None
+        while time.perf_counter() - inicio < timeout_s:
+            if proceso.poll() is not None:
+                raise RuntimeError("uvicorn terminó antes de atender la primera petición")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/", timeout=1) as r:
+                    if r.status == 200:
+                        primera_peticion_ms = (time.perf_counter() - inicio) * 1000
+                        break
+            except OSError:
+                time.sleep(0.05)
+        if primera_peticion_ms is None:
+            raise RuntimeError(f"Sin respuesta de uvicorn tras {timeout_s}s")
+
+        # Dar tiempo a que el resto de workers termine de arrancar
+        time.sleep(1.0)
+        pids = _workers(proceso.pid) if workers > 1 else [proceso.pid]
+        rss = {pid: _rss_mb(pid) for pid in pids}
+        return primera_peticion_ms, _rss_mb(proceso.pid), rss
+    finally:
+        proceso.terminate()
+        try:
+            proceso.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Perfil de arranque en frío de la API")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--top", type=int, default=15, help="Importaciones más costosas a mostrar")
+    parser.add_argument("--solo-import", action="store_true", help="No levantar uvicorn")
+    parser.add_argument("--presupuesto-import-ms", type=float,
+                        default=float(os.environ.get("PRESUPUESTO_IMPORT_MS", "1500")))
+    parser.add_argument("--presupuesto-primera-peticion-ms", type=float,
+                        default=float(os.environ.get("PRESUPUESTO_PRIMERA_PETICION_MS", "5000")))
+    parser.add_argument("--presupuesto-rss-mb", type=float,
+                        default=float(os.environ.get("PRESUPUESTO_RSS_MB", "150")))
+    args = parser.parse_args()
+
+    errores = []
+
+    total_ms, filas = medir_importacion()
+    print(f"Importación de server: {total_ms:.1f} ms (presupuesto {args.presupuesto_import_ms:.0f} ms)")
+    print(f"{'acumulado (ms)':>15} {'propio (ms)':>12}  módulo")
+    for fila in sorted(filas, key=lambda f: f["acumulado_ms"], reverse=True)[:args.top]:
+        print(f"{fila['acumulado_ms']:>15.1f} {fila['propio_ms']:>12.1f}  {fila['modulo']}")
+
+    if total_ms > args.presupuesto_import_ms:
+        errores.append(f"importación {total_ms:.1f} ms > {args.presupuesto_import_ms:.0f} ms")
+
+    cargados = sorted({
+        f["modulo"] for f in filas
+        if f["modulo"].split(".")[0] in MODULOS_DIFERIDOS
+    })
+    if cargados:
+        errores.append(f"módulos de reportes cargados en el arranque: {', '.join(cargados)}")
+
+    if not args.solo_import:
+        primera_ms, rss_maestro, rss_workers = medir_servidor(args.workers)
+        print(f"\nPrimera petición: {primera_ms:.1f} ms (presupuesto {args.presupuesto_primera_peticion_ms:.0f} ms)")
+        print(f"RSS proceso maestro: {rss_maestro:.1f} MB")
+        for pid, rss in rss_workers.items():
+            print(f"RSS worker {pid}: {rss:.1f} MB (presupuesto {args.presupuesto_rss_mb:.0f} MB)")
+            if rss > args.presupuesto_rss_mb:
+                errores.append(f"worker {pid} usa {rss:.1f} MB > {args.presupuesto_rss_mb:.0f} MB")
+        if primera_ms > args.presupuesto_primera_peticion_ms:
+            errores.append(f"primera petición {primera_ms:.1f} ms > {args.presupuesto_primera_peticion_ms:.0f} ms")
+
+    if errores:
+        print("\nPRESUPUESTO EXCEDIDO:")
+        for error in errores:
+            print(f"  - {error}")
+        return 1
+
+    print("\nArranque dentro del presupuesto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Perfilado de peticiones y registro de consultas SQL lentas
+
+Consultas lentas (siempre activo): toda sentencia que supere
+SQL_LENTO_UMBRAL_MS se registra como JSON en el logger `logifarma.sql_lento`.
+Si es una lectura simple, se le agrega el plan de `EXPLAIN (ANALYZE, BUFFERS)`,
+que se obtiene en un hilo aparte con otra conexión. Como EXPLAIN ANALYZE vuelve
+a ejecutar la consulta, se limita a SQL_LENTO_EXPLAIN_POR_MINUTO planes y se
+omiten los SELECT con efectos (bloqueos advisory, pg_notify, FOR UPDATE/SHARE):
+repetirlos tomaría otra vez los bloqueos o enviaría de nuevo las notificaciones.
+
+Perfil de una petición (opcional): registra todas sus sentencias con su
+duración y, si se pide, una traza de pyinstrument (si está instalado) o de
+cProfile. Se activa de dos formas:
+  - header `X-Perfilar: <PERFILADO_TOKEN>` (y opcionalmente
+    `X-Perfilar-Traza: pyinstrument|cprofile`)
+  - muestreo: PERFILADO_MUESTREO es la fracción de peticiones perfiladas
+Solo se traza una petición a la vez; las demás perfiladas capturan solo SQL.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger("logifarma.perfilado")
+logger_sql_lento = logging.getLogger("logifarma.sql_lento")
+
+SQL_LENTO_UMBRAL_MS = float(os.environ.get('SQL_LENTO_UMBRAL_MS', '500'))
+SQL_LENTO_EXPLAIN = os.environ.get('SQL_LENTO_EXPLAIN', 'true').lower() == 'true'
+SQL_LENTO_EXPLAIN_POR_MINUTO = int(os.environ.get('SQL_LENTO_EXPLAIN_POR_MINUTO', '6'))
+SQL_LENTO_EXPLAIN_TIMEOUT_MS = int(os.environ.get('SQL_LENTO_EXPLAIN_TIMEOUT_MS', '30000'))
+# Los parámetros pueden tener datos de pacientes; por defecto no se registran
+SQL_INCLUIR_PARAMETROS = os.environ.get('SQL_INCLUIR_PARAMETROS', 'false').lower() == 'true'
+
+PERFILADO_TOKEN = os.environ.get('PERFILADO_TOKEN') or None
+PERFILADO_MUESTREO = float(os.environ.get('PERFILADO_MUESTREO', '0'))
+PERFILADO_TRAZA = os.environ.get('PERFILADO_TRAZA', '')  # traza por defecto: pyinstrument, cprofile o vacío
+PERFILADO_DIRECTORIO = os.environ.get('PERFILADO_DIRECTORIO') or None  # guarda las trazas completas
+
+MAX_LARGO_SQL = 4000
+
+# SELECT que no se pueden volver a ejecutar sin repetir un efecto
+_SQL_CON_EFECTOS = re.compile(
+    r"pg_advisory|pg_try_advisory|pg_notify|\bFOR\s+(NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(KEY\s+)?SHARE\b",
+    re.IGNORECASE,
+)
+
+class _Peticion:
+    __slots__ = ("id", "metodo", "ruta", "consultas")
+
+    def __init__(self, metodo: str, ruta: str, perfilar: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.metodo = metodo
+        self.ruta = ruta
+        # Solo las peticiones perfiladas acumulan sus sentencias
+        self.consultas = [] if perfilar else None
+
+_peticion: ContextVar[Optional[_Peticion]] = ContextVar("peticion_perfilada", default=None)
+
+_ejecutor_explain = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain-sql-lento")
+_lock_explain = threading.Lock()
+_explains_recientes = []
+_lock_traza = threading.Lock()
+
+def _recortar_sql(sentencia: str) -> str:
+    sentencia = " ".join(sentencia.split())
+    return sentencia if len(sentencia) <= MAX_LARGO_SQL else sentencia[:MAX_LARGO_SQL] + "..."
+
+def _cupo_explain() -> bool:
+    """Ventana deslizante de un minuto para acotar los EXPLAIN ANALYZE"""
+    ahora = time.monotonic()
+    with _lock_explain:
+        while _explains_recientes and ahora - _explains_recientes[0] > 60:
+            _explains_recientes.pop(0)
+        if len(_explains_recientes) >= SQL_LENTO_EXPLAIN_POR_MINUTO:
+            return False
+        _explains_recientes.append(ahora)
+        return True
+
+def _es_lectura_simple(sentencia: str) -> bool:
+    """Si la sentencia se puede repetir con EXPLAIN ANALYZE sin efectos"""
+    return sentencia.lstrip().upper().startswith("SELECT") and not _SQL_CON_EFECTOS.search(sentencia)
+
+def _explicar(motor, sentencia: str, parametros) -> Optional[object]:
+    """
+    Plan de EXPLAIN ANALYZE en una conexión aparte. La conexión se descarta en
+    vez de volver al pool, para que no quede estado de sesión.
+    """
+    conexion = motor.raw_connection()
+    try:
+        cursor = conexion.cursor()
+        try:
+            cursor.execute(f"SET LOCAL statement_timeout = {SQL_LENTO_EXPLAIN_TIMEOUT_MS}")
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sentencia, parametros)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+            conexion.rollback()
+    finally:
+        conexion.invalidate()
+
+def _registrar_sql_lento(motor, registro: dict, sentencia: str, parametros, explicar: bool):
+    if explicar:
+        try:
+            registro["plan"] = _explicar(motor, sentencia, parametros)
+        except Exception as e:
+            registro["error_plan"] = str(e)
+    logger_sql_lento.warning(json.dumps(registro, ensure_ascii=False, default=str))
+
+def instrumentar_engine(motor):
+    """Mide cada sentencia de `motor` para el log de lentas y el perfil de la petición"""
+
+    @event.listens_for(motor, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("inicios_perfilado", []).append(time.perf_counter())
+
+    @event.listens_for(motor, "after_cursor_execute")
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        duracion_ms = (time.perf_counter() - conn.info["inicios_perfilado"].pop()) * 1000
+        peticion = _peticion.get()
+        if peticion is not None and peticion.consultas is not None:
+            peticion.consultas.append((statement, duracion_ms))
+        if duracion_ms < SQL_LENTO_UMBRAL_MS:
+            return
+
+        registro = {
+            "evento": "sql_lento",
+            "duracion_ms": round(duracion_ms, 1),
+            "sql": _recortar_sql(statement),
+            "peticion_id": peticion.id if peticion else None,
+            "metodo": peticion.metodo if peticion else None,
+            "ruta": peticion.ruta if peticion else None,
+        }
+        if SQL_INCLUIR_PARAMETROS:
+            registro["parametros"] = parameters
+        explicar = (
+            SQL_LENTO_EXPLAIN
+            and motor.dialect.name == "postgresql"
+            and not executemany
+            and _es_lectura_simple(statement)
+            and _cupo_explain()
+        )
+        _ejecutor_explain.submit(_registrar_sql_lento, motor, registro, statement, parameters, explicar)
+
+    @event.listens_for(motor, "handle_error")
+    def _error(contexto):
+        inicios = contexto.connection.info.get("inicios_perfilado") if contexto.connection is not None else None
+        if inicios:
+            inicios.pop()
+
+class _Traza:
+    """Traza de una petición con pyinstrument (modo async) o cProfile"""
+
+    def __init__(self, tipo: str):
+        self.tipo = tipo
+        self._perfilador = None
+        if tipo == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+                self._perfilador = Profiler(async_mode="enabled")
+            except ImportError:
+                self.tipo = "cprofile"
+        if self.tipo == "cprofile":
+            # cProfile mide todo el hilo del event loop, incluidas otras peticiones
+            # concurrentes, y no ve los endpoints síncronos (corren en el threadpool)
+            self._perfilador = cProfile.Profile()
+
+    def iniciar(self):
+        if self.tipo == "pyinstrument":
+            self._perfilador.start()
+        else:
+            self._perfilador.enable()
+
+    def detener(self, peticion_id: str) -> str:
+        if self.tipo == "pyinstrument":
+            self._perfilador.stop()
+            if PERFILADO_DIRECTORIO:
+                with open(os.path.join(PERFILADO_DIRECTORIO, f"{peticion_id}.html"), "w") as f:
+                    f.write(self._perfilador.output_html())
+            return self._perfilador.output_text(unicode=True, color=False)
+
+        self._perfilador.disable()
+        if PERFILADO_DIRECTORIO:
+            self._perfilador.dump_stats(os.path.join(PERFILADO_DIRECTORIO, f"{peticion_id}.prof"))
+        salida = io.StringIO()
+        pstats.Stats(self._perfilador, stream=salida).sort_stats("cumulative").print_stats(30)
+        return salida.getvalue()
+
+class MiddlewarePerfilado:
+    def __init__(self, app):
+        self.app = app
+
+    def _perfilar(self, headers: dict) -> bool:
+        if PERFILADO_TOKEN and headers.get(b"x-perfilar", b"").decode() == PERFILADO_TOKEN:
+            return True
+        return PERFILADO_MUESTREO > 0 and random.random() < PERFILADO_MUESTREO
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        perfilar = self._perfilar(headers)
+        peticion = _Peticion(scope["method"], scope["path"], perfilar)
+        token = _peticion.set(peticion)
+        if not perfilar:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _peticion.reset(token)
+            return
+
+        tipo_traza = headers.get(b"x-perfilar-traza", b"").decode() or PERFILADO_TRAZA
+        traza = None
+        if tipo_traza in ("pyinstrument", "cprofile") and _lock_traza.acquire(blocking=False):
+            traza = _Traza(tipo_traza)
+            traza.iniciar()
+
+        estado = [500]
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+                db_ms = sum(d for _, d in peticion.consultas)
+                mensaje.setdefault("headers", [])
+                mensaje["headers"] = list(mensaje["headers"]) + [
+                    (b"x-perfil-id", peticion.id.encode()),
+                    (b"server-timing", f"db;dur={db_ms:.1f}".encode()),
+                ]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            texto_traza = None
+            if traza is not None:
+                try:
+                    texto_traza = traza.detener(peticion.id)
+                finally:
+                    _lock_traza.release()
+            _peticion.reset(token)
+
+            ruta = scope.get("route")
+            logger.info(json.dumps({
+                "evento": "perfil_peticion",
+                "peticion_id": peticion.id,
+                "metodo": peticion.metodo,
+                "ruta": ruta.path if ruta is not None else peticion.ruta,
+                "path": peticion.ruta,
+                "estado": estado[0],
+                "duracion_ms": round((time.perf_counter() - inicio) * 1000, 1),
+                "total_sql_ms": round(sum(d for _, d in peticion.consultas), 1),
+                "consultas": [
+                    {"sql": _recortar_sql(s), "duracion_ms": round(d, 2)} for s, d in peticion.consultas
+                ],
+                "traza": texto_traza,
+            }, ensure_ascii=False))
@@ -0,0 +1,132 @@
+"""
+Periodos de agregación (hora, día, semana, mes) en la zona horaria de operación
+
+Las fechas se guardan en la base de datos como UTC sin zona horaria; los
+reportes y métricas agrupan por la hora local de Colombia (America/Bogota).
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Hashable, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import func
+
+ZONA_HORARIA = os.environ.get('ZONA_HORARIA', 'America/Bogota')
+ZONA = ZoneInfo(ZONA_HORARIA)
+
+# agrupar_por -> unidad de date_trunc en PostgreSQL
+UNIDADES_PERIODO = {
+    "hora": "hour",
+    "dia": "day",
+    "semana": "week",
+    "mes": "month",
+}
+
+def hora_local(columna):
+    """Expresión SQL que convierte una columna UTC sin zona a hora local sin zona"""
+    return func.timezone(ZONA_HORARIA, func.timezone('UTC', columna))
+
+def ahora_local() -> datetime:
+    return datetime.now(ZONA).replace(tzinfo=None)
+
+def local_a_utc(fecha: datetime) -> datetime:
+    """Hora local (sin zona) -> UTC sin zona, para filtrar columnas indexadas"""
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=ZONA)
+    return fecha.astimezone(timezone.utc).replace(tzinfo=None)
+
+def utc_a_local(fecha: datetime) -> datetime:
+    """UTC (con o sin zona) -> hora local sin zona"""
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.astimezone(ZONA).replace(tzinfo=None)
+
+def truncar(fecha: datetime, agrupar_por: str) -> datetime:
+    """Equivalente en Python de date_trunc (semanas ISO, inician el lunes)"""
+    if agrupar_por == "hora":
+        return fecha.replace(minute=0, second=0, microsecond=0)
+    inicio_dia = fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+    if agrupar_por == "dia":
+        return inicio_dia
+    if agrupar_por == "semana":
+        return inicio_dia - timedelta(days=inicio_dia.weekday())
+    if agrupar_por == "mes":
+        return inicio_dia.replace(day=1)
+    raise ValueError(f"Agrupación no soportada: {agrupar_por}")
+
+def siguiente(periodo: datetime, agrupar_por: str) -> datetime:
+    """Inicio del periodo siguiente a `periodo` (que ya debe estar truncado)"""
+    if agrupar_por == "hora":
+        return periodo + timedelta(hours=1)
+    if agrupar_por == "dia":
+        return periodo + timedelta(days=1)
+    if agrupar_por == "semana":
+        return periodo + timedelta(days=7)
+    if agrupar_por == "mes":
+        if periodo.month == 12:
+            return periodo.replace(year=periodo.year + 1, month=1)
+        return periodo.replace(month=periodo.month + 1)
+    raise ValueError(f"Agrupación no soportada: {agrupar_por}")
+
+def etiqueta(periodo: datetime, agrupar_por: str) -> str:
+    if agrupar_por == "hora":
+        return periodo.strftime('%Y-%m-%d %H:00')
+    if agrupar_por == "mes":
+        return periodo.strftime('%Y-%m')
+    return periodo.strftime('%Y-%m-%d')
+
+class CachePeriodosCerrados:
+    """
+    Caché en memoria de resultados por periodo ya cerrado.
+
+    Un periodo cerrado solo cambia si se modifica un caso creado dentro de él
+    o si se recalcula el agregado de uno de sus días, por eso se invalida
+    explícitamente con `invalidar_fecha` e `invalidar_dia`. Cada worker tiene su
+    propia caché; quien la usa debe invalidarla desde el bus de eventos para que
+    todos la descarten. El TTL acota la desactualización si se pierde un evento.
+    """
+
+    def __init__(self, ttl_segundos: int = 3600, max_entradas: int = 20000):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self._datos: Dict[Hashable, tuple] = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, agrupar_por: str, periodo: datetime) -> Optional[dict]:
+        with self._lock:
+            entrada = self._datos.get((agrupar_por, periodo))
+            if entrada is None:
+                return None
+            valor, expira = entrada
+            if expira < time.monotonic():
+                del self._datos[(agrupar_por, periodo)]
+                return None
+            return valor
+
+    def guardar(self, agrupar_por: str, periodo: datetime, valor: dict):
+        with self._lock:
+            if len(self._datos) >= self.max_entradas:
+                self._datos.clear()
+            self._datos[(agrupar_por, periodo)] = (valor, time.monotonic() + self.ttl_segundos)
+
+    def invalidar_fecha(self, fecha_utc: datetime):
+        """Descarta los periodos (de cualquier agrupación) que contienen la fecha"""
+        local = utc_a_local(fecha_utc)
+        with self._lock:
+            for agrupar_por in UNIDADES_PERIODO:
+                self._datos.pop((agrupar_por, truncar(local, agrupar_por)), None)
+
+    def invalidar_dia(self, dia: date):
+        """Descarta los periodos (de cualquier agrupación) que se solapan con el día local"""
+        inicio = datetime.combine(dia, datetime.min.time())
+        with self._lock:
+            for hora in range(24):
+                self._datos.pop(("hora", inicio + timedelta(hours=hora)), None)
+            for agrupar_por in ("dia", "semana", "mes"):
+                self._datos.pop((agrupar_por, truncar(inicio, agrupar_por)), None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
@@ -0,0 +1,163 @@
+"""
+Prueba local del enrutamiento de lecturas a la réplica
+
+Levanta la API contra dos bases de datos: una hace de primaria y la otra de
+réplica. Por defecto son dos archivos SQLite temporales; con --primaria y
+--replica se pueden usar dos bases PostgreSQL (se borran y recrean las tablas,
+por eso se exige --confirmar-borrado).
+
+Como no hay replicación real, el retraso se simula con la tabla
+`lag_simulado` de la réplica (REPLICA_LAG_SQL) y cada base tiene un paciente
+que solo existe en ella, para saber qué base respondió cada petición.
+
+Uso:
+    python probar_replica.py
+    python probar_replica.py --primaria postgresql://... --replica postgresql://... --confirmar-borrado
+"""
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+PACIENTE_PRIMARIA = "SOLO-PRIMARIA"
+PACIENTE_REPLICA = "SOLO-REPLICA"
+
+
+def _configurar_entorno(primaria: str, replica: str):
+    # Debe ejecutarse antes de importar database
+    os.environ["DATABASE_URL"] = primaria
+    os.environ["DATABASE_READ_URL"] = replica
+    os.environ["REPLICA_LAG_SQL"] = "SELECT segundos FROM lag_simulado"
+    os.environ["REPLICA_MAX_LAG_SEGUNDOS"] = "5"
+    os.environ["REPLICA_VERIFICACION_SEGUNDOS"] = "0"
+
+
+def _preparar_bases():
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+    import database
+    import models
+
+    for motor, marca in ((database.engine, PACIENTE_PRIMARIA), (database.read_engine, PACIENTE_REPLICA)):
+        database.Base.metadata.drop_all(bind=motor)
+        database.Base.metadata.create_all(bind=motor)
+        with Session(motor) as db:
+            db.add(models.Usuario(
+                username="admin", password_hash="x", nombre_completo="Administrador",
+                email="admin@logifarma.local", rol=models.RolEnum.ADMINISTRADOR, activo=True
+            ))
+            for identificacion in ("1000", marca):
+                db.add(models.Paciente(
+                    identificacion=identificacion, nombre="Paciente", apellidos=identificacion,
+                    celular="3000000000", direccion="N/A", departamento="Huila", ciudad="Neiva"
+                ))
+            db.commit()
+
+    with database.read_engine.begin() as conexion:
+        conexion.execute(text("DROP TABLE IF EXISTS lag_simulado"))
+        conexion.execute(text("CREATE TABLE lag_simulado (segundos FLOAT)"))
+        conexion.execute(text("INSERT INTO lag_simulado VALUES (0)"))
+
+
+def _simular_lag(segundos):
+    from sqlalchemy import text
+    import database
+    with database.read_engine.begin() as conexion:
+        if segundos is None:
+            # Réplica caída: la consulta de retraso falla
+            conexion.execute(text("DROP TABLE IF EXISTS lag_simulado"))
+        else:
+            conexion.execute(text("UPDATE lag_simulado SET segundos = :s"), {"s": segundos})
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Prueba local de lecturas en réplica")
+    parser.add_argument("--primaria", help="URL de la base que hace de primaria")
+    parser.add_argument("--replica", help="URL de la base que hace de réplica")
+    parser.add_argument("--confirmar-borrado", action="store_true",
+                        help="Permite borrar y recrear las tablas de bases que no son temporales")
+    args = parser.parse_args()
+
+    if bool(args.primaria) != bool(args.replica):
+        parser.error("--primaria y --replica se usan juntas")
+    if args.primaria:
+        if not args.confirmar_borrado:
+            parser.error("las tablas de ambas bases se borran; agregue --confirmar-borrado")
+        primaria, replica = args.primaria, args.replica
+    else:
+        directorio = Path(tempfile.mkdtemp(prefix="logifarma_replica_"))
+        primaria = f"sqlite:///{directorio / 'primaria.db'}"
+        replica = f"sqlite:///{directorio / 'replica.db'}"
+
+    _configurar_entorno(primaria, replica)
+    sys.path.insert(0, str(Path(__file__).parent))
+    _preparar_bases()
+
+    from fastapi.testclient import TestClient
+    import database
+    import models
+    import server
+
+    with database.SessionLocal() as db:
+        admin = db.query(models.Usuario).filter(models.Usuario.username == "admin").first()
+        db.expunge(admin)
+    server.app.dependency_overrides[server.get_current_user] = lambda: admin
+    server.app.dependency_overrides[server.get_current_admin_user] = lambda: admin
+    cliente = TestClient(server.app)
+
+    def base_que_responde() -> str:
+        respuesta = cliente.get("/api/pacientes")
+        respuesta.raise_for_status()
+        identificaciones = {p["identificacion"] for p in respuesta.json()}
+        if PACIENTE_REPLICA in identificaciones:
+            return "replica"
+        if PACIENTE_PRIMARIA in identificaciones:
+            return "primaria"
+        return "desconocida"
+
+    fallos = []
+
+    def verificar(descripcion: str, obtenido, esperado):
+        estado = "OK " if obtenido == esperado else "FALLA"
+        print(f"[{estado}] {descripcion}: {obtenido} (esperado {esperado})")
+        if obtenido != esperado:
+            fallos.append(descripcion)
+
+    print(f"Primaria: {primaria}\nRéplica:  {replica}\n")
+
+    verificar("Listado con réplica al día", base_que_responde(), "replica")
+
+    _simular_lag(60)
+    verificar("Listado con 60s de retraso", base_que_responde(), "primaria")
+
+    _simular_lag(1)
+    verificar("Listado con 1s de retraso", base_que_responde(), "replica")
+
+    nuevo = cliente.post("/api/pacientes", json={
+        "identificacion": "2000", "nombre": "Nuevo", "apellidos": "Paciente", "celular": "1",
+        "direccion": "N/A", "departamento": "Huila", "ciudad": "Neiva"
+    })
+    with database.SessionLocal() as db:
+        en_primaria = db.query(models.Paciente).filter(models.Paciente.identificacion == "2000").count()
+    verificar("Escritura en la primaria", (nuevo.status_code, en_primaria), (200, 1))
+
+    if database.engine.dialect.name == "postgresql":
+        # Las métricas usan funciones de PostgreSQL; con SQLite solo se prueban listados
+        for ruta in ("/api/metricas/dashboard", "/api/metricas/casos-por-motivo?inicio=2025-01-01&fin=2025-01-31"):
+            verificar(f"GET {ruta} en la réplica", cliente.get(ruta).status_code, 200)
+
+    _simular_lag(None)
+    verificar("Listado con la réplica caída", base_que_responde(), "primaria")
+
+    print(f"\nLecturas en réplica: {database.guardia_replica.lecturas_replica}, "
+          f"en primaria: {database.guardia_replica.lecturas_primaria}")
+    if fallos:
+        print(f"\n{len(fallos)} verificaciones fallaron")
+        return 1
+    print("\nEnrutamiento de lecturas correcto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
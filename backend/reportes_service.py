@@ -167,6 +167,36 @@ class ReportesService:
         buffer.seek(0)
         return buffer
 
+    @staticmethod
+    def _desgloses_casos_periodo(datos: Dict) -> List[Dict]:
+        """Secciones de desglose del reporte de casos por período con su gráfica"""
+        return [
+            {
+                "titulo": "Casos por Motivo",
+                "columna": "Motivo",
+                "filas": [(d['motivo'], d['cantidad']) for d in datos.get('por_motivo', [])],
+                "grafica": ReportesService.generar_grafica_barras,
+            },
+            {
+                "titulo": "Casos por Prioridad",
+                "columna": "Prioridad",
+                "filas": [(d['prioridad'], d['cantidad']) for d in datos.get('por_prioridad', [])],
+                "grafica": ReportesService.generar_grafica_barras,
+            },
+            {
+                "titulo": "Casos por Origen",
+                "columna": "Origen",
+                "filas": [(d['origen'], d['cantidad']) for d in datos.get('por_origen', [])],
+                "grafica": ReportesService.generar_grafica_barras,
+            },
+            {
+                "titulo": "Casos por Día",
+                "columna": "Día",
+                "filas": [(d['dia'], d['cantidad']) for d in datos.get('por_dia', [])],
+                "grafica": ReportesService.generar_grafica_linea,
+            },
+        ]
+
     @staticmethod
     def generar_pdf_casos_periodo(datos: Dict, fecha_inicio: str, fecha_fin: str) -> io.BytesIO:
         """Genera reporte PDF de casos por período"""
@@ -209,6 +239,108 @@ class ReportesService:
         ]))
         story.append(t)
 
+        # Desgloses: tabla y gráfica por cada dimensión
+        for seccion in ReportesService._desgloses_casos_periodo(datos):
+            if not seccion['filas']:
+                continue
+
+            story.append(PageBreak())
+            story.append(Paragraph(f"<b>{seccion['titulo']}</b>", styles['Heading2']))
+
+            table_data = [[seccion['columna'], 'Cantidad']]
+            table_data.extend([str(etiqueta), str(cantidad)] for etiqueta, cantidad in seccion['filas'])
+
+            t = Table(table_data)
+            t.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#059669')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('GRID', (0, 0), (-1, -1), 1, colors.grey)
+            ]))
+            story.append(t)
+            story.append(Spacer(1, 20))
+
+            grafica = seccion['grafica'](
+                [{'label': str(etiqueta), 'value': cantidad} for etiqueta, cantidad in seccion['filas']],
+                seccion['columna'], 'Cantidad', seccion['titulo']
+            )
+            story.append(Image(grafica, width=6 * inch, height=3.6 * inch))
+
         doc.build(story)
         buffer.seek(0)
         return buffer
+
+    @staticmethod
+    def generar_excel_casos_periodo(datos: Dict, fecha_inicio: str, fecha_fin: str) -> io.BytesIO:
+        """Genera reporte Excel de casos por período"""
+        from openpyxl.drawing.image import Image as ExcelImage
+
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Resumen"
+
+        # Estilos
+        header_font = Font(bold=True, color="FFFFFF", size=12)
+        header_fill = PatternFill(start_color="059669", end_color="059669", fill_type="solid")
+        border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+
+        # Encabezados
+        ws['A1'] = "REPORTE DE CASOS POR PERÍODO"
+        ws['A1'].font = Font(bold=True, size=16, color="059669")
+        ws['A2'] = f"Período: {fecha_inicio} a {fecha_fin}"
+        ws['A3'] = f"Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+
+        # Resumen ejecutivo
+        resumen = [
+            ('Total de Casos', datos.get('total_casos', 0)),
+            ('Casos Abiertos', datos.get('abiertos', 0)),
+            ('Casos Cerrados', datos.get('cerrados', 0)),
+            ('Casos en Proceso', datos.get('en_proceso', 0)),
+            ('Tiempo Promedio Resolución (horas)', round(datos.get('tiempo_promedio', 0), 2)),
+        ]
+        for row_idx, (etiqueta, valor) in enumerate(resumen, start=5):
+            ws.cell(row=row_idx, column=1, value=etiqueta).border = border
+            ws.cell(row=row_idx, column=1).font = Font(bold=True)
+            ws.cell(row=row_idx, column=2, value=valor).border = border
+
+        ws.column_dimensions['A'].width = 38
+        ws.column_dimensions['B'].width = 15
+
+        # Una hoja por desglose, con su tabla y su gráfica
+        for seccion in ReportesService._desgloses_casos_periodo(datos):
+            hoja = wb.create_sheet(title=seccion['titulo'].replace("Casos por ", "Por "))
+
+            for col, header in enumerate([seccion['columna'], 'Cantidad'], start=1):
+                cell = hoja.cell(row=1, column=col)
+                cell.value = header
+                cell.font = header_font
+                cell.fill = header_fill
+                cell.border = border
+                cell.alignment = Alignment(horizontal='center')
+
+            for row_idx, (etiqueta, cantidad) in enumerate(seccion['filas'], start=2):
+                hoja.cell(row=row_idx, column=1, value=str(etiqueta)).border = border
+                hoja.cell(row=row_idx, column=2, value=cantidad).border = border
+
+            hoja.column_dimensions['A'].width = 40
+            hoja.column_dimensions['B'].width = 15
+
+            if seccion['filas']:
+                grafica = seccion['grafica'](
+                    [{'label': str(etiqueta), 'value': cantidad} for etiqueta, cantidad in seccion['filas']],
+                    seccion['columna'], 'Cantidad', seccion['titulo']
+                )
+                imagen = ExcelImage(grafica)
+                imagen.width, imagen.height = 640, 384
+                hoja.add_image(imagen, "D2")
+
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        return buffer
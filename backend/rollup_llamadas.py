@@ -0,0 +1,224 @@
+"""
+Agregado de llamadas (interacciones) para /metricas/llamadas
+
+La tabla `metricas_llamadas` guarda conteos de interacciones por (día, hora
+local, campaña y agente de OmniLeads). Las interacciones se agrupan por
+`fecha_registro`, la clave de partición: `datetime_llamada` puede venir vacía
+desde OmniLeads.
+
+Las interacciones no se modifican después de registrarse, así que el refresco
+incremental usa una marca de agua sobre el id (`MarcaAgregacion.ultimo_id`):
+recalcula los días que recibieron interacciones nuevas desde la ejecución
+anterior, aunque sean días pasados (importaciones), más los días que estaban en
+curso en ese momento. El archivado mueve interacciones a interacciones_archivo
+sin cambiar los conteos, porque el recálculo lee ambas tablas.
+
+Los endpoints leen de `fuente_llamadas`, que combina el agregado para los días
+ya consolidados con las interacciones crudas del resto del rango.
+"""
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Sequence
+
+from sqlalchemy import Integer, cast, extract, func, insert, literal, select, text, union_all
+from sqlalchemy.orm import Session
+
+from database import engine
+from models import Interaccion, InteraccionArchivada, MarcaAgregacion, MetricaLlamada
+import periodos
+
+logger = logging.getLogger(__name__)
+
+MARCA_METRICAS_LLAMADAS = "metricas_llamadas"
+
+DIMENSIONES = (
+    "dia", "hora", "omnileads_campaign_id", "omnileads_campaign_name", "omnileads_campaign_type",
+    "agent_username", "agent_name"
+)
+
+# Identificador del advisory lock; distinto del de rollup_metricas para que ambos refrescos corran en paralelo
+CLAVE_BLOQUEO_REFRESCO = 7301002
+
+# Días recalculados por transacción en el refresco
+DIAS_POR_LOTE = 31
+
+# Las interacciones archivadas siguen contando en los días en que se registraron
+MODELOS_INTERACCIONES = (Interaccion, InteraccionArchivada)
+
+def _dia_local(modelo=Interaccion):
+    return func.date(periodos.hora_local(modelo.fecha_registro))
+
+def _hora_local(modelo=Interaccion):
+    return cast(extract('hour', periodos.hora_local(modelo.fecha_registro)), Integer)
+
+def _inicio_dia_utc(dia: date) -> datetime:
+    return periodos.local_a_utc(datetime.combine(dia, datetime.min.time()))
+
+def _columnas_crudas(modelo=Interaccion):
+    """Dimensiones calculadas sobre la tabla interacciones (o interacciones_archivo)"""
+    # OmniLeads envía cadenas vacías cuando no tiene el dato; cuentan como sin campaña o sin agente
+    return {
+        "dia": _dia_local(modelo),
+        "hora": _hora_local(modelo),
+        "omnileads_campaign_id": func.nullif(modelo.omnileads_campaign_id, ''),
+        "omnileads_campaign_name": func.nullif(modelo.omnileads_campaign_name, ''),
+        "omnileads_campaign_type": func.nullif(modelo.omnileads_campaign_type, ''),
+        "agent_username": func.nullif(modelo.agent_username, ''),
+        "agent_name": func.nullif(modelo.agent_name, ''),
+    }
+
+def _recalcular_dias(db: Session, dias: List[date]):
+    """Reemplaza las filas del agregado de los días indicados"""
+    desde = _inicio_dia_utc(min(dias))
+    hasta = _inicio_dia_utc(max(dias) + timedelta(days=1))
+
+    db.query(MetricaLlamada).filter(MetricaLlamada.dia.in_(dias)).delete(synchronize_session=False)
+
+    # Una inserción por tabla, como en rollup_metricas: los consumidores suman
+    for modelo in MODELOS_INTERACCIONES:
+        columnas = _columnas_crudas(modelo)
+        agregados = select(
+            *[columnas[d].label(d) for d in DIMENSIONES],
+            func.count()
+        ).where(
+            modelo.fecha_registro >= desde,
+            modelo.fecha_registro < hasta,
+            columnas["dia"].in_(dias)
+        ).group_by(*[columnas[d] for d in DIMENSIONES])
+
+        db.execute(insert(MetricaLlamada).from_select([*DIMENSIONES, "cantidad"], agregados))
+
+def refrescar_metricas_llamadas(db: Session) -> int:
+    """
+    Refresca el agregado de forma incremental y devuelve los días recalculados.
+
+    Solo se consolidan días anteriores a hoy (hora local); el día en curso se
+    responde siempre desde las interacciones crudas.
+    """
+    with engine.connect() as conexion_bloqueo:
+        if engine.dialect.name == "postgresql":
+            obtenido = conexion_bloqueo.execute(
+                text("SELECT pg_try_advisory_lock(:clave)"), {"clave": CLAVE_BLOQUEO_REFRESCO}
+            ).scalar()
+            if not obtenido:
+                logger.info("Refresco de metricas_llamadas en curso en otro worker; se omite")
+                return 0
+        try:
+            return _refrescar(db)
+        finally:
+            if engine.dialect.name == "postgresql":
+                conexion_bloqueo.execute(
+                    text("SELECT pg_advisory_unlock(:clave)"), {"clave": CLAVE_BLOQUEO_REFRESCO}
+                )
+
+def _refrescar(db: Session) -> int:
+    # La nueva marca se toma antes de leer: lo que llegue después queda para la siguiente ejecución
+    nueva_fecha = datetime.now(timezone.utc).replace(tzinfo=None)
+    hoy = periodos.utc_a_local(nueva_fecha).date()
+    nuevo_id = db.query(func.max(Interaccion.id)).scalar() or 0
+
+    marca = db.get(MarcaAgregacion, MARCA_METRICAS_LLAMADAS)
+    dias = set()
+    if marca and marca.ultima_fecha and marca.ultimo_id is not None:
+        # Interacciones registradas desde la última ejecución
+        dia = _dia_local()
+        dias.update(r.dia for r in db.query(dia.label('dia')).filter(
+            Interaccion.id > marca.ultimo_id, Interaccion.id <= nuevo_id
+        ).distinct().all())
+        # Días que estaban en curso en la ejecución anterior y ya terminaron
+        d = periodos.utc_a_local(marca.ultima_fecha).date()
+        while d < hoy:
+            dias.add(d)
+            d += timedelta(days=1)
+    else:
+        # Primera ejecución: todos los días con interacciones
+        for modelo in MODELOS_INTERACCIONES:
+            primera = db.query(func.min(modelo.fecha_registro)).scalar()
+            if primera is None:
+                continue
+            d = periodos.utc_a_local(primera).date()
+            while d < hoy:
+                dias.add(d)
+                d += timedelta(days=1)
+    dias = sorted(d for d in dias if d < hoy)
+
+    for i in range(0, len(dias), DIAS_POR_LOTE):
+        _recalcular_dias(db, dias[i:i + DIAS_POR_LOTE])
+        db.commit()
+
+    if marca is None:
+        marca = MarcaAgregacion(nombre=MARCA_METRICAS_LLAMADAS)
+        db.add(marca)
+    marca.ultima_fecha = nueva_fecha
+    marca.ultimo_id = nuevo_id
+    db.commit()
+
+    if dias:
+        logger.info(f"metricas_llamadas: {len(dias)} días recalculados")
+    return len(dias)
+
+def limite_consolidado(db: Session) -> Optional[date]:
+    """Primer día local que aún no está consolidado en el agregado"""
+    ultima_fecha = db.query(MarcaAgregacion.ultima_fecha).filter(
+        MarcaAgregacion.nombre == MARCA_METRICAS_LLAMADAS
+    ).scalar()
+    if ultima_fecha is None:
+        return None
+    return periodos.utc_a_local(ultima_fecha).date()
+
+def fuente_llamadas(db: Session, desde: datetime, hasta: datetime, dimensiones: Sequence[str],
+                    filtros: Optional[dict] = None):
+    """
+    Subconsulta con las columnas `dimensiones` más cantidad para las
+    interacciones registradas en [desde, hasta) (hora local). `filtros` restringe
+    dimensiones a un valor (p. ej. {"agent_username": "jperez"}).
+
+    Los días completos ya consolidados salen de metricas_llamadas; los tramos
+    restantes salen de interacciones e interacciones_archivo.
+    Quien la usa debe agregar con sum(cantidad).
+    """
+    filtros = filtros or {}
+    limite = limite_consolidado(db)
+
+    # Días completos dentro del rango
+    primer_dia = desde.date() if desde == periodos.truncar(desde, "dia") else desde.date() + timedelta(days=1)
+    ultimo_dia = hasta.date()  # exclusivo
+    if limite is not None:
+        ultimo_dia = min(ultimo_dia, limite)
+
+    partes = []
+    tramos_crudos = []
+    if limite is not None and primer_dia < ultimo_dia:
+        partes.append(select(
+            *[getattr(MetricaLlamada, d).label(d) for d in dimensiones],
+            MetricaLlamada.cantidad.label('cantidad')
+        ).where(
+            MetricaLlamada.dia >= primer_dia,
+            MetricaLlamada.dia < ultimo_dia,
+            *[getattr(MetricaLlamada, d) == valor for d, valor in filtros.items()]
+        ))
+        inicio_consolidado = datetime.combine(primer_dia, datetime.min.time())
+        fin_consolidado = datetime.combine(ultimo_dia, datetime.min.time())
+        if desde < inicio_consolidado:
+            tramos_crudos.append((desde, inicio_consolidado))
+        if fin_consolidado < hasta:
+            tramos_crudos.append((fin_consolidado, hasta))
+    else:
+        tramos_crudos.append((desde, hasta))
+
+    for modelo in MODELOS_INTERACCIONES:
+        columnas = _columnas_crudas(modelo)
+        for inicio_tramo, fin_tramo in tramos_crudos:
+            partes.append(select(
+                *[columnas[d].label(d) for d in dimensiones],
+                literal(1).label('cantidad')
+            ).where(
+                modelo.fecha_registro >= periodos.local_a_utc(inicio_tramo),
+                modelo.fecha_registro < periodos.local_a_utc(fin_tramo),
+                # Sobre la columna cruda para aprovechar los índices (campaña|agente, fecha_registro)
+                *[getattr(modelo, d) == valor for d, valor in filtros.items()]
+            ))
+
+    if len(partes) == 1:
+        return partes[0].subquery('fuente_llamadas')
+    return union_all(*partes).subquery('fuente_llamadas')
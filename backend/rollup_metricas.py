@@ -0,0 +1,263 @@
+"""
+Agregado diario de casos para los endpoints de /metricas
+
+La tabla `metricas_diarias` guarda conteos por (día, hora local, motivo, agente,
+prioridad, estado, origen). Un proceso en segundo plano la mantiene de forma
+incremental: con la marca de agua de `fecha_actualizacion` solo recalcula los
+días que tienen casos modificados desde la ejecución anterior, más los días que
+estaban en curso en ese momento. La marca se relee con ROLLUP_MARGEN_SEGUNDOS de
+solapamiento: una transacción que fijó `fecha_actualizacion` antes de la marca
+pero confirmó después de la lectura se recoge en la ejecución siguiente.
+
+Cada lote de días recalculado se publica en el bus (`metricas_recalculadas`)
+para que los workers descarten lo que tengan cacheado de esos días.
+
+Los endpoints leen de `fuente_casos`, que combina el agregado para los días ya
+consolidados con los casos crudos del resto del rango (normalmente solo hoy).
+"""
+import logging
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import Integer, case, cast, extract, func, insert, literal, select, text, union_all
+from sqlalchemy.orm import Session
+
+from database import engine
+from eventos_tiempo_real import bus_eventos
+from models import Caso, CasoArchivado, MetricaDiaria, MarcaAgregacion
+import periodos
+
+logger = logging.getLogger(__name__)
+
+MARCA_METRICAS_DIARIAS = "metricas_diarias"
+
+DIMENSIONES = ("dia", "hora", "motivo_id", "agente_asignado_id", "prioridad", "estado", "origen")
+
+# Identificador del advisory lock que evita refrescos simultáneos entre workers
+CLAVE_BLOQUEO_REFRESCO = 7301001
+
+# Días recalculados por transacción en el refresco
+DIAS_POR_LOTE = 31
+
+# Solapamiento con la marca anterior; debe superar la transacción de escritura más larga
+ROLLUP_MARGEN_SEGUNDOS = int(os.environ.get('ROLLUP_MARGEN_SEGUNDOS', '600'))
+
+# Los casos archivados siguen contando en los días en que se crearon
+MODELOS_CASOS = (Caso, CasoArchivado)
+
+def _dia_local(modelo=Caso):
+    return func.date(periodos.hora_local(modelo.fecha_creacion))
+
+def _hora_local(modelo=Caso):
+    return cast(extract('hour', periodos.hora_local(modelo.fecha_creacion)), Integer)
+
+def _inicio_dia_utc(dia: date) -> datetime:
+    return periodos.local_a_utc(datetime.combine(dia, datetime.min.time()))
+
+def _columnas_crudas(modelo=Caso):
+    """Dimensiones calculadas sobre la tabla casos (o casos_archivo)"""
+    return {
+        "dia": _dia_local(modelo),
+        "hora": _hora_local(modelo),
+        "motivo_id": modelo.motivo_id,
+        "agente_asignado_id": modelo.agente_asignado_id,
+        "prioridad": modelo.prioridad,
+        "estado": modelo.estado,
+        "origen": modelo.origen,
+    }
+
+def _recalcular_dias(db: Session, dias: List[date]):
+    """Reemplaza las filas del agregado de los días indicados"""
+    desde = _inicio_dia_utc(min(dias))
+    hasta = _inicio_dia_utc(max(dias) + timedelta(days=1))
+
+    db.query(MetricaDiaria).filter(MetricaDiaria.dia.in_(dias)).delete(synchronize_session=False)
+
+    # Una inserción por tabla: los consumidores suman, así que una misma
+    # combinación de dimensiones puede tener una fila caliente y una archivada
+    for modelo in MODELOS_CASOS:
+        columnas = _columnas_crudas(modelo)
+        agregados = select(
+            *[columnas[d].label(d) for d in DIMENSIONES],
+            func.count(modelo.id),
+            func.coalesce(func.sum(modelo.tiempo_resolucion_horas), 0),
+            func.count(modelo.tiempo_resolucion_horas)
+        ).where(
+            modelo.fecha_creacion >= desde,
+            modelo.fecha_creacion < hasta,
+            columnas["dia"].in_(dias)
+        ).group_by(*[columnas[d] for d in DIMENSIONES])
+
+        db.execute(insert(MetricaDiaria).from_select(
+            [*DIMENSIONES, "cantidad", "suma_resolucion_horas", "casos_con_resolucion"],
+            agregados
+        ))
+
+def _recalcular_por_lotes(db: Session, dias: List[date]):
+    """Recalcula los días por lotes, confirmando y publicando cada uno"""
+    for i in range(0, len(dias), DIAS_POR_LOTE):
+        lote = dias[i:i + DIAS_POR_LOTE]
+        _recalcular_dias(db, lote)
+        db.commit()
+        bus_eventos.publicar("metricas_recalculadas", {"tabla": MARCA_METRICAS_DIARIAS, "dias": lote})
+
+@contextmanager
+def _bloqueo_refresco(esperar: bool = False):
+    """Advisory lock del refresco; devuelve False si otro worker lo tiene y no se espera"""
+    with engine.connect() as conexion_bloqueo:
+        if engine.dialect.name != "postgresql":
+            yield True
+            return
+        if esperar:
+            conexion_bloqueo.execute(text("SELECT pg_advisory_lock(:clave)"), {"clave": CLAVE_BLOQUEO_REFRESCO})
+            obtenido = True
+        else:
+            obtenido = conexion_bloqueo.execute(
+                text("SELECT pg_try_advisory_lock(:clave)"), {"clave": CLAVE_BLOQUEO_REFRESCO}
+            ).scalar()
+        try:
+            yield obtenido
+        finally:
+            if obtenido:
+                conexion_bloqueo.execute(
+                    text("SELECT pg_advisory_unlock(:clave)"), {"clave": CLAVE_BLOQUEO_REFRESCO}
+                )
+
+def refrescar_metricas_diarias(db: Session) -> int:
+    """
+    Refresca el agregado de forma incremental y devuelve los días recalculados.
+
+    Solo se consolidan días anteriores a hoy (hora local); el día en curso se
+    responde siempre desde los casos crudos.
+    """
+    with _bloqueo_refresco() as obtenido:
+        if not obtenido:
+            logger.info("Refresco de metricas_diarias en curso en otro worker; se omite")
+            return 0
+        return _refrescar(db)
+
+def recalcular_dias(db: Session, dias: Iterable[date]) -> int:
+    """
+    Recalcula días ya consolidados, p. ej. después de importar casos con fechas
+    pasadas, que la marca de fecha_actualizacion no detecta. Devuelve los días
+    recalculados.
+    """
+    dias = sorted(set(dias))
+    with _bloqueo_refresco(esperar=True):
+        limite = limite_consolidado(db)
+        # Sin marca, el próximo refresco calcula todos los días
+        consolidados = [d for d in dias if limite is not None and d < limite]
+        _recalcular_por_lotes(db, consolidados)
+    # Los días sin consolidar se leen de los casos crudos, pero sus periodos
+    # cerrados pueden estar cacheados: se publican igual
+    pendientes = dias[len(consolidados):]
+    for i in range(0, len(pendientes), DIAS_POR_LOTE):
+        bus_eventos.publicar("metricas_recalculadas", {
+            "tabla": MARCA_METRICAS_DIARIAS, "dias": pendientes[i:i + DIAS_POR_LOTE]
+        })
+    if consolidados:
+        logger.info(f"metricas_diarias: {len(consolidados)} días recalculados")
+    return len(consolidados)
+
+def _refrescar(db: Session) -> int:
+    # La nueva marca se toma antes de leer para no perder cambios concurrentes
+    nueva_marca = datetime.now(timezone.utc).replace(tzinfo=None)
+    hoy = periodos.utc_a_local(nueva_marca).date()
+
+    marca = db.get(MarcaAgregacion, MARCA_METRICAS_DIARIAS)
+    dias = set()
+    if marca and marca.ultima_fecha:
+        # Casos modificados desde la última ejecución, con solapamiento para los
+        # que confirmaron después de la lectura anterior
+        consultas = [db.query(_dia_local().label('dia')).distinct().filter(
+            Caso.fecha_actualizacion >= marca.ultima_fecha - timedelta(seconds=ROLLUP_MARGEN_SEGUNDOS)
+        )]
+        # Días que estaban en curso en la ejecución anterior y ya terminaron
+        d = periodos.utc_a_local(marca.ultima_fecha).date()
+        while d < hoy:
+            dias.add(d)
+            d += timedelta(days=1)
+    else:
+        # Primera ejecución: también los días que solo tienen casos archivados
+        consultas = [db.query(_dia_local(modelo).label('dia')).distinct() for modelo in MODELOS_CASOS]
+    for consulta in consultas:
+        dias.update(r.dia for r in consulta.all())
+    dias = sorted(d for d in dias if d < hoy)
+    _recalcular_por_lotes(db, dias)
+
+    if marca is None:
+        marca = MarcaAgregacion(nombre=MARCA_METRICAS_DIARIAS)
+        db.add(marca)
+    marca.ultima_fecha = nueva_marca
+    db.commit()
+
+    if dias:
+        logger.info(f"metricas_diarias: {len(dias)} días recalculados")
+    return len(dias)
+
+def limite_consolidado(db: Session) -> Optional[date]:
+    """Primer día local que aún no está consolidado en el agregado"""
+    ultima_fecha = db.query(MarcaAgregacion.ultima_fecha).filter(
+        MarcaAgregacion.nombre == MARCA_METRICAS_DIARIAS
+    ).scalar()
+    if ultima_fecha is None:
+        return None
+    return periodos.utc_a_local(ultima_fecha).date()
+
+def fuente_casos(db: Session, desde: datetime, hasta: datetime, dimensiones: Sequence[str]):
+    """
+    Subconsulta con las columnas `dimensiones` más cantidad, suma_resolucion_horas
+    y casos_con_resolucion para los casos creados en [desde, hasta) (hora local).
+
+    Los días completos ya consolidados salen de metricas_diarias; los tramos
+    restantes (bordes del rango y días sin consolidar) salen de las tablas casos
+    y casos_archivo.
+    Quien la usa debe agregar con sum() sobre las columnas de medida.
+    """
+    limite = limite_consolidado(db)
+
+    # Días completos dentro del rango
+    primer_dia = desde.date() if desde == periodos.truncar(desde, "dia") else desde.date() + timedelta(days=1)
+    ultimo_dia = hasta.date()  # exclusivo
+    if limite is not None:
+        ultimo_dia = min(ultimo_dia, limite)
+
+    partes = []
+    tramos_crudos = []
+    if limite is not None and primer_dia < ultimo_dia:
+        partes.append(select(
+            *[getattr(MetricaDiaria, d).label(d) for d in dimensiones],
+            MetricaDiaria.cantidad.label('cantidad'),
+            MetricaDiaria.suma_resolucion_horas.label('suma_resolucion_horas'),
+            MetricaDiaria.casos_con_resolucion.label('casos_con_resolucion')
+        ).where(
+            MetricaDiaria.dia >= primer_dia,
+            MetricaDiaria.dia < ultimo_dia
+        ))
+        inicio_consolidado = datetime.combine(primer_dia, datetime.min.time())
+        fin_consolidado = datetime.combine(ultimo_dia, datetime.min.time())
+        if desde < inicio_consolidado:
+            tramos_crudos.append((desde, inicio_consolidado))
+        if fin_consolidado < hasta:
+            tramos_crudos.append((fin_consolidado, hasta))
+    else:
+        tramos_crudos.append((desde, hasta))
+
+    for modelo in MODELOS_CASOS:
+        columnas = _columnas_crudas(modelo)
+        for inicio_tramo, fin_tramo in tramos_crudos:
+            partes.append(select(
+                *[columnas[d].label(d) for d in dimensiones],
+                literal(1).label('cantidad'),
+                func.coalesce(modelo.tiempo_resolucion_horas, 0).label('suma_resolucion_horas'),
+                case((modelo.tiempo_resolucion_horas.isnot(None), 1), else_=0).label('casos_con_resolucion')
+            ).where(
+                modelo.fecha_creacion >= periodos.local_a_utc(inicio_tramo),
+                modelo.fecha_creacion < periodos.local_a_utc(fin_tramo)
+            ))
+
+    if len(partes) == 1:
+        return partes[0].subquery('fuente_casos')
+    return union_all(*partes).subquery('fuente_casos')
@@ -96,6 +96,18 @@ class CasoUpdate(BaseModel):
     agente_asignado_id: Optional[int] = None
     descripcion: Optional[str] = None
 
+class ActualizacionCasoLote(BaseModel):
+    caso_id: int
+    cambios: dict  # mismos campos que PUT /casos/{id}, incluido comentario
+
+class ResultadoActualizacionLote(BaseModel):
+    caso_id: int
+    exito: bool
+    error: Optional[str] = None
+    numero_caso: Optional[str] = None
+    estado: Optional[EstadoCasoEnum] = None
+    agente_asignado_id: Optional[int] = None
+
 class InteraccionCreate(BaseModel):
     caso_id: int
     omnileads_call_id: Optional[str] = None
@@ -141,9 +153,28 @@ class Caso(BaseModel):
     fecha_cierre: Optional[datetime]
     tiempo_resolucion_horas: Optional[float]
     origen: str
+    num_interacciones: int = 0
+    primera_interaccion: Optional[datetime] = None
+    ultima_interaccion: Optional[datetime] = None
     paciente: Optional[Paciente] = None
     motivo_obj: Optional[MotivoPQR] = None
 
+class CasoListado(BaseModel):
+    """Fila plana del listado de casos (/casos/lista): solo lo que muestra la tabla"""
+    id: int
+    numero_caso: str
+    prioridad: PrioridadEnum
+    estado: EstadoCasoEnum
+    origen: str
+    fecha_creacion: datetime
+    agente_asignado_id: Optional[int]
+    paciente_id: int
+    paciente_identificacion: str
+    paciente_nombre: str
+    paciente_apellidos: str
+    motivo_id: int
+    motivo_nombre: str
+
 class CasoDetalle(Caso):
     paciente: Paciente
     motivo_obj: MotivoPQR
@@ -162,6 +193,12 @@ class Alerta(BaseModel):
     leida: bool
     usuario_notificado_id: Optional[int]
 
+class AlertaBandeja(Alerta):
+    numero_caso: str
+    prioridad: PrioridadEnum
+    agente_asignado_id: Optional[int]
+    paciente_nombre: str
+
 class HistorialEvento(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     id: int
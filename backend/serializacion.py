@@ -0,0 +1,42 @@
+"""
+Serialización rápida de listados grandes
+
+Los listados en modo ligero consultan solo columnas (tuplas, sin hidratar
+entidades ORM) y se serializan directamente a bytes JSON: con orjson si está
+instalado, o con un TypeAdapter de pydantic precompilado. Ambos producen el
+mismo JSON. Los cuerpos grandes se comprimen con gzip cuando el cliente lo
+acepta; no se usa GZipMiddleware porque retendría los eventos del stream SSE.
+"""
+import gzip
+import os
+from typing import Any, Dict, List, Sequence
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+GZIP_MINIMO_BYTES = int(os.environ.get('GZIP_MINIMO_BYTES', '4096'))
+GZIP_NIVEL = int(os.environ.get('GZIP_NIVEL', '5'))
+
+def adaptador_lista(modelo) -> TypeAdapter:
+    """TypeAdapter de List[modelo]; se crea una vez por módulo, no por petición"""
+    return TypeAdapter(List[modelo])
+
+def filas_a_json(adaptador: TypeAdapter, filas: Sequence[Any]) -> bytes:
+    """Filas de una consulta por columnas (Row) a un arreglo JSON de objetos"""
+    datos: List[Dict[str, Any]] = [fila._asdict() for fila in filas]
+    if orjson is not None:
+        return orjson.dumps(datos)
+    return adaptador.dump_json(adaptador.validate_python(datos))
+
+def respuesta_json_comprimida(request: Request, cuerpo: bytes) -> Response:
+    """JSON ya serializado, en gzip si supera GZIP_MINIMO_BYTES y el cliente lo acepta"""
+    headers = {"Vary": "Accept-Encoding"}
+    if len(cuerpo) >= GZIP_MINIMO_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        cuerpo = gzip.compress(cuerpo, compresslevel=GZIP_NIVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
@@ -1,24 +1,49 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, Request, Response, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_, or_, extract, case
+from sqlalchemy import func, and_, or_, extract, case, select, insert, literal_column, cast, DateTime
 from typing import List, Optional
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import json
+import asyncio
 import logging
 
-from database import get_db, engine, Base
+from database import get_db, get_read_db, engine, Base, SessionLocal, read_engine
 from models import (
     Usuario, Paciente, Caso, MotivoPQR, Interaccion, HistorialEstado, HistorialEvento,
-    Alerta, Departamento, Ciudad, EstadoCasoEnum, PrioridadEnum, TipoAlertaEnum, RolEnum
+    Alerta, Departamento, Ciudad, EstadoCasoEnum, PrioridadEnum, TipoAlertaEnum, RolEnum,
+    CasoArchivado, Importacion
 )
 import schemas
+import periodos
+import rollup_metricas
+import rollup_llamadas
+import tareas
+import observabilidad
+import perfilado
+import particiones
+import archivo_casos
+import control_admision
+import interacciones_caso
+import numeracion
+import importar_historico
+import idempotencia
 from auth import (
     verify_password, get_password_hash, create_access_token,
-    get_current_user, get_current_admin_user
+    get_current_user, get_current_admin_user, obtener_usuario_desde_token
 )
+from eventos_tiempo_real import bus_eventos
+from contador_alertas import contador_alertas
+from catalogos import cache_catalogos
+from asignacion_agentes import motor_asignacion
+from http_cache import (
+    respuesta_json, etag_de_version, no_modificado, respuesta_no_modificado, validadores
+)
+from serializacion import adaptador_lista, filas_a_json, respuesta_json_comprimida
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -71,21 +96,10 @@ async def get_current_user_info(current_user: Usuario = Depends(get_current_user
 
 def generar_numero_caso(db: Session) -> str:
     """Genera un número de caso único con formato RAD-XXXX (autoincremental)"""
-    prefix = "RAD-"
-
-    # Buscar el último caso creado (sin importar la fecha)
-    ultimo_caso = db.query(Caso).filter(
-        Caso.numero_caso.like(f"{prefix}%")
-    ).order_by(Caso.id.desc()).first()
-
-    if ultimo_caso:
-        # Extraer el número del último caso (RAD-1234 -> 1234)
-        ultimo_num = int(ultimo_caso.numero_caso.split('-')[-1])
-        nuevo_num = ultimo_num + 1
-    else:
-        nuevo_num = 1
-
-    return f"{prefix}{nuevo_num}"
+    # El lock dura hasta el commit del alta y la serializa con las demás altas y
+    # con los bloques de números que reservan las importaciones de histórico
+    numeracion.bloquear_numeracion(db)
+    return f"RAD-{numeracion.ultimo_numero_rad(db) + 1}"
 
 def registrar_evento(
     db: Session,
@@ -96,7 +110,7 @@ def registrar_evento(
     valor_anterior: Optional[str] = None,
     valor_nuevo: Optional[str] = None,
     comentario: Optional[str] = None,
-    datos_adicionales: Optional[str] = None
+    datos_adicionales: Optional[dict] = None
 ):
     """
     Registra un evento en el historial unificado del caso
@@ -123,10 +137,34 @@ def registrar_evento(
     db.add(evento)
     return evento
 
+def datos_evento_caso(caso: Caso, **extra) -> dict:
+    """Datos mínimos de un caso para los eventos del stream"""
+    return {
+        "id": caso.id,
+        "numero_caso": caso.numero_caso,
+        "estado": caso.estado,
+        "prioridad": caso.prioridad,
+        "agente_asignado_id": caso.agente_asignado_id,
+        "origen": caso.origen,
+        "fecha_creacion": caso.fecha_creacion,
+        **extra
+    }
+
+def datos_evento_alerta(alerta: Alerta, caso: Caso) -> dict:
+    return {
+        "id": alerta.id,
+        "caso_id": alerta.caso_id,
+        "numero_caso": caso.numero_caso,
+        "tipo_alerta": alerta.tipo_alerta,
+        "fecha_creacion": alerta.fecha_creacion,
+        "leida": alerta.leida,
+        "agente_asignado_id": caso.agente_asignado_id
+    }
+
 @api_router.get("/embedded/paciente/{identificacion}")
 async def buscar_paciente_embebido(
     identificacion: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Endpoint para buscar paciente sin autenticación (vista embebida)
@@ -172,7 +210,7 @@ async def buscar_paciente_embebido(
 @api_router.get("/embedded/paciente/{identificacion}/historial")
 async def obtener_historial_paciente_embebido(
     identificacion: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Endpoint para obtener historial completo de casos sin autenticación (vista embebida)
@@ -181,10 +219,8 @@ async def obtener_historial_paciente_embebido(
     if not paciente:
         return []
 
-    # Buscar todos los casos del paciente
-    casos = db.query(Caso).filter(
-        Caso.paciente_id == paciente.id
-    ).order_by(Caso.fecha_creacion.desc()).all()
+    # Buscar todos los casos del paciente, incluidos los archivados
+    casos = archivo_casos.casos_de_paciente(db, paciente.id)
 
     return [
         {
@@ -209,6 +245,7 @@ async def crear_caso_embebido(
     Endpoint para vista embebida de OmniLeads (sin autenticación)
     Recibe datos del paciente, caso e información de OmniLeads
     """
+    agente_reservado = None
     try:
         # Extraer datos del paciente
         paciente_data = caso_data.get('paciente', {})
@@ -230,35 +267,44 @@ async def crear_caso_embebido(
             db.add(paciente)
             db.flush()
         
-        # Buscar agente por defecto (el primero disponible) para uso posterior
-        agente = db.query(Usuario).filter(Usuario.rol == "agente", Usuario.activo == True).first()
-        if not agente:
-            agente = db.query(Usuario).filter(Usuario.activo == True).first()
-
         # Si es un caso existente, actualizarlo
         numero_caso_buscar = caso_data.get('numero_caso_existente')
         if numero_caso_buscar:
             caso = db.query(Caso).filter(Caso.numero_caso == numero_caso_buscar).first()
+            if not caso and archivo_casos.esta_archivado(db, numero_caso=numero_caso_buscar):
+                raise HTTPException(status_code=409, detail="El caso está archivado y no se puede modificar")
             if caso:
+                estado_anterior = caso.estado
+                prioridad_anterior = caso.prioridad
                 caso.estado = EstadoCasoEnum[caso_data.get('estado', 'ABIERTO')]
                 caso.descripcion = caso_data.get('descripcion', caso.descripcion)
                 caso.prioridad = PrioridadEnum[caso_data.get('prioridad', 'MEDIA')]
+                agente_id = caso.agente_asignado_id
             else:
                 raise HTTPException(status_code=404, detail="Caso no encontrado")
         else:
             # Crear nuevo caso
-            
+            prioridad = PrioridadEnum[caso_data.get('prioridad', 'MEDIA')]
+            estado = EstadoCasoEnum[caso_data.get('estado', 'ABIERTO')]
+
+            # Agente activo con menos carga abierta (ver asignacion_agentes.py)
+            agente_reservado = motor_asignacion.asignar(db, prioridad, estado)
+            agente_id = agente_reservado
+            if agente_id is None:
+                # Sin agentes activos: el caso queda a nombre del primer usuario activo
+                agente_id = db.query(Usuario.id).filter(Usuario.activo == True).order_by(Usuario.id).limit(1).scalar()
+
             numero_caso = generar_numero_caso(db)
             
             caso = Caso(
                 numero_caso=numero_caso,
                 paciente_id=paciente.id,
                 motivo_id=caso_data.get('motivo_id'),
-                prioridad=PrioridadEnum[caso_data.get('prioridad', 'MEDIA')],
-                estado=EstadoCasoEnum[caso_data.get('estado', 'ABIERTO')],
+                prioridad=prioridad,
+                estado=estado,
                 descripcion=caso_data.get('descripcion'),
-                agente_creador_id=agente.id if agente else 1,
-                agente_asignado_id=agente.id if agente else None,
+                agente_creador_id=agente_id or 1,
+                agente_asignado_id=agente_id,
                 origen='call'  # Los casos desde embedded view son de call center
             )
             db.add(caso)
@@ -268,7 +314,7 @@ async def crear_caso_embebido(
             registrar_evento(
                 db=db,
                 caso_id=caso.id,
-                usuario_id=agente.id if agente else None,
+                usuario_id=agente_id,
                 tipo_evento='creacion',
                 campo_modificado=None,
                 valor_anterior=None,
@@ -281,7 +327,7 @@ async def crear_caso_embebido(
                 caso_id=caso.id,
                 estado_anterior=None,
                 estado_nuevo=caso.estado.value,
-                usuario_id=agente.id if agente else None,
+                usuario_id=agente_id,
                 comentario="Caso creado desde vista embebida"
             )
             db.add(historial)
@@ -304,18 +350,18 @@ async def crear_caso_embebido(
         )
         db.add(interaccion)
         db.flush()
+        interacciones_caso.registrar_interaccion(db, caso.id, interaccion.fecha_registro)
 
         # Registrar evento de interacción
-        import json
-        datos_omnileads = json.dumps({
+        datos_omnileads = {
             "agent_name": omnileads_data.get('agent_name'),
             "campaign_name": omnileads_data.get('campaign_name'),
             "telefono": omnileads_data.get('telefono')
-        })
+        }
         registrar_evento(
             db=db,
             caso_id=caso.id,
-            usuario_id=agente.id if agente else None,
+            usuario_id=agente_id,
             tipo_evento='interaccion',
             campo_modificado='llamada',
             valor_anterior=None,
@@ -325,6 +371,7 @@ async def crear_caso_embebido(
         )
 
         # Crear alerta si es prioridad alta
+        alerta = None
         if caso.prioridad == PrioridadEnum.ALTA:
             alerta = Alerta(
                 caso_id=caso.id,
@@ -333,16 +380,38 @@ async def crear_caso_embebido(
             )
             db.add(alerta)
         
+        idempotencia.confirmar(db)
         db.commit()
-        db.refresh(caso)
-        
-        return caso
         
+    except HTTPException:
+        db.rollback()
+        # La reserva de carga se deshace en cualquier fallo antes del commit
+        if agente_reservado is not None:
+            motor_asignacion.liberar(agente_reservado, prioridad, estado)
+        raise
     except Exception as e:
         db.rollback()
+        if agente_reservado is not None:
+            motor_asignacion.liberar(agente_reservado, prioridad, estado)
         logger.error(f"Error al crear caso embebido: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    db.refresh(caso)
+
+    if numero_caso_buscar:
+        bus_eventos.publicar("caso_actualizado", datos_evento_caso(
+            caso, estado_anterior=estado_anterior, prioridad_anterior=prioridad_anterior
+        ))
+    elif agente_reservado is not None:
+        # La carga ya se reservó en este proceso; el oyente no debe sumarla otra vez
+        bus_eventos.publicar("caso_creado", datos_evento_caso(caso, asignado_por=motor_asignacion.token))
+    else:
+        bus_eventos.publicar("caso_creado", datos_evento_caso(caso))
+    if alerta is not None:
+        bus_eventos.publicar("alerta_creada", datos_evento_alerta(alerta, caso))
+
+    return caso
+
 # ==================== PACIENTES ====================
 
 @api_router.get("/pacientes", response_model=List[schemas.Paciente])
@@ -352,7 +421,7 @@ async def listar_pacientes(
     skip: int = 0,
     limit: int = 100,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     query = db.query(Paciente)
     
@@ -372,13 +441,16 @@ async def listar_pacientes(
 @api_router.get("/pacientes/{paciente_id}", response_model=schemas.Paciente)
 async def obtener_paciente(
     paciente_id: int,
+    request: Request,
     current_user: Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     paciente = db.query(Paciente).filter(Paciente.id == paciente_id).first()
     if not paciente:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    return paciente
+    # La fila es pequeña: el ETag sale del contenido serializado
+    cuerpo = schemas.Paciente.model_validate(paciente).model_dump_json().encode("utf-8")
+    return respuesta_json(request, cuerpo)
 
 @api_router.post("/pacientes", response_model=schemas.Paciente)
 async def crear_paciente(
@@ -400,16 +472,26 @@ async def crear_paciente(
 @api_router.get("/pacientes/{paciente_id}/casos", response_model=List[schemas.Caso])
 async def obtener_casos_paciente(
     paciente_id: int,
+    request: Request,
+    response: Response,
+    incluir_archivados: bool = True,
     current_user: Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    casos = db.query(Caso).filter(Caso.paciente_id == paciente_id).order_by(Caso.fecha_creacion.desc()).all()
-    return casos
+    # Versión de la lista: cantidad de casos y última modificación (índices por paciente_id)
+    cantidad, ultima_modificacion = archivo_casos.version_casos_paciente(db, paciente_id, incluir_archivados)
+    etag = etag_de_version("casos_paciente", paciente_id, incluir_archivados, cantidad, ultima_modificacion)
+    if no_modificado(request, etag, ultima_modificacion):
+        return respuesta_no_modificado(etag, ultima_modificacion)
+
+    response.headers.update(validadores(etag, ultima_modificacion))
+    return archivo_casos.casos_de_paciente(db, paciente_id, incluir_archivados)
 
 # ==================== CASOS ====================
 
-@api_router.get("/casos", response_model=List[schemas.Caso])
-async def listar_casos(
+def filtrar_casos(
+    query,
+    current_user: Usuario,
     numero_caso: Optional[str] = None,
     estado: Optional[EstadoCasoEnum] = None,
     prioridad: Optional[PrioridadEnum] = None,
@@ -418,14 +500,9 @@ async def listar_casos(
     agente_id: Optional[int] = None,
     fecha_desde: Optional[str] = None,
     fecha_hasta: Optional[str] = None,
-    origen: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 100,
-    current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    origen: Optional[str] = None
 ):
-    query = db.query(Caso).options(joinedload(Caso.paciente), joinedload(Caso.motivo_obj))
-
+    """Filtros y permisos del listado de casos; el filtro por paciente requiere el join a pacientes"""
     # PERMISOS POR ROL: Agentes solo ven casos asignados a ellos
     if current_user.rol == RolEnum.AGENTE:
         query = query.filter(Caso.agente_asignado_id == current_user.id)
@@ -442,23 +519,134 @@ async def listar_casos(
     if agente_id:
         query = query.filter(or_(Caso.agente_creador_id == agente_id, Caso.agente_asignado_id == agente_id))
     if paciente_identificacion:
-        query = query.join(Paciente).filter(Paciente.identificacion == paciente_identificacion)
+        query = query.filter(Paciente.identificacion == paciente_identificacion)
     if fecha_desde:
         query = query.filter(Caso.fecha_creacion >= datetime.fromisoformat(fecha_desde))
     if fecha_hasta:
         query = query.filter(Caso.fecha_creacion <= datetime.fromisoformat(fecha_hasta))
     if origen:
         query = query.filter(Caso.origen == origen)
+    return query
+
+@api_router.get("/casos", response_model=List[schemas.Caso])
+async def listar_casos(
+    numero_caso: Optional[str] = None,
+    estado: Optional[EstadoCasoEnum] = None,
+    prioridad: Optional[PrioridadEnum] = None,
+    motivo_id: Optional[int] = None,
+    paciente_identificacion: Optional[str] = None,
+    agente_id: Optional[int] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    origen: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    query = db.query(Caso).options(joinedload(Caso.paciente), joinedload(Caso.motivo_obj))
+    if paciente_identificacion:
+        query = query.join(Paciente)
+    query = filtrar_casos(
+        query, current_user, numero_caso, estado, prioridad, motivo_id,
+        paciente_identificacion, agente_id, fecha_desde, fecha_hasta, origen
+    )
 
     casos = query.order_by(Caso.fecha_creacion.desc()).offset(skip).limit(limit).all()
     return casos
 
+# Columnas del listado ligero; el orden no importa, las filas se leen por nombre
+COLUMNAS_LISTADO_CASOS = (
+    Caso.id, Caso.numero_caso, Caso.prioridad, Caso.estado, Caso.origen, Caso.fecha_creacion,
+    Caso.agente_asignado_id, Caso.paciente_id,
+    Paciente.identificacion.label('paciente_identificacion'),
+    Paciente.nombre.label('paciente_nombre'),
+    Paciente.apellidos.label('paciente_apellidos'),
+    Caso.motivo_id,
+    MotivoPQR.nombre.label('motivo_nombre'),
+)
+adaptador_casos_listado = adaptador_lista(schemas.CasoListado)
+
+@api_router.get("/casos/lista", response_model=List[schemas.CasoListado])
+async def listar_casos_ligero(
+    request: Request,
+    numero_caso: Optional[str] = None,
+    estado: Optional[EstadoCasoEnum] = None,
+    prioridad: Optional[PrioridadEnum] = None,
+    motivo_id: Optional[int] = None,
+    paciente_identificacion: Optional[str] = None,
+    agente_id: Optional[int] = None,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    origen: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=500),
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Mismos filtros que /casos, pero devuelve filas planas con solo las columnas
+    de la tabla: sin entidades ORM ni validación por fila.
+    """
+    query = db.query(*COLUMNAS_LISTADO_CASOS).join(
+        Paciente, Paciente.id == Caso.paciente_id
+    ).join(MotivoPQR, MotivoPQR.id == Caso.motivo_id)
+    query = filtrar_casos(
+        query, current_user, numero_caso, estado, prioridad, motivo_id,
+        paciente_identificacion, agente_id, fecha_desde, fecha_hasta, origen
+    )
+
+    filas = query.order_by(Caso.fecha_creacion.desc()).offset(skip).limit(limit).all()
+    return respuesta_json_comprimida(request, filas_a_json(adaptador_casos_listado, filas))
+
+def version_caso(db: Session, caso_id: int):
+    """
+    Versión del detalle de un caso sin cargar relaciones: fecha_actualizacion
+    del caso más el último evento e interacción (índices por caso_id).
+    """
+    return db.query(
+        Caso.agente_asignado_id,
+        Caso.fecha_actualizacion,
+        select(func.max(HistorialEvento.id)).where(
+            HistorialEvento.caso_id == Caso.id).scalar_subquery().label('ultimo_evento_id'),
+        select(func.max(HistorialEvento.fecha_evento)).where(
+            HistorialEvento.caso_id == Caso.id).scalar_subquery().label('fecha_ultimo_evento'),
+        select(func.max(Interaccion.id)).where(
+            Interaccion.caso_id == Caso.id).scalar_subquery().label('ultima_interaccion_id'),
+        select(func.max(Interaccion.fecha_registro)).where(
+            Interaccion.caso_id == Caso.id).scalar_subquery().label('fecha_ultima_interaccion')
+    ).filter(Caso.id == caso_id).first()
+
 @api_router.get("/casos/{caso_id}", response_model=schemas.CasoDetalle)
 async def obtener_caso(
     caso_id: int,
+    request: Request,
+    response: Response,
     current_user: Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    version = version_caso(db, caso_id)
+    if not version:
+        return obtener_caso_archivado(caso_id, request, response, current_user, db)
+
+    # PERMISOS: Agentes solo pueden ver casos asignados a ellos
+    if current_user.rol == RolEnum.AGENTE and version.agente_asignado_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tiene permisos para ver este caso")
+
+    etag = etag_de_version(
+        "caso", caso_id, version.fecha_actualizacion, version.agente_asignado_id,
+        version.ultimo_evento_id, version.ultima_interaccion_id
+    )
+    ultima_modificacion = max(
+        f for f in (version.fecha_actualizacion, version.fecha_ultimo_evento, version.fecha_ultima_interaccion)
+        if f is not None
+    )
+    if no_modificado(request, etag, ultima_modificacion):
+        return respuesta_no_modificado(etag, ultima_modificacion)
+
+    # Si el caso cambia entre la versión y la carga, el cuerpo es más nuevo que
+    # el ETag y la siguiente petición simplemente vuelve a recibir un 200
+    response.headers.update(validadores(etag, ultima_modificacion))
     caso = db.query(Caso).options(
         joinedload(Caso.paciente),
         joinedload(Caso.motivo_obj),
@@ -472,10 +660,23 @@ async def obtener_caso(
     if not caso:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
 
-    # PERMISOS: Agentes solo pueden ver casos asignados a ellos
+    return caso
+
+def obtener_caso_archivado(
+    caso_id: int, request: Request, response: Response, current_user: Usuario, db: Session
+):
+    """Detalle de un caso que ya no está en las tablas calientes (solo lectura)"""
+    caso = archivo_casos.obtener_caso_archivado(db, caso_id)
+    if not caso:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
     if current_user.rol == RolEnum.AGENTE and caso.agente_asignado_id != current_user.id:
         raise HTTPException(status_code=403, detail="No tiene permisos para ver este caso")
 
+    # Un caso archivado no cambia: su versión es la fecha en que se archivó
+    etag = etag_de_version("caso_archivado", caso_id, caso.fecha_archivo)
+    if no_modificado(request, etag, caso.fecha_archivo):
+        return respuesta_no_modificado(etag, caso.fecha_archivo)
+    response.headers.update(validadores(etag, caso.fecha_archivo))
     return caso
 
 @api_router.post("/casos", response_model=schemas.Caso)
@@ -484,51 +685,252 @@ async def crear_caso(
     current_user: Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    numero_caso = generar_numero_caso(db)
-    
-    db_caso = Caso(
-        **caso.model_dump(),
-        numero_caso=numero_caso,
-        agente_creador_id=current_user.id
-    )
-    db.add(db_caso)
-    db.flush()
-
-    # Registrar evento de creación
-    registrar_evento(
-        db=db,
-        caso_id=db_caso.id,
-        usuario_id=current_user.id,
-        tipo_evento='creacion',
-        campo_modificado=None,
-        valor_anterior=None,
-        valor_nuevo=f"Caso {db_caso.numero_caso} creado",
-        comentario="Caso creado desde web"
-    )
+    datos_caso = caso.model_dump()
+    agente_reservado = None
+    # Cualquier fallo antes del commit deshace la reserva de carga
+    try:
+        # Sin agente elegido se asigna el de menor carga (ver asignacion_agentes.py)
+        if datos_caso['agente_asignado_id'] is None:
+            agente_reservado = motor_asignacion.asignar(db, caso.prioridad, caso.estado)
+            datos_caso['agente_asignado_id'] = agente_reservado
 
-    # Registrar en historial (compatibilidad)
-    historial = HistorialEstado(
-        caso_id=db_caso.id,
-        estado_anterior=None,
-        estado_nuevo=db_caso.estado.value,
-        usuario_id=current_user.id,
-        comentario="Caso creado"
-    )
-    db.add(historial)
-    
-    # Crear alerta si es prioridad alta
-    if db_caso.prioridad == PrioridadEnum.ALTA:
-        alerta = Alerta(
+        numero_caso = generar_numero_caso(db)
+
+        db_caso = Caso(
+            **datos_caso,
+            numero_caso=numero_caso,
+            agente_creador_id=current_user.id
+        )
+        db.add(db_caso)
+        db.flush()
+
+        # Registrar evento de creación
+        registrar_evento(
+            db=db,
             caso_id=db_caso.id,
-            tipo_alerta=TipoAlertaEnum.PRIORIDAD_ALTA,
-            leida=False
+            usuario_id=current_user.id,
+            tipo_evento='creacion',
+            campo_modificado=None,
+            valor_anterior=None,
+            valor_nuevo=f"Caso {db_caso.numero_caso} creado",
+            comentario="Caso creado desde web"
         )
-        db.add(alerta)
-    
-    db.commit()
+
+        # Registrar en historial (compatibilidad)
+        historial = HistorialEstado(
+            caso_id=db_caso.id,
+            estado_anterior=None,
+            estado_nuevo=db_caso.estado.value,
+            usuario_id=current_user.id,
+            comentario="Caso creado"
+        )
+        db.add(historial)
+
+        # Crear alerta si es prioridad alta
+        alerta = None
+        if db_caso.prioridad == PrioridadEnum.ALTA:
+            alerta = Alerta(
+                caso_id=db_caso.id,
+                tipo_alerta=TipoAlertaEnum.PRIORIDAD_ALTA,
+                leida=False
+            )
+            db.add(alerta)
+
+        idempotencia.confirmar(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        motor_asignacion.liberar(agente_reservado, caso.prioridad, caso.estado)
+        raise
     db.refresh(db_caso)
+
+    if agente_reservado is not None:
+        # La carga ya se reservó en este proceso; el oyente no debe sumarla otra vez
+        bus_eventos.publicar("caso_creado", datos_evento_caso(db_caso, asignado_por=motor_asignacion.token))
+    else:
+        bus_eventos.publicar("caso_creado", datos_evento_caso(db_caso))
+    if alerta is not None:
+        bus_eventos.publicar("alerta_creada", datos_evento_alerta(alerta, db_caso))
     return db_caso
 
+CAMPOS_ACTUALIZABLES_CASO = ('estado', 'prioridad', 'agente_asignado_id', 'descripcion')
+MAX_ACTUALIZACIONES_LOTE = int(os.environ.get('MAX_ACTUALIZACIONES_LOTE', '500'))
+
+def _resumir(texto: str) -> str:
+    return texto[:100] + "..." if len(texto) > 100 else texto
+
+def normalizar_cambios_caso(cambios: dict) -> dict:
+    """Filtra los campos actualizables y convierte estado/prioridad a enum (ValueError si no son válidos)"""
+    normalizados = {}
+    for key, value in cambios.items():
+        if key not in CAMPOS_ACTUALIZABLES_CASO:
+            continue
+        if key == 'estado' and isinstance(value, str):
+            if value not in EstadoCasoEnum.__members__:
+                raise ValueError(f"Estado no válido: {value}")
+            value = EstadoCasoEnum[value]
+        elif key == 'prioridad' and isinstance(value, str):
+            if value not in PrioridadEnum.__members__:
+                raise ValueError(f"Prioridad no válida: {value}")
+            value = PrioridadEnum[value]
+        normalizados[key] = value
+    return normalizados
+
+def aplicar_cambios_caso(
+    caso: Caso,
+    cambios: dict,
+    comentario: Optional[str],
+    usuario_id: int,
+    nombres_usuarios: dict,
+    eventos: list,
+    historiales: list
+) -> dict:
+    """
+    Aplica cambios ya normalizados a un caso y agrega a `eventos` y `historiales`
+    las filas de historial como diccionarios, para insertarlas en bloque.
+
+    `nombres_usuarios` (id -> nombre_completo) debe incluir el agente anterior y
+    el nuevo. Devuelve los datos extra del evento caso_actualizado del stream.
+    """
+    # Guardar valores anteriores
+    estado_anterior = caso.estado.value if caso.estado else None
+    prioridad_anterior = caso.prioridad.value if caso.prioridad else None
+    agente_anterior_id = caso.agente_asignado_id
+    descripcion_anterior = caso.descripcion
+
+    def evento(tipo_evento, campo_modificado, valor_anterior, valor_nuevo):
+        eventos.append({
+            "caso_id": caso.id,
+            "usuario_id": usuario_id,
+            "tipo_evento": tipo_evento,
+            "campo_modificado": campo_modificado,
+            "valor_anterior": valor_anterior,
+            "valor_nuevo": valor_nuevo,
+            "comentario": comentario,
+        })
+
+    for key, value in cambios.items():
+        if key == 'estado':
+            if caso.estado != value:
+                evento('cambio_estado', 'estado', estado_anterior, value.value)
+                # Mantener compatibilidad con tabla antigua
+                historiales.append({
+                    "caso_id": caso.id,
+                    "estado_anterior": estado_anterior,
+                    "estado_nuevo": value.value,
+                    "usuario_id": usuario_id,
+                    "comentario": comentario,
+                })
+
+        elif key == 'prioridad':
+            if caso.prioridad != value:
+                evento('cambio_prioridad', 'prioridad', prioridad_anterior, value.value)
+
+        elif key == 'agente_asignado_id':
+            if agente_anterior_id != value:
+                evento(
+                    'asignacion', 'agente_asignado',
+                    nombres_usuarios.get(agente_anterior_id) or "Sin asignar",
+                    nombres_usuarios.get(value) or "Sin asignar"
+                )
+
+        elif key == 'descripcion':
+            if descripcion_anterior != value:
+                evento('edicion_descripcion', 'descripcion', _resumir(descripcion_anterior), _resumir(value))
+
+        setattr(caso, key, value)
+
+    # Si se cierra el caso, calcular tiempo de resolución
+    if caso.estado == EstadoCasoEnum.CERRADO and not caso.fecha_cierre:
+        caso.fecha_cierre = datetime.now(timezone.utc)
+        # fecha_creacion se lee de la base de datos como UTC sin zona horaria
+        fecha_creacion = caso.fecha_creacion
+        if fecha_creacion.tzinfo is None:
+            fecha_creacion = fecha_creacion.replace(tzinfo=timezone.utc)
+        diff = caso.fecha_cierre - fecha_creacion
+        caso.tiempo_resolucion_horas = diff.total_seconds() / 3600
+
+    return {
+        "estado_anterior": estado_anterior,
+        "prioridad_anterior": prioridad_anterior,
+        "agente_anterior_id": agente_anterior_id
+    }
+
+def guardar_historial_en_bloque(db: Session, eventos: list, historiales: list):
+    if eventos:
+        db.execute(insert(HistorialEvento), eventos)
+    if historiales:
+        db.execute(insert(HistorialEstado), historiales)
+
+@api_router.put("/casos/lote", response_model=List[schemas.ResultadoActualizacionLote])
+async def actualizar_casos_lote(
+    actualizaciones: List[schemas.ActualizacionCasoLote],
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Aplica varias actualizaciones de casos en una sola transacción (p. ej.
+    reasignaciones en el cambio de turno). Los errores se reportan por ítem y
+    no impiden aplicar el resto.
+    """
+    if len(actualizaciones) > MAX_ACTUALIZACIONES_LOTE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {MAX_ACTUALIZACIONES_LOTE} actualizaciones por lote"
+        )
+
+    casos = {
+        c.id: c for c in
+        db.query(Caso).filter(Caso.id.in_({a.caso_id for a in actualizaciones})).all()
+    }
+    nombres = cache_catalogos.nombres_usuarios(
+        db,
+        [c.agente_asignado_id for c in casos.values()] +
+        [a.cambios.get('agente_asignado_id') for a in actualizaciones]
+    )
+
+    resultados = []
+    eventos, historiales, publicaciones = [], [], []
+    for actualizacion in actualizaciones:
+        caso = casos.get(actualizacion.caso_id)
+        if caso is None:
+            resultados.append({"caso_id": actualizacion.caso_id, "exito": False, "error": "Caso no encontrado"})
+            continue
+        # PERMISOS: Solo administradores o el agente asignado pueden actualizar
+        if current_user.rol == RolEnum.AGENTE and caso.agente_asignado_id != current_user.id:
+            resultados.append({"caso_id": caso.id, "exito": False, "error": "No tiene permisos para modificar este caso"})
+            continue
+        try:
+            cambios = normalizar_cambios_caso(actualizacion.cambios)
+        except ValueError as e:
+            resultados.append({"caso_id": caso.id, "exito": False, "error": str(e)})
+            continue
+        nuevo_agente = cambios.get('agente_asignado_id')
+        if nuevo_agente and nuevo_agente not in nombres:
+            resultados.append({"caso_id": caso.id, "exito": False, "error": "Agente no encontrado"})
+            continue
+
+        extra = aplicar_cambios_caso(
+            caso, cambios, actualizacion.cambios.get('comentario'),
+            current_user.id, nombres, eventos, historiales
+        )
+        # Los datos del evento se toman antes del commit, que expira los objetos
+        publicaciones.append(datos_evento_caso(caso, **extra))
+        resultados.append({
+            "caso_id": caso.id,
+            "numero_caso": caso.numero_caso,
+            "exito": True,
+            "estado": caso.estado,
+            "agente_asignado_id": caso.agente_asignado_id
+        })
+
+    guardar_historial_en_bloque(db, eventos, historiales)
+    db.commit()
+
+    for datos in publicaciones:
+        bus_eventos.publicar("caso_actualizado", datos)
+    return resultados
+
 @api_router.put("/casos/{caso_id}", response_model=schemas.Caso)
 async def actualizar_caso(
     caso_id: int,
@@ -538,113 +940,33 @@ async def actualizar_caso(
 ):
     caso = db.query(Caso).filter(Caso.id == caso_id).first()
     if not caso:
+        if archivo_casos.esta_archivado(db, caso_id=caso_id):
+            raise HTTPException(status_code=409, detail="El caso está archivado y no se puede modificar")
         raise HTTPException(status_code=404, detail="Caso no encontrado")
 
     # PERMISOS: Solo administradores o el agente asignado pueden actualizar
     if current_user.rol == RolEnum.AGENTE and caso.agente_asignado_id != current_user.id:
         raise HTTPException(status_code=403, detail="No tiene permisos para modificar este caso")
 
-    # Guardar valores anteriores
-    estado_anterior = caso.estado.value if caso.estado else None
-    prioridad_anterior = caso.prioridad.value if caso.prioridad else None
-    agente_anterior_id = caso.agente_asignado_id
-    descripcion_anterior = caso.descripcion
-
-    comentario = caso_update.pop('comentario', None)
-
-    # Actualizar campos y registrar eventos
-    for key, value in caso_update.items():
-        if key in ['estado', 'prioridad', 'agente_asignado_id', 'descripcion']:
-            if key == 'estado':
-                nuevo_valor = EstadoCasoEnum[value] if isinstance(value, str) else value
-                if caso.estado != nuevo_valor:
-                    # Registrar evento de cambio de estado
-                    registrar_evento(
-                        db=db,
-                        caso_id=caso.id,
-                        usuario_id=current_user.id,
-                        tipo_evento='cambio_estado',
-                        campo_modificado='estado',
-                        valor_anterior=estado_anterior,
-                        valor_nuevo=nuevo_valor.value,
-                        comentario=comentario
-                    )
-                    # Mantener compatibilidad con tabla antigua
-                    historial = HistorialEstado(
-                        caso_id=caso.id,
-                        estado_anterior=estado_anterior,
-                        estado_nuevo=nuevo_valor.value,
-                        usuario_id=current_user.id,
-                        comentario=comentario
-                    )
-                    db.add(historial)
-                setattr(caso, key, nuevo_valor)
-
-            elif key == 'prioridad':
-                nuevo_valor = PrioridadEnum[value] if isinstance(value, str) else value
-                if caso.prioridad != nuevo_valor:
-                    # Registrar evento de cambio de prioridad
-                    registrar_evento(
-                        db=db,
-                        caso_id=caso.id,
-                        usuario_id=current_user.id,
-                        tipo_evento='cambio_prioridad',
-                        campo_modificado='prioridad',
-                        valor_anterior=prioridad_anterior,
-                        valor_nuevo=nuevo_valor.value,
-                        comentario=comentario
-                    )
-                setattr(caso, key, nuevo_valor)
-
-            elif key == 'agente_asignado_id':
-                if agente_anterior_id != value:
-                    # Registrar evento de asignación
-                    agente_anterior_nombre = ""
-                    agente_nuevo_nombre = ""
-                    if agente_anterior_id:
-                        agente_ant = db.query(Usuario).filter(Usuario.id == agente_anterior_id).first()
-                        if agente_ant:
-                            agente_anterior_nombre = agente_ant.nombre_completo
-                    if value:
-                        agente_nuevo = db.query(Usuario).filter(Usuario.id == value).first()
-                        if agente_nuevo:
-                            agente_nuevo_nombre = agente_nuevo.nombre_completo
-
-                    registrar_evento(
-                        db=db,
-                        caso_id=caso.id,
-                        usuario_id=current_user.id,
-                        tipo_evento='asignacion',
-                        campo_modificado='agente_asignado',
-                        valor_anterior=agente_anterior_nombre or "Sin asignar",
-                        valor_nuevo=agente_nuevo_nombre or "Sin asignar",
-                        comentario=comentario
-                    )
-                setattr(caso, key, value)
-
-            elif key == 'descripcion':
-                if descripcion_anterior != value:
-                    # Registrar evento de edición de descripción
-                    registrar_evento(
-                        db=db,
-                        caso_id=caso.id,
-                        usuario_id=current_user.id,
-                        tipo_evento='edicion_descripcion',
-                        campo_modificado='descripcion',
-                        valor_anterior=descripcion_anterior[:100] + "..." if len(descripcion_anterior) > 100 else descripcion_anterior,
-                        valor_nuevo=value[:100] + "..." if len(value) > 100 else value,
-                        comentario=comentario
-                    )
-                setattr(caso, key, value)
-
-    # Si se cierra el caso, calcular tiempo de resolución
-    if caso.estado == EstadoCasoEnum.CERRADO and not caso.fecha_cierre:
-        caso.fecha_cierre = datetime.now(timezone.utc)
-        diff = caso.fecha_cierre - caso.fecha_creacion
-        caso.tiempo_resolucion_horas = diff.total_seconds() / 3600
-
+    try:
+        cambios = normalizar_cambios_caso(caso_update)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    nombres = {}
+    if 'agente_asignado_id' in cambios and cambios['agente_asignado_id'] != caso.agente_asignado_id:
+        nombres = cache_catalogos.nombres_usuarios(db, [caso.agente_asignado_id, cambios['agente_asignado_id']])
+
+    eventos, historiales = [], []
+    extra = aplicar_cambios_caso(
+        caso, cambios, caso_update.get('comentario'),
+        current_user.id, nombres, eventos, historiales
+    )
+    guardar_historial_en_bloque(db, eventos, historiales)
     db.commit()
     db.refresh(caso)
+
+    bus_eventos.publicar("caso_actualizado", datos_evento_caso(caso, **extra))
     return caso
 
 # ==================== INTERACCIONES ====================
@@ -653,7 +975,7 @@ async def actualizar_caso(
 async def listar_interacciones(
     caso_id: Optional[int] = None,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     query = db.query(Interaccion)
     if caso_id:
@@ -666,27 +988,141 @@ async def crear_interaccion(
     current_user: Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    db_interaccion = Interaccion(**interaccion.model_dump())
+    # El resumen del caso se actualiza antes de insertar: bloquea la fila del
+    # caso y evita el error de clave foránea si no existe
+    fecha = datetime.now(timezone.utc)
+    if not interacciones_caso.registrar_interaccion(db, interaccion.caso_id, fecha):
+        db.rollback()
+        if archivo_casos.esta_archivado(db, caso_id=interaccion.caso_id):
+            raise HTTPException(status_code=409, detail="El caso está archivado y no se puede modificar")
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+
+    db_interaccion = Interaccion(**interaccion.model_dump(), fecha_registro=fecha)
     db.add(db_interaccion)
+    idempotencia.confirmar(db)
     db.commit()
     db.refresh(db_interaccion)
     return db_interaccion
 
+# ==================== HISTORIAL DE EVENTOS ====================
+
+@api_router.get("/eventos", response_model=List[schemas.HistorialEvento])
+async def buscar_eventos(
+    caso_id: Optional[int] = None,
+    tipo_evento: Optional[str] = None,
+    agent_name: Optional[str] = None,
+    campaign_name: Optional[str] = None,
+    telefono: Optional[str] = None,
+    datos: Optional[str] = Query(None, description='Objeto JSON contenido en datos_adicionales, p. ej. {"agent_name": "Ana"}'),
+    fecha_inicio: Optional[datetime] = None,
+    fecha_fin: Optional[datetime] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Eventos del historial filtrados en SQL por los datos de la llamada de
+    OmniLeads (índices de expresión) o por cualquier contenido de
+    datos_adicionales (índice GIN), del más reciente al más antiguo. Un rango
+    de fechas limita las particiones que se recorren.
+    """
+    query = db.query(HistorialEvento).options(joinedload(HistorialEvento.usuario))
+    # PERMISOS POR ROL: Agentes solo ven eventos de los casos asignados a ellos
+    if current_user.rol == RolEnum.AGENTE:
+        query = query.join(Caso, HistorialEvento.caso_id == Caso.id).filter(
+            Caso.agente_asignado_id == current_user.id)
+    if caso_id is not None:
+        query = query.filter(HistorialEvento.caso_id == caso_id)
+    if tipo_evento:
+        query = query.filter(HistorialEvento.tipo_evento == tipo_evento)
+    for clave, valor in (("agent_name", agent_name), ("campaign_name", campaign_name), ("telefono", telefono)):
+        if valor is not None:
+            query = query.filter(HistorialEvento.datos_adicionales[clave].astext == valor)
+    if datos:
+        try:
+            contenido = json.loads(datos)
+        except ValueError:
+            contenido = None
+        if not isinstance(contenido, dict) or not contenido:
+            raise HTTPException(status_code=400, detail="El filtro de datos debe ser un objeto JSON")
+        query = query.filter(HistorialEvento.datos_adicionales.contains(contenido))
+    if fecha_inicio:
+        query = query.filter(HistorialEvento.fecha_evento >= fecha_inicio)
+    if fecha_fin:
+        query = query.filter(HistorialEvento.fecha_evento <= fecha_fin)
+    return query.order_by(
+        HistorialEvento.fecha_evento.desc(), HistorialEvento.id.desc()
+    ).offset(skip).limit(limit).all()
+
 # ==================== ALERTAS ====================
 
-@api_router.get("/alertas", response_model=List[schemas.Alerta])
+def _filtrar_alertas_por_usuario(query, current_user: Usuario):
+    # PERMISOS POR ROL: Agentes solo ven alertas de los casos asignados a ellos
+    if current_user.rol == RolEnum.AGENTE:
+        query = query.filter(Caso.agente_asignado_id == current_user.id)
+    return query
+
+@api_router.get("/alertas", response_model=List[schemas.AlertaBandeja])
 async def listar_alertas(
     leida: Optional[bool] = None,
     tipo: Optional[TipoAlertaEnum] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
     current_user: Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Alerta)
+    """Bandeja de alertas paginada con el número de caso, paciente y prioridad"""
+    query = db.query(
+        Alerta.id,
+        Alerta.caso_id,
+        Alerta.tipo_alerta,
+        Alerta.fecha_creacion,
+        Alerta.leida,
+        Alerta.usuario_notificado_id,
+        Caso.numero_caso,
+        Caso.prioridad,
+        Caso.agente_asignado_id,
+        (Paciente.nombre + ' ' + Paciente.apellidos).label('paciente_nombre')
+    ).join(Caso, Alerta.caso_id == Caso.id).join(Paciente, Caso.paciente_id == Paciente.id)
+    query = _filtrar_alertas_por_usuario(query, current_user)
     if leida is not None:
         query = query.filter(Alerta.leida == leida)
     if tipo:
         query = query.filter(Alerta.tipo_alerta == tipo)
-    return query.order_by(Alerta.fecha_creacion.desc()).all()
+    return query.order_by(Alerta.fecha_creacion.desc(), Alerta.id.desc()).offset(skip).limit(limit).all()
+
+@api_router.get("/alertas/no-leidas")
+async def contar_alertas_no_leidas(
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    agente_id = current_user.id if current_user.rol == RolEnum.AGENTE else None
+    return {"no_leidas": contador_alertas.obtener(db, agente_id)}
+
+@api_router.put("/alertas/marcar-todas-leidas")
+async def marcar_todas_alertas_leidas(
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Marca como leídas todas las alertas visibles para el usuario en un solo UPDATE"""
+    query = db.query(Alerta).filter(Alerta.leida == False)
+    if current_user.rol == RolEnum.AGENTE:
+        query = query.filter(Alerta.caso_id.in_(
+            select(Caso.id).where(Caso.agente_asignado_id == current_user.id)
+        ))
+    cantidad = query.update(
+        {Alerta.leida: True, Alerta.usuario_notificado_id: current_user.id},
+        synchronize_session=False
+    )
+    db.commit()
+    if cantidad:
+        bus_eventos.publicar("alertas_leidas", {
+            "cantidad": cantidad,
+            "usuario_id": current_user.id,
+            "agente_asignado_id": current_user.id if current_user.rol == RolEnum.AGENTE else None
+        })
+    return {"message": f"{cantidad} alertas marcadas como leídas", "cantidad": cantidad}
 
 @api_router.put("/alertas/{alerta_id}/marcar-leida")
 async def marcar_alerta_leida(
@@ -697,9 +1133,14 @@ async def marcar_alerta_leida(
     alerta = db.query(Alerta).filter(Alerta.id == alerta_id).first()
     if not alerta:
         raise HTTPException(status_code=404, detail="Alerta no encontrada")
+    if current_user.rol == RolEnum.AGENTE and alerta.caso.agente_asignado_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tienes permiso para modificar esta alerta")
+    if alerta.leida:
+        return {"message": "Alerta marcada como leída"}
     alerta.leida = True
     alerta.usuario_notificado_id = current_user.id
     db.commit()
+    bus_eventos.publicar("alerta_leida", datos_evento_alerta(alerta, alerta.caso))
     return {"message": "Alerta marcada como leída"}
 
 @api_router.post("/alertas/verificar-sla")
@@ -712,6 +1153,7 @@ async def verificar_sla(db: Session = Depends(get_db)):
         Caso.fecha_creacion <= fecha_limite
     ).all()
     
+    nuevas_alertas = []
     for caso in casos_vencidos:
         # Verificar si ya existe alerta
         alerta_existente = db.query(Alerta).filter(
@@ -726,16 +1168,66 @@ async def verificar_sla(db: Session = Depends(get_db)):
                 leida=False
             )
             db.add(alerta)
+            nuevas_alertas.append((alerta, caso))
     
     db.commit()
+
+    for alerta, caso in nuevas_alertas:
+        bus_eventos.publicar("alerta_creada", datos_evento_alerta(alerta, caso))
     return {"message": f"Se verificaron {len(casos_vencidos)} casos"}
 
+# ==================== STREAM DE EVENTOS (SSE) ====================
+
+@api_router.get("/stream")
+async def stream_eventos(request: Request, token: str = Query(...)):
+    """
+    Server-sent events con los cambios de casos y alertas.
+    EventSource no permite enviar headers, por eso el JWT llega como parámetro.
+    """
+    db = SessionLocal()
+    try:
+        usuario = obtener_usuario_desde_token(token, db)
+        usuario_id = usuario.id
+        es_agente = usuario.rol == RolEnum.AGENTE
+    finally:
+        db.close()
+
+    async def generar():
+        cola = bus_eventos.suscribir()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+
+                evento = json.loads(evento)
+                datos = evento["datos"]
+                # Los agentes solo reciben eventos de sus casos
+                if es_agente and "agente_asignado_id" in datos and usuario_id not in (
+                    datos.get("agente_asignado_id"), datos.get("agente_anterior_id")
+                ):
+                    continue
+                yield f"event: {evento['tipo']}\ndata: {json.dumps(datos)}\n\n"
+        finally:
+            bus_eventos.desuscribir(cola)
+
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ==================== MÉTRICAS Y DASHBOARD ====================
 
 @api_router.get("/metricas/dashboard", response_model=schemas.DashboardMetrics)
 async def obtener_metricas_dashboard(
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     hoy_inicio = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     hoy_fin = hoy_inicio + timedelta(days=1)
@@ -754,22 +1246,33 @@ async def obtener_metricas_dashboard(
     
     casos_en_proceso = db.query(Caso).filter(Caso.estado == EstadoCasoEnum.EN_PROCESO).count()
     
-    total_casos = db.query(Caso).count()
-    
-    # Casos cerrados con una sola interacción
-    casos_primera_llamada = db.query(Caso).join(Interaccion).filter(
-        Caso.estado == EstadoCasoEnum.CERRADO
-    ).group_by(Caso.id).having(func.count(Interaccion.id) == 1).count()
-    
-    total_cerrados = db.query(Caso).filter(Caso.estado == EstadoCasoEnum.CERRADO).count()
+    # Los totales históricos suman los casos archivados (todos cerrados)
+    total_casos = 0
+    casos_primera_llamada = 0
+    total_cerrados = 0
+    suma_tiempo, con_tiempo = 0.0, 0
+    for modelo_caso in (Caso, CasoArchivado):
+        total_casos += db.query(modelo_caso).count()
+
+        # Casos cerrados con una sola interacción
+        casos_primera_llamada += db.query(modelo_caso).filter(
+            modelo_caso.estado == EstadoCasoEnum.CERRADO,
+            modelo_caso.num_interacciones == 1
+        ).count()
+
+        total_cerrados += db.query(modelo_caso).filter(modelo_caso.estado == EstadoCasoEnum.CERRADO).count()
+
+        # Tiempo promedio de resolución
+        suma, cantidad = db.query(
+            func.sum(modelo_caso.tiempo_resolucion_horas), func.count(modelo_caso.tiempo_resolucion_horas)
+        ).one()
+        suma_tiempo += suma or 0
+        con_tiempo += cantidad
+
     tasa_primera_llamada = (casos_primera_llamada / total_cerrados * 100) if total_cerrados > 0 else 0
+    avg_tiempo = suma_tiempo / con_tiempo if con_tiempo else None
     
-    # Tiempo promedio de resolución
-    avg_tiempo = db.query(func.avg(Caso.tiempo_resolucion_horas)).filter(
-        Caso.tiempo_resolucion_horas.isnot(None)
-    ).scalar()
-    
-    alertas_activas = db.query(Alerta).filter(Alerta.leida == False).count()
+    alertas_activas = contador_alertas.obtener(db, None)
     
     return {
         "casos_abiertos_hoy": casos_abiertos_hoy,
@@ -785,89 +1288,133 @@ async def obtener_metricas_dashboard(
 async def obtener_casos_por_hora(
     fecha: str,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     fecha_obj = datetime.fromisoformat(fecha)
     fecha_inicio = fecha_obj.replace(hour=0, minute=0, second=0, microsecond=0)
     fecha_fin = fecha_inicio + timedelta(days=1)
-    
+
+    fuente = rollup_metricas.fuente_casos(db, fecha_inicio, fecha_fin, ["hora"])
     resultados = db.query(
-        extract('hour', Caso.fecha_creacion).label('hora'),
-        func.count(Caso.id).label('cantidad')
-    ).filter(
-        Caso.fecha_creacion >= fecha_inicio,
-        Caso.fecha_creacion < fecha_fin
-    ).group_by('hora').order_by('hora').all()
-    
-    return [{"hora": int(r.hora), "cantidad": r.cantidad} for r in resultados]
+        fuente.c.hora,
+        func.sum(fuente.c.cantidad).label('cantidad')
+    ).group_by(fuente.c.hora).order_by(fuente.c.hora).all()
+
+    return [{"hora": int(r.hora), "cantidad": int(r.cantidad)} for r in resultados]
+
+def _rango_dias(inicio: str, fin: str):
+    """Rango local [inicio, fin) de los endpoints de métricas; fin incluye su día completo"""
+    fecha_inicio = datetime.fromisoformat(inicio)
+    fecha_fin = datetime.fromisoformat(fin)
+    if len(fin) == 10:
+        fecha_fin += timedelta(days=1)
+    return fecha_inicio, fecha_fin
 
 @api_router.get("/metricas/casos-por-motivo")
 async def obtener_casos_por_motivo(
     inicio: str,
     fin: str,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    fecha_inicio = datetime.fromisoformat(inicio)
-    fecha_fin = datetime.fromisoformat(fin)
-    
+    fecha_inicio, fecha_fin = _rango_dias(inicio, fin)
+
+    fuente = rollup_metricas.fuente_casos(db, fecha_inicio, fecha_fin, ["motivo_id"])
+    cantidad = func.sum(fuente.c.cantidad)
     resultados = db.query(
         MotivoPQR.nombre,
-        func.count(Caso.id).label('cantidad')
-    ).join(Caso).filter(
-        Caso.fecha_creacion >= fecha_inicio,
-        Caso.fecha_creacion <= fecha_fin
-    ).group_by(MotivoPQR.nombre).order_by(func.count(Caso.id).desc()).limit(10).all()
-    
-    return [{"motivo": r.nombre, "cantidad": r.cantidad} for r in resultados]
+        cantidad.label('cantidad')
+    ).join(fuente, fuente.c.motivo_id == MotivoPQR.id).group_by(
+        MotivoPQR.nombre
+    ).order_by(cantidad.desc()).limit(10).all()
+
+    return [{"motivo": r.nombre, "cantidad": int(r.cantidad)} for r in resultados]
 
 @api_router.get("/metricas/desempeno-agentes")
 async def obtener_desempeno_agentes(
     inicio: str,
     fin: str,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    fecha_inicio = datetime.fromisoformat(inicio)
-    fecha_fin = datetime.fromisoformat(fin)
-    
+    fecha_inicio, fecha_fin = _rango_dias(inicio, fin)
+
+    fuente = rollup_metricas.fuente_casos(db, fecha_inicio, fecha_fin, ["agente_asignado_id", "estado"])
     resultados = db.query(
         Usuario.nombre_completo,
-        func.count(case((Caso.estado == EstadoCasoEnum.ABIERTO, 1))).label('abiertos'),
-        func.count(case((Caso.estado == EstadoCasoEnum.CERRADO, 1))).label('cerrados'),
-        func.avg(Caso.tiempo_resolucion_horas).label('promedio_horas')
-    ).join(Caso, Usuario.id == Caso.agente_asignado_id).filter(
-        Caso.fecha_creacion >= fecha_inicio,
-        Caso.fecha_creacion <= fecha_fin
-    ).group_by(Usuario.nombre_completo).all()
-    
+        func.sum(case((fuente.c.estado == EstadoCasoEnum.ABIERTO, fuente.c.cantidad), else_=0)).label('abiertos'),
+        func.sum(case((fuente.c.estado == EstadoCasoEnum.CERRADO, fuente.c.cantidad), else_=0)).label('cerrados'),
+        (func.sum(fuente.c.suma_resolucion_horas) /
+         func.nullif(func.sum(fuente.c.casos_con_resolucion), 0)).label('promedio_horas')
+    ).join(fuente, Usuario.id == fuente.c.agente_asignado_id).group_by(Usuario.nombre_completo).all()
+
     return [{
         "agente": r.nombre_completo,
-        "abiertos": r.abiertos,
-        "cerrados": r.cerrados,
+        "abiertos": int(r.abiertos),
+        "cerrados": int(r.cerrados),
         "promedio_horas": round(r.promedio_horas, 2) if r.promedio_horas else 0
     } for r in resultados]
 
+@api_router.post("/metricas/rollup/refrescar")
+async def refrescar_rollup_metricas(
+    current_user: Usuario = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Refresca metricas_diarias sin esperar a la tarea periódica"""
+    dias = rollup_metricas.refrescar_metricas_diarias(db)
+    dias_llamadas = rollup_llamadas.refrescar_metricas_llamadas(db)
+    return {"message": f"Se recalcularon {dias} días de casos y {dias_llamadas} de llamadas"}
+
+# SLA de resolución: 5 días = 120 horas
+SLA_HORAS = 120
+
+def _agregados_resolucion(fuente):
+    """Columnas agregadas de tiempo de resolución, cumplimiento de SLA y percentiles"""
+    horas = fuente.c.tiempo_resolucion_horas
+    return [
+        func.count(fuente.c.id).label('casos_cerrados'),
+        func.avg(horas).label('tiempo_promedio'),
+        func.min(horas).label('tiempo_minimo'),
+        func.max(horas).label('tiempo_maximo'),
+        func.count(fuente.c.id).filter(horas <= SLA_HORAS).label('dentro_sla'),
+        func.percentile_cont(0.5).within_group(horas).label('p50'),
+        func.percentile_cont(0.9).within_group(horas).label('p90'),
+        func.percentile_cont(0.95).within_group(horas).label('p95')
+    ]
+
+def _percentiles_resolucion(r) -> dict:
+    return {
+        "p50_horas": round(r.p50, 2) if r.p50 is not None else 0,
+        "p90_horas": round(r.p90, 2) if r.p90 is not None else 0,
+        "p95_horas": round(r.p95, 2) if r.p95 is not None else 0
+    }
+
 @api_router.get("/metricas/tiempo-resolucion")
 async def obtener_tiempo_resolucion(
     inicio: str,
     fin: str,
     agrupar_por: str = "general",  # general, motivo, prioridad
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     fecha_inicio = datetime.fromisoformat(inicio)
     fecha_fin = datetime.fromisoformat(fin)
 
-    # Calcular promedio general y SLA
-    casos_cerrados = db.query(Caso).filter(
-        Caso.estado == EstadoCasoEnum.CERRADO,
-        Caso.fecha_cierre >= fecha_inicio,
-        Caso.fecha_cierre <= fecha_fin,
-        Caso.tiempo_resolucion_horas.isnot(None)
-    ).all()
+    # Casos cerrados en el rango, calientes y archivados
+    fuente = archivo_casos.union_casos(
+        ["id", "motivo_id", "prioridad", "tiempo_resolucion_horas"],
+        lambda m: [
+            m.estado == EstadoCasoEnum.CERRADO,
+            m.fecha_cierre >= fecha_inicio,
+            m.fecha_cierre <= fecha_fin,
+            m.tiempo_resolucion_horas.isnot(None)
+        ]
+    )
+
+    # Promedio general, SLA y percentiles calculados en la base de datos
+    general = db.query(*_agregados_resolucion(fuente)).one()
 
-    total = len(casos_cerrados)
+    total = general.casos_cerrados
     if total == 0:
         return {
             "periodo": {"inicio": inicio, "fin": fin},
@@ -876,108 +1423,350 @@ async def obtener_tiempo_resolucion(
             "promedio_general": 0,
             "casos_dentro_sla": 0,
             "casos_fuera_sla": 0,
-            "porcentaje_cumplimiento_sla": 0
+            "porcentaje_cumplimiento_sla": 0,
+            "percentiles": _percentiles_resolucion(general)
         }
 
-    tiempos = [c.tiempo_resolucion_horas for c in casos_cerrados]
-    promedio_general = sum(tiempos) / len(tiempos)
-    casos_dentro_sla = sum(1 for t in tiempos if t <= 120)  # 5 días = 120 horas
-    casos_fuera_sla = total - casos_dentro_sla
-
     # Agrupar según el parámetro
-    datos = []
+    resultados = []
     if agrupar_por == "motivo":
         resultados = db.query(
             MotivoPQR.nombre.label('categoria'),
-            func.count(Caso.id).label('casos_cerrados'),
-            func.avg(Caso.tiempo_resolucion_horas).label('tiempo_promedio'),
-            func.min(Caso.tiempo_resolucion_horas).label('tiempo_minimo'),
-            func.max(Caso.tiempo_resolucion_horas).label('tiempo_maximo')
-        ).join(Caso).filter(
-            Caso.estado == EstadoCasoEnum.CERRADO,
-            Caso.fecha_cierre >= fecha_inicio,
-            Caso.fecha_cierre <= fecha_fin,
-            Caso.tiempo_resolucion_horas.isnot(None)
-        ).group_by(MotivoPQR.nombre).all()
-
-        datos = [{
-            "categoria": r.categoria,
-            "casos_cerrados": r.casos_cerrados,
-            "tiempo_promedio_horas": round(r.tiempo_promedio, 2),
-            "tiempo_minimo_horas": round(r.tiempo_minimo, 2),
-            "tiempo_maximo_horas": round(r.tiempo_maximo, 2)
-        } for r in resultados]
+            *_agregados_resolucion(fuente)
+        ).join(fuente, fuente.c.motivo_id == MotivoPQR.id).group_by(MotivoPQR.nombre).all()
 
     elif agrupar_por == "prioridad":
         resultados = db.query(
-            Caso.prioridad.label('categoria'),
-            func.count(Caso.id).label('casos_cerrados'),
-            func.avg(Caso.tiempo_resolucion_horas).label('tiempo_promedio'),
-            func.min(Caso.tiempo_resolucion_horas).label('tiempo_minimo'),
-            func.max(Caso.tiempo_resolucion_horas).label('tiempo_maximo')
-        ).filter(
-            Caso.estado == EstadoCasoEnum.CERRADO,
-            Caso.fecha_cierre >= fecha_inicio,
-            Caso.fecha_cierre <= fecha_fin,
-            Caso.tiempo_resolucion_horas.isnot(None)
-        ).group_by(Caso.prioridad).all()
-
-        datos = [{
-            "categoria": r.categoria.value,
-            "casos_cerrados": r.casos_cerrados,
-            "tiempo_promedio_horas": round(r.tiempo_promedio, 2),
-            "tiempo_minimo_horas": round(r.tiempo_minimo, 2),
-            "tiempo_maximo_horas": round(r.tiempo_maximo, 2)
-        } for r in resultados]
+            fuente.c.prioridad.label('categoria'),
+            *_agregados_resolucion(fuente)
+        ).group_by(fuente.c.prioridad).all()
+
+    datos = [{
+        "categoria": r.categoria.value if isinstance(r.categoria, PrioridadEnum) else r.categoria,
+        "casos_cerrados": r.casos_cerrados,
+        "tiempo_promedio_horas": round(r.tiempo_promedio, 2),
+        "tiempo_minimo_horas": round(r.tiempo_minimo, 2),
+        "tiempo_maximo_horas": round(r.tiempo_maximo, 2),
+        "casos_dentro_sla": r.dentro_sla,
+        "porcentaje_cumplimiento_sla": round(r.dentro_sla / r.casos_cerrados * 100, 2),
+        **_percentiles_resolucion(r)
+    } for r in resultados]
 
     return {
         "periodo": {"inicio": inicio, "fin": fin},
         "agrupacion": agrupar_por,
         "datos": datos,
-        "promedio_general": round(promedio_general, 2),
-        "casos_dentro_sla": casos_dentro_sla,
-        "casos_fuera_sla": casos_fuera_sla,
-        "porcentaje_cumplimiento_sla": round(casos_dentro_sla / total * 100, 2)
+        "promedio_general": round(general.tiempo_promedio, 2),
+        "casos_dentro_sla": general.dentro_sla,
+        "casos_fuera_sla": total - general.dentro_sla,
+        "porcentaje_cumplimiento_sla": round(general.dentro_sla / total * 100, 2),
+        "percentiles": _percentiles_resolucion(general)
+    }
+
+def _agregados_primera_llamada(fuente):
+    """Cerrados, resueltos con una sola interacción y sin interacciones sobre `fuente`"""
+    return (
+        func.count().label('casos_cerrados'),
+        func.coalesce(func.sum(case((fuente.c.num_interacciones == 1, 1), else_=0)), 0).label('primera_llamada'),
+        func.coalesce(func.sum(case((fuente.c.num_interacciones == 0, 1), else_=0)), 0).label('sin_interacciones'),
+    )
+
+def _resumen_primera_llamada(fila) -> dict:
+    return {
+        "casos_cerrados": fila.casos_cerrados,
+        "resueltos_primera_llamada": fila.primera_llamada,
+        "sin_interacciones": fila.sin_interacciones,
+        "tasa_resolucion_primera_llamada": round(fila.primera_llamada / fila.casos_cerrados * 100, 2)
+        if fila.casos_cerrados else 0,
+    }
+
+@api_router.get("/metricas/primera-llamada")
+async def obtener_resolucion_primera_llamada(
+    inicio: str,
+    fin: str,
+    agrupar_por: str = "general",  # general, agente, motivo
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Resolución en primera llamada de los casos cerrados en el rango, por agente o motivo"""
+    if agrupar_por not in ("general", "agente", "motivo"):
+        raise HTTPException(status_code=400, detail="Agrupación no soportada")
+    fecha_inicio, fecha_fin = _rango_dias(inicio, fin)
+
+    # Casos cerrados en el rango, calientes y archivados
+    fuente = archivo_casos.union_casos(
+        ["agente_asignado_id", "motivo_id", "num_interacciones"],
+        lambda m: [
+            m.estado == EstadoCasoEnum.CERRADO,
+            m.fecha_cierre >= fecha_inicio,
+            m.fecha_cierre < fecha_fin
+        ]
+    )
+    general = db.query(*_agregados_primera_llamada(fuente)).one()
+
+    resultados = []
+    if agrupar_por == "agente":
+        resultados = db.query(
+            fuente.c.agente_asignado_id.label('id'),
+            func.coalesce(Usuario.nombre_completo, 'Sin asignar').label('categoria'),
+            *_agregados_primera_llamada(fuente)
+        ).select_from(fuente).outerjoin(
+            Usuario, Usuario.id == fuente.c.agente_asignado_id
+        ).group_by(fuente.c.agente_asignado_id, Usuario.nombre_completo).all()
+    elif agrupar_por == "motivo":
+        resultados = db.query(
+            MotivoPQR.id.label('id'),
+            MotivoPQR.nombre.label('categoria'),
+            *_agregados_primera_llamada(fuente)
+        ).join(fuente, fuente.c.motivo_id == MotivoPQR.id).group_by(MotivoPQR.id, MotivoPQR.nombre).all()
+
+    datos = sorted(
+        ({"id": r.id, "categoria": r.categoria, **_resumen_primera_llamada(r)} for r in resultados),
+        key=lambda d: d["casos_cerrados"], reverse=True
+    )
+    return {
+        "periodo": {"inicio": inicio, "fin": fin},
+        "agrupacion": agrupar_por,
+        **_resumen_primera_llamada(general),
+        "datos": datos
+    }
+
+# agrupar_por de /metricas/llamadas -> columnas de fuente_llamadas; la primera es la clave de grupo
+AGRUPACIONES_LLAMADAS = {
+    "dia": ("dia",),
+    "hora": ("hora",),
+    "campana": ("omnileads_campaign_id", "omnileads_campaign_name", "omnileads_campaign_type"),
+    "agente": ("agent_username", "agent_name"),
+}
+
+@api_router.get("/metricas/llamadas")
+async def obtener_metricas_llamadas(
+    inicio: str,
+    fin: str,
+    agrupar_por: str = "campana",  # combinación separada por comas de campana, agente, dia, hora
+    campaign_id: Optional[str] = None,
+    agent_username: Optional[str] = None,
+    current_user: Usuario = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Llamadas (interacciones) registradas en el rango por campaña, agente de OmniLeads, día u hora local"""
+    agrupaciones = list(dict.fromkeys(a.strip() for a in agrupar_por.split(",") if a.strip()))
+    if not agrupaciones or any(a not in AGRUPACIONES_LLAMADAS for a in agrupaciones):
+        raise HTTPException(status_code=400, detail="Agrupación no soportada")
+    fecha_inicio, fecha_fin = _rango_dias(inicio, fin)
+    if fecha_fin <= fecha_inicio:
+        raise HTTPException(status_code=400, detail="El rango de fechas no es válido")
+
+    filtros = {}
+    if campaign_id:
+        filtros["omnileads_campaign_id"] = campaign_id
+    if agent_username:
+        filtros["agent_username"] = agent_username
+
+    dimensiones = [c for a in agrupaciones for c in AGRUPACIONES_LLAMADAS[a]]
+    fuente = rollup_llamadas.fuente_llamadas(db, fecha_inicio, fecha_fin, dimensiones, filtros)
+    # Los nombres de campaña y agente pueden cambiar en OmniLeads: se agrupa por el
+    # identificador y se muestra un nombre cualquiera del periodo
+    claves = [fuente.c[AGRUPACIONES_LLAMADAS[a][0]] for a in agrupaciones]
+    descripciones = [
+        func.max(fuente.c[c]).label(c) for a in agrupaciones for c in AGRUPACIONES_LLAMADAS[a][1:]
+    ]
+    cantidad = func.sum(fuente.c.cantidad)
+    orden = [fuente.c[a] for a in ("dia", "hora") if a in agrupaciones] or [cantidad.desc()]
+    resultados = db.query(
+        *claves, *descripciones, cantidad.label('llamadas')
+    ).group_by(*claves).order_by(*orden).all()
+
+    datos = []
+    for r in resultados:
+        fila = r._asdict()
+        if "dia" in fila:
+            fila["dia"] = fila["dia"].isoformat()
+        fila["llamadas"] = int(fila["llamadas"])
+        datos.append(fila)
+    return {
+        "periodo": {"inicio": inicio, "fin": fin},
+        "agrupacion": agrupaciones,
+        "total": sum(d["llamadas"] for d in datos),
+        "datos": datos
+    }
+
+# Resultados de tendencia por periodo cerrado; los casos creados en el pasado solo
+# cambian al actualizarse o al recalcularse metricas_diarias, y ambos llegan por el bus
+cache_tendencia = periodos.CachePeriodosCerrados(
+    ttl_segundos=int(os.environ.get('CACHE_TENDENCIA_TTL', '3600'))
+)
+
+def invalidar_cache_tendencia(tipo: str, datos: dict):
+    """Oyente del bus de eventos; corre en cada worker"""
+    if tipo == "caso_actualizado" and datos.get("fecha_creacion"):
+        cache_tendencia.invalidar_fecha(datetime.fromisoformat(datos["fecha_creacion"]))
+    elif tipo == "metricas_recalculadas" and datos.get("tabla") == rollup_metricas.MARCA_METRICAS_DIARIAS:
+        for dia in datos["dias"]:
+            cache_tendencia.invalidar_dia(date.fromisoformat(dia))
+
+def consultar_tendencia(db: Session, desde: datetime, hasta: datetime, agrupar_por: str) -> dict:
+    """
+    Conteos por periodo local en [desde, hasta), con los periodos sin casos
+    rellenados en el servidor mediante generate_series.
+    """
+    unidad = periodos.UNIDADES_PERIODO[agrupar_por]
+    fuente = rollup_metricas.fuente_casos(db, desde, hasta, ["dia", "hora", "estado"])
+    instante = cast(fuente.c.dia, DateTime) + fuente.c.hora * literal_column("interval '1 hour'")
+    periodo = func.date_trunc(unidad, instante)
+
+    conteos = db.query(
+        periodo.label('periodo'),
+        func.sum(fuente.c.cantidad).label('casos_abiertos'),
+        func.sum(case((fuente.c.estado == EstadoCasoEnum.CERRADO, fuente.c.cantidad), else_=0)).label('casos_cerrados')
+    ).group_by(periodo).subquery('conteos')
+
+    serie = select(
+        func.generate_series(
+            cast(periodos.truncar(desde, agrupar_por), DateTime),
+            cast(periodos.truncar(hasta - timedelta(microseconds=1), agrupar_por), DateTime),
+            literal_column(f"interval '1 {unidad}'")
+        ).label('periodo')
+    ).subquery('serie')
+
+    resultados = db.query(
+        serie.c.periodo,
+        func.coalesce(conteos.c.casos_abiertos, 0).label('casos_abiertos'),
+        func.coalesce(conteos.c.casos_cerrados, 0).label('casos_cerrados')
+    ).outerjoin(conteos, conteos.c.periodo == serie.c.periodo).order_by(serie.c.periodo).all()
+
+    return {
+        r.periodo: {"casos_abiertos": r.casos_abiertos, "casos_cerrados": r.casos_cerrados}
+        for r in resultados
     }
 
 @api_router.get("/metricas/tendencia-historica")
 async def obtener_tendencia_historica(
     inicio: str,
     fin: str,
-    agrupar_por: str = "dia",  # dia, semana, mes
+    agrupar_por: str = "dia",  # hora, dia, semana, mes
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    if agrupar_por not in periodos.UNIDADES_PERIODO:
+        raise HTTPException(status_code=400, detail="Agrupación no soportada")
+
+    # Fechas en hora local; una fecha sin hora como fin incluye el día completo
     fecha_inicio = datetime.fromisoformat(inicio)
     fecha_fin = datetime.fromisoformat(fin)
+    if len(fin) == 10:
+        fecha_fin += timedelta(days=1)
+    if fecha_fin <= fecha_inicio:
+        raise HTTPException(status_code=400, detail="El rango de fechas no es válido")
+
+    # Periodos del rango; solo se cachean los cerrados que caen completos en él
+    ahora = periodos.ahora_local()
+    lista_periodos = []
+    p = periodos.truncar(fecha_inicio, agrupar_por)
+    while p < fecha_fin:
+        lista_periodos.append(p)
+        p = periodos.siguiente(p, agrupar_por)
+
+    def cacheable(p: datetime) -> bool:
+        fin_periodo = periodos.siguiente(p, agrupar_por)
+        return fin_periodo <= ahora and p >= fecha_inicio and fin_periodo <= fecha_fin
+
+    conteos = {}
+    faltantes = []
+    for p in lista_periodos:
+        valor = cache_tendencia.obtener(agrupar_por, p) if cacheable(p) else None
+        if valor is None:
+            faltantes.append(p)
+        else:
+            conteos[p] = valor
 
-    if agrupar_por == "dia":
-        resultados = db.query(
-            func.date(Caso.fecha_creacion).label('periodo'),
-            func.count(Caso.id).label('casos_abiertos'),
-            func.count(case((Caso.estado == EstadoCasoEnum.CERRADO, 1))).label('casos_cerrados')
-        ).filter(
-            Caso.fecha_creacion >= fecha_inicio,
-            Caso.fecha_creacion <= fecha_fin
-        ).group_by(func.date(Caso.fecha_creacion)).order_by('periodo').all()
-
-        datos = [{
-            "periodo": str(r.periodo),
-            "casos_abiertos": r.casos_abiertos,
-            "casos_cerrados": r.casos_cerrados,
-            "casos_pendientes": r.casos_abiertos - r.casos_cerrados
-        } for r in resultados]
+    # Una sola consulta cubre el tramo de periodos faltantes (normalmente solo el abierto)
+    if faltantes:
+        desde = max(faltantes[0], fecha_inicio)
+        hasta = min(periodos.siguiente(faltantes[-1], agrupar_por), fecha_fin)
+        for p, valor in consultar_tendencia(db, desde, hasta, agrupar_por).items():
+            conteos.setdefault(p, valor)
+            if cacheable(p):
+                cache_tendencia.guardar(agrupar_por, p, valor)
+
+    datos = []
+    for p in lista_periodos:
+        valor = conteos.get(p, {"casos_abiertos": 0, "casos_cerrados": 0})
+        datos.append({
+            "periodo": periodos.etiqueta(p, agrupar_por),
+            "casos_abiertos": valor["casos_abiertos"],
+            "casos_cerrados": valor["casos_cerrados"],
+            "casos_pendientes": valor["casos_abiertos"] - valor["casos_cerrados"]
+        })
 
     return {
         "periodo": {"inicio": inicio, "fin": fin},
         "agrupacion": agrupar_por,
+        "zona_horaria": periodos.ZONA_HORARIA,
         "datos": datos
     }
 
 # ==================== REPORTES ====================
 
-from reportes_service import ReportesService
-from fastapi.responses import StreamingResponse
+def obtener_datos_casos_periodo(db: Session, fecha_ini: datetime, fecha_f: datetime) -> dict:
+    """
+    Datos del reporte de casos por período a partir de una única consulta agrupada
+    por día, motivo, prioridad, origen y estado. Los totales y todos los desgloses
+    se consolidan en memoria sobre ese resultado (pocas filas, una por combinación).
+    Incluye los casos archivados del período.
+    """
+    fuente = archivo_casos.union_casos(
+        ["id", "fecha_creacion", "motivo_id", "prioridad", "origen", "estado", "tiempo_resolucion_horas"],
+        lambda m: [m.fecha_creacion >= fecha_ini, m.fecha_creacion <= fecha_f]
+    )
+    dia = func.date(fuente.c.fecha_creacion)
+    filas = db.query(
+        dia.label('dia'),
+        MotivoPQR.nombre.label('motivo'),
+        fuente.c.prioridad,
+        fuente.c.origen,
+        fuente.c.estado,
+        func.count(fuente.c.id).label('cantidad'),
+        func.sum(fuente.c.tiempo_resolucion_horas).label('suma_horas'),
+        func.count(fuente.c.tiempo_resolucion_horas).label('con_resolucion')
+    ).join(MotivoPQR, fuente.c.motivo_id == MotivoPQR.id).group_by(
+        dia, MotivoPQR.nombre, fuente.c.prioridad, fuente.c.origen, fuente.c.estado
+    ).all()
+
+    por_estado = {estado: 0 for estado in EstadoCasoEnum}
+    por_motivo, por_prioridad, por_origen, por_dia = {}, {}, {}, {}
+    suma_horas = 0.0
+    con_resolucion = 0
+
+    for f in filas:
+        por_estado[f.estado] += f.cantidad
+        por_motivo[f.motivo] = por_motivo.get(f.motivo, 0) + f.cantidad
+        por_prioridad[f.prioridad.value] = por_prioridad.get(f.prioridad.value, 0) + f.cantidad
+        por_origen[f.origen] = por_origen.get(f.origen, 0) + f.cantidad
+        por_dia[str(f.dia)] = por_dia.get(str(f.dia), 0) + f.cantidad
+        suma_horas += f.suma_horas or 0
+        con_resolucion += f.con_resolucion
+
+    return {
+        "total_casos": sum(por_estado.values()),
+        "abiertos": por_estado[EstadoCasoEnum.ABIERTO],
+        "cerrados": por_estado[EstadoCasoEnum.CERRADO],
+        "en_proceso": por_estado[EstadoCasoEnum.EN_PROCESO],
+        "tiempo_promedio": suma_horas / con_resolucion if con_resolucion else 0,
+        "por_motivo": [
+            {"motivo": k, "cantidad": v}
+            for k, v in sorted(por_motivo.items(), key=lambda item: item[1], reverse=True)
+        ],
+        "por_prioridad": [
+            {"prioridad": p.value, "cantidad": por_prioridad[p.value]}
+            for p in PrioridadEnum if p.value in por_prioridad
+        ],
+        "por_origen": [
+            {"origen": k, "cantidad": v}
+            for k, v in sorted(por_origen.items(), key=lambda item: item[1], reverse=True)
+        ],
+        "por_dia": [{"dia": k, "cantidad": v} for k, v in sorted(por_dia.items())]
+    }
 
 @api_router.post("/reportes/generar")
 async def generar_reporte(
@@ -986,24 +1775,28 @@ async def generar_reporte(
     fecha_inicio: str,
     fecha_fin: str,
     current_user: Usuario = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Genera reportes en PDF o Excel"""
+    # Importación diferida: reportlab, openpyxl y matplotlib solo se cargan
+    # cuando un worker genera su primer reporte, no en el arranque
+    from reportes_service import ReportesService
 
     if tipo_reporte == "desempeno_agentes":
         # Obtener datos
         fecha_ini = datetime.fromisoformat(fecha_inicio)
         fecha_f = datetime.fromisoformat(fecha_fin)
 
+        fuente = archivo_casos.union_casos(
+            ["agente_asignado_id", "estado", "tiempo_resolucion_horas"],
+            lambda m: [m.fecha_creacion >= fecha_ini, m.fecha_creacion <= fecha_f]
+        )
         resultados = db.query(
             Usuario.nombre_completo,
-            func.count(case((Caso.estado == EstadoCasoEnum.ABIERTO, 1))).label('abiertos'),
-            func.count(case((Caso.estado == EstadoCasoEnum.CERRADO, 1))).label('cerrados'),
-            func.avg(Caso.tiempo_resolucion_horas).label('promedio_horas')
-        ).join(Caso, Usuario.id == Caso.agente_asignado_id).filter(
-            Caso.fecha_creacion >= fecha_ini,
-            Caso.fecha_creacion <= fecha_f
-        ).group_by(Usuario.nombre_completo).all()
+            func.count(case((fuente.c.estado == EstadoCasoEnum.ABIERTO, 1))).label('abiertos'),
+            func.count(case((fuente.c.estado == EstadoCasoEnum.CERRADO, 1))).label('cerrados'),
+            func.avg(fuente.c.tiempo_resolucion_horas).label('promedio_horas')
+        ).join(fuente, Usuario.id == fuente.c.agente_asignado_id).group_by(Usuario.nombre_completo).all()
 
         datos = {
             "agentes": [{
@@ -1031,46 +1824,10 @@ async def generar_reporte(
         )
 
     elif tipo_reporte == "casos_periodo":
-        # Obtener datos
+        # Obtener datos (una sola consulta agregada alimenta todo el reporte)
         fecha_ini = datetime.fromisoformat(fecha_inicio)
         fecha_f = datetime.fromisoformat(fecha_fin)
-
-        total_casos = db.query(Caso).filter(
-            Caso.fecha_creacion >= fecha_ini,
-            Caso.fecha_creacion <= fecha_f
-        ).count()
-
-        abiertos = db.query(Caso).filter(
-            Caso.fecha_creacion >= fecha_ini,
-            Caso.fecha_creacion <= fecha_f,
-            Caso.estado == EstadoCasoEnum.ABIERTO
-        ).count()
-
-        cerrados = db.query(Caso).filter(
-            Caso.fecha_creacion >= fecha_ini,
-            Caso.fecha_creacion <= fecha_f,
-            Caso.estado == EstadoCasoEnum.CERRADO
-        ).count()
-
-        en_proceso = db.query(Caso).filter(
-            Caso.fecha_creacion >= fecha_ini,
-            Caso.fecha_creacion <= fecha_f,
-            Caso.estado == EstadoCasoEnum.EN_PROCESO
-        ).count()
-
-        avg_tiempo = db.query(func.avg(Caso.tiempo_resolucion_horas)).filter(
-            Caso.fecha_creacion >= fecha_ini,
-            Caso.fecha_creacion <= fecha_f,
-            Caso.tiempo_resolucion_horas.isnot(None)
-        ).scalar()
-
-        datos = {
-            "total_casos": total_casos,
-            "abiertos": abiertos,
-            "cerrados": cerrados,
-            "en_proceso": en_proceso,
-            "tiempo_promedio": avg_tiempo or 0
-        }
+        datos = obtener_datos_casos_periodo(db, fecha_ini, fecha_f)
 
         # Generar reporte
         if formato == "pdf":
@@ -1078,8 +1835,9 @@ async def generar_reporte(
             filename = f"reporte_casos_periodo_{fecha_inicio}_{fecha_fin}.pdf"
             media_type = "application/pdf"
         else:
-            # Por ahora solo PDF, puedes agregar Excel después
-            raise HTTPException(status_code=400, detail="Formato no soportado para este reporte")
+            buffer = ReportesService.generar_excel_casos_periodo(datos, fecha_inicio, fecha_fin)
+            filename = f"reporte_casos_periodo_{fecha_inicio}_{fecha_fin}.xlsx"
+            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
         return StreamingResponse(
             buffer,
@@ -1090,17 +1848,80 @@ async def generar_reporte(
     else:
         raise HTTPException(status_code=400, detail="Tipo de reporte no soportado")
 
+# ==================== ARCHIVO ====================
+
+@api_router.get("/archivo/estado")
+async def obtener_estado_archivo(
+    current_user: Usuario = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Filas calientes y archivadas por tabla y casos pendientes de archivar"""
+    return archivo_casos.estado_archivo(db)
+
+# Ruta síncrona: FastAPI la ejecuta en el threadpool y un archivo largo no bloquea el event loop
+@api_router.post("/archivo/ejecutar")
+def ejecutar_archivo(
+    dias: Optional[int] = Query(None, ge=0),
+    maximo: Optional[int] = Query(None, ge=1),
+    current_user: Usuario = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Archiva ya los casos cerrados hace más de `dias` días (ARCHIVO_DIAS_CIERRE por defecto)"""
+    total = archivo_casos.archivar_casos(db, dias=dias, maximo=maximo)
+    return {"message": f"Se archivaron {total} casos", "archivados": total}
+
+# ==================== IMPORTACIÓN DE HISTÓRICO ====================
+
+# Ruta síncrona: la carga corre en el threadpool. Para archivos de millones de
+# filas conviene la línea de comandos (importar_historico.py), sin timeouts HTTP
+@api_router.post("/importaciones")
+def importar_historico_archivo(
+    archivo: UploadFile = File(...),
+    hoja: Optional[str] = None,
+    separador: Optional[str] = None,
+    codificacion: str = "utf-8-sig",
+    forzar: bool = False,
+    current_user: Usuario = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Importa pacientes y casos históricos desde CSV o XLSX; el mismo archivo reanuda una carga interrumpida"""
+    try:
+        resultado = importar_historico.importar(
+            archivo.file, archivo.filename or "importacion.csv", current_user.id,
+            hoja=hoja, separador=separador, codificacion=codificacion, forzar=forzar
+        )
+    except importar_historico.ImportacionEnCurso:
+        raise HTTPException(status_code=409, detail="Ya hay una importación en curso")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Los casos abiertos importados suman carga a sus agentes
+    motor_asignacion.reconstruir(db)
+    return resultado
+
+@api_router.get("/importaciones")
+async def listar_importaciones(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Usuario = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    importaciones = db.query(Importacion).order_by(Importacion.id.desc()).limit(limit).all()
+    return [importar_historico.resumen(i) for i in importaciones]
+
 # ==================== MOTIVOS ====================
 
+def invalidar_catalogo(catalogo: str):
+    """Invalida la caché de un catálogo en este worker y avisa a los demás"""
+    cache_catalogos.invalidar(catalogo)
+    bus_eventos.publicar("catalogo_actualizado", {"catalogo": catalogo})
+
 @api_router.get("/motivos", response_model=List[schemas.MotivoPQR])
 async def listar_motivos(
+    request: Request,
     activo: Optional[bool] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(MotivoPQR)
-    if activo is not None:
-        query = query.filter(MotivoPQR.activo == activo)
-    return query.order_by(MotivoPQR.orden).all()
+    cuerpo, etag = cache_catalogos.motivos(db, activo)
+    return respuesta_json(request, cuerpo, etag)
 
 @api_router.post("/motivos", response_model=schemas.MotivoPQR)
 async def crear_motivo(
@@ -1112,6 +1933,7 @@ async def crear_motivo(
     db.add(db_motivo)
     db.commit()
     db.refresh(db_motivo)
+    invalidar_catalogo("motivos")
     return db_motivo
 
 @api_router.put("/motivos/{motivo_id}", response_model=schemas.MotivoPQR)
@@ -1130,6 +1952,7 @@ async def actualizar_motivo(
     
     db.commit()
     db.refresh(db_motivo)
+    invalidar_catalogo("motivos")
     return db_motivo
 
 # ==================== USUARIOS ====================
@@ -1165,6 +1988,7 @@ async def crear_usuario(
     db.add(db_usuario)
     db.commit()
     db.refresh(db_usuario)
+    invalidar_catalogo("usuarios")
     return db_usuario
 
 @api_router.put("/usuarios/{usuario_id}", response_model=schemas.Usuario)
@@ -1187,23 +2011,24 @@ async def actualizar_usuario(
     
     db.commit()
     db.refresh(db_usuario)
+    invalidar_catalogo("usuarios")
     return db_usuario
 
 # ==================== UBICACIONES ====================
 
 @api_router.get("/ubicaciones/departamentos", response_model=List[schemas.Departamento])
-async def listar_departamentos(db: Session = Depends(get_db)):
-    return db.query(Departamento).order_by(Departamento.nombre).all()
+async def listar_departamentos(request: Request, db: Session = Depends(get_db)):
+    cuerpo, etag = cache_catalogos.departamentos(db)
+    return respuesta_json(request, cuerpo, etag)
 
 @api_router.get("/ubicaciones/ciudades", response_model=List[schemas.Ciudad])
 async def listar_ciudades(
+    request: Request,
     departamento_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(Ciudad)
-    if departamento_id:
-        query = query.filter(Ciudad.departamento_id == departamento_id)
-    return query.order_by(Ciudad.nombre).all()
+    cuerpo, etag = cache_catalogos.ciudades(db, departamento_id)
+    return respuesta_json(request, cuerpo, etag)
 
 # ==================== CONFIGURACIÓN ====================
 
@@ -1215,6 +2040,12 @@ cors_origins_str = os.environ.get('CORS_ORIGINS', '*')
 cors_origins = [origin.strip() for origin in cors_origins_str.split(',')]
 logger.info(f"Configurando CORS con orígenes: {cors_origins}")
 
+# Idempotency-Key en las altas; va dentro del control de admisión, que rechaza antes de tocar la base
+app.add_middleware(idempotencia.MiddlewareIdempotencia)
+
+# Límites de los endpoints embebidos; va dentro de CORS para que los 429 lleven sus headers
+app.add_middleware(control_admision.MiddlewareAdmision)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1223,13 +2054,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Perfilado opcional por petición (X-Perfilar o PERFILADO_MUESTREO) y log de SQL lento
+app.add_middleware(perfilado.MiddlewarePerfilado)
+perfilado.instrumentar_engine(engine)
+if read_engine is not None:
+    perfilado.instrumentar_engine(read_engine)
+
+# Métricas por ruta (/metrics); se agrega al final para medir toda la pila
+app.add_middleware(observabilidad.MiddlewareMetricas)
+observabilidad.instrumentar_engine(engine)
+if read_engine is not None:
+    observabilidad.instrumentar_engine(read_engine)
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Iniciando servidor LOGIFARMA PQR...")
     # Crear tablas si no existen
     Base.metadata.create_all(bind=engine)
+    # Las tablas particionadas necesitan la partición del mes en curso antes de recibir filas
+    with engine.begin() as conexion:
+        particiones.asegurar_particiones(conexion)
+    bus_eventos.agregar_oyente(contador_alertas.aplicar_evento)
+    bus_eventos.agregar_oyente(cache_catalogos.aplicar_evento)
+    bus_eventos.agregar_oyente(motor_asignacion.aplicar_evento)
+    bus_eventos.agregar_oyente(invalidar_cache_tendencia)
+    bus_eventos.iniciar()
+    tareas.programar(
+        "metricas_diarias",
+        rollup_metricas.refrescar_metricas_diarias,
+        int(os.environ.get('ROLLUP_INTERVALO_SEGUNDOS', '300'))
+    )
+    tareas.programar(
+        "metricas_llamadas",
+        rollup_llamadas.refrescar_metricas_llamadas,
+        int(os.environ.get('ROLLUP_INTERVALO_SEGUNDOS', '300'))
+    )
+    # Carga de los agentes: se calcula ahora y se reconcilia con la base de datos cada tanto
+    tareas.programar(
+        "asignacion_agentes",
+        motor_asignacion.reconstruir,
+        int(os.environ.get('ASIGNACION_RECONSTRUIR_SEGUNDOS', '600'))
+    )
+    tareas.programar(
+        "archivo_casos",
+        archivo_casos.tarea_archivo,
+        int(os.environ.get('ARCHIVO_INTERVALO_SEGUNDOS', '3600'))
+    )
+    tareas.programar(
+        "particiones",
+        particiones.mantener_particiones,
+        int(os.environ.get('PARTICIONES_INTERVALO_SEGUNDOS', '86400'))
+    )
+    tareas.programar(
+        "claves_idempotencia",
+        idempotencia.purgar_expiradas,
+        int(os.environ.get('IDEMPOTENCIA_PURGA_SEGUNDOS', '3600'))
+    )
     logger.info("Servidor iniciado correctamente")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    bus_eventos.detener()
+    await tareas.detener()
+
 @app.get("/")
 async def root():
     return {"message": "LOGIFARMA PQR API - Sistema de Gestión de PQR"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Métricas en formato de texto de Prometheus"""
+    token = os.environ.get('METRICAS_TOKEN')
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="No autorizado")
+    return PlainTextResponse(
+        observabilidad.exponer(clientes_sse=bus_eventos.clientes_conectados),
+        media_type="text/plain; version=0.0.4"
+    )
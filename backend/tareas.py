@@ -0,0 +1,47 @@
+"""
+Tareas periódicas en segundo plano del servidor
+
+Cada tarea recibe una sesión propia y se ejecuta en el threadpool para no
+bloquear el event loop. Un intervalo <= 0 deshabilita la tarea.
+"""
+import asyncio
+import logging
+from typing import Callable, List
+
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+_tareas: List[asyncio.Task] = []
+
+def _ejecutar(funcion: Callable[[Session], object]):
+    db = SessionLocal()
+    try:
+        return funcion(db)
+    finally:
+        db.close()
+
+async def _ciclo(nombre: str, funcion: Callable[[Session], object], intervalo_segundos: float):
+    while True:
+        try:
+            await run_in_threadpool(_ejecutar, funcion)
+        except Exception as e:
+            logger.error(f"Error en la tarea {nombre}: {e}")
+        await asyncio.sleep(intervalo_segundos)
+
+def programar(nombre: str, funcion: Callable[[Session], object], intervalo_segundos: float):
+    """Ejecuta `funcion(db)` ahora y luego cada `intervalo_segundos`"""
+    if intervalo_segundos <= 0:
+        logger.info(f"Tarea {nombre} deshabilitada")
+        return
+    _tareas.append(asyncio.create_task(_ciclo(nombre, funcion, intervalo_segundos), name=nombre))
+    logger.info(f"Tarea {nombre} programada cada {intervalo_segundos}s")
+
+async def detener():
+    for tarea in _tareas:
+        tarea.cancel()
+    await asyncio.gather(*_tareas, return_exceptions=True)
+    _tareas.clear()
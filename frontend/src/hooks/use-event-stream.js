@@ -0,0 +1,31 @@
+import { useEffect, useRef } from 'react';
+import { abrirStreamEventos } from '../services/api';
+
+/**
+ * Suscribe el componente al stream de eventos del backend.
+ * `handlers` es un objeto { tipo_evento: (datos) => void }.
+ */
+export function useEventStream(handlers) {
+  const handlersRef = useRef(handlers);
+  handlersRef.current = handlers;
+
+  useEffect(() => {
+    const stream = abrirStreamEventos();
+    const tipos = Object.keys(handlersRef.current);
+
+    const listeners = tipos.map((tipo) => {
+      const listener = (event) => {
+        const handler = handlersRef.current[tipo];
+        if (handler) handler(JSON.parse(event.data));
+      };
+      stream.addEventListener(tipo, listener);
+      return [tipo, listener];
+    });
+
+    return () => {
+      listeners.forEach(([tipo, listener]) => stream.removeEventListener(tipo, listener));
+      stream.close();
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
+}
@@ -1,14 +1,20 @@
 import React, { useEffect, useState } from 'react';
-import { alertasAPI, casosAPI } from '../services/api';
+import { alertasAPI } from '../services/api';
 import { Card, CardContent, CardHeader, CardTitle } from '../components/ui/card';
 import { Button } from '../components/ui/button';
 import { Badge } from '../components/ui/badge';
 import { AlertTriangle, CheckCircle } from 'lucide-react';
 import { toast } from 'sonner';
 import { formatDate } from '../lib/utils';
+import { useEventStream } from '../hooks/use-event-stream';
+
+const PAGINA_ALERTAS = 50;
 
 const Alertas = () => {
   const [alertas, setAlertas] = useState([]);
+  const [alertasLeidas, setAlertasLeidas] = useState([]);
+  const [noLeidas, setNoLeidas] = useState(0);
+  const [hayMas, setHayMas] = useState(false);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -17,8 +23,15 @@ const Alertas = () => {
 
   const loadAlertas = async () => {
     try {
-      const response = await alertasAPI.getAll();
-      setAlertas(response.data);
+      const [pendientes, leidas, contador] = await Promise.all([
+        alertasAPI.getAll({ leida: false, limit: PAGINA_ALERTAS }),
+        alertasAPI.getAll({ leida: true, limit: 20 }),
+        alertasAPI.getUnreadCount(),
+      ]);
+      setAlertas(pendientes.data);
+      setHayMas(pendientes.data.length === PAGINA_ALERTAS);
+      setAlertasLeidas(leidas.data);
+      setNoLeidas(contador.data.no_leidas);
     } catch (error) {
       toast.error('Error al cargar alertas');
     } finally {
@@ -26,18 +39,54 @@ const Alertas = () => {
     }
   };
 
+  const cargarMas = async () => {
+    try {
+      const response = await alertasAPI.getAll({ leida: false, skip: alertas.length, limit: PAGINA_ALERTAS });
+      setAlertas((prev) => [...prev, ...response.data.filter((a) => !prev.some((p) => p.id === a.id))]);
+      setHayMas(response.data.length === PAGINA_ALERTAS);
+    } catch (error) {
+      toast.error('Error al cargar alertas');
+    }
+  };
+
+  const quitarPendiente = (alertaId) => {
+    const alerta = alertas.find((a) => a.id === alertaId);
+    if (!alerta) return;
+    setAlertas((prev) => prev.filter((a) => a.id !== alertaId));
+    setAlertasLeidas((prev) => [{ ...alerta, leida: true }, ...prev]);
+    setNoLeidas((n) => Math.max(0, n - 1));
+  };
+
+  // Actualizaciones en vivo: las alertas nuevas y las leídas llegan por el stream
+  useEventStream({
+    alerta_creada: (alerta) => {
+      if (alertas.some((a) => a.id === alerta.id)) return;
+      setAlertas((prev) => [alerta, ...prev]);
+      setNoLeidas((n) => n + 1);
+    },
+    alerta_leida: (alerta) => quitarPendiente(alerta.id),
+    alertas_leidas: () => loadAlertas(),
+  });
+
   const marcarLeida = async (alertaId) => {
     try {
       await alertasAPI.markAsRead(alertaId);
       toast.success('Alerta marcada como leída');
-      loadAlertas();
+      quitarPendiente(alertaId);
     } catch (error) {
       toast.error('Error al marcar alerta');
     }
   };
 
-  const alertasNoLeidas = alertas.filter(a => !a.leida);
-  const alertasLeidas = alertas.filter(a => a.leida);
+  const marcarTodas = async () => {
+    try {
+      const response = await alertasAPI.markAllAsRead();
+      toast.success(response.data.message);
+      loadAlertas();
+    } catch (error) {
+      toast.error('Error al marcar alertas');
+    }
+  };
 
   if (loading) {
     return (
@@ -54,25 +103,33 @@ const Alertas = () => {
           Alertas
         </h1>
         <p className="text-muted-foreground">
-          Gestión de alertas del sistema ({alertasNoLeidas.length} no leídas)
+          Gestión de alertas del sistema ({noLeidas} no leídas)
         </p>
       </div>
 
       {/* Alertas No Leídas */}
       <Card className="border-2">
         <CardHeader>
-          <CardTitle className="flex items-center gap-2">
-            <AlertTriangle className="h-5 w-5 text-orange-600" />
-            Alertas No Leídas ({alertasNoLeidas.length})
-          </CardTitle>
+          <div className="flex items-center justify-between">
+            <CardTitle className="flex items-center gap-2">
+              <AlertTriangle className="h-5 w-5 text-orange-600" />
+              Alertas No Leídas ({noLeidas})
+            </CardTitle>
+            {noLeidas > 0 && (
+              <Button size="sm" variant="outline" onClick={marcarTodas} data-testid="btn-marcar-todas-leidas">
+                <CheckCircle className="h-4 w-4 mr-2" />
+                Marcar todas como leídas
+              </Button>
+            )}
+          </div>
         </CardHeader>
         <CardContent className="space-y-3">
-          {alertasNoLeidas.length === 0 ? (
+          {alertas.length === 0 ? (
             <p className="text-center text-muted-foreground py-4">
               No hay alertas pendientes
             </p>
           ) : (
-            alertasNoLeidas.map((alerta) => (
+            alertas.map((alerta) => (
               <div
                 key={alerta.id}
                 className="p-4 border-2 rounded-lg bg-orange-50 border-orange-200"
@@ -92,7 +149,11 @@ const Alertas = () => {
                         ? 'Caso abierto hace más de 5 días sin resolver'
                         : 'Nuevo caso con prioridad alta'}
                     </p>
-                    <p className="text-sm text-muted-foreground">Caso ID: {alerta.caso_id}</p>
+                    <p className="text-sm text-muted-foreground">
+                      Caso {alerta.numero_caso}
+                      {alerta.paciente_nombre && ` · ${alerta.paciente_nombre}`}
+                      {alerta.prioridad && ` · Prioridad ${alerta.prioridad}`}
+                    </p>
                   </div>
                   <Button
                     size="sm"
@@ -106,6 +167,13 @@ const Alertas = () => {
               </div>
             ))
           )}
+          {hayMas && (
+            <div className="text-center">
+              <Button variant="outline" size="sm" onClick={cargarMas} data-testid="btn-cargar-mas-alertas">
+                Cargar más
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
 
@@ -115,7 +183,7 @@ const Alertas = () => {
           <CardHeader>
             <CardTitle className="flex items-center gap-2">
               <CheckCircle className="h-5 w-5 text-green-600" />
-              Alertas Leídas ({alertasLeidas.length})
+              Alertas Leídas Recientes
             </CardTitle>
           </CardHeader>
           <CardContent className="space-y-3">
@@ -128,6 +196,7 @@ const Alertas = () => {
                   <span className="text-sm text-muted-foreground">
                     {formatDate(alerta.fecha_creacion)}
                   </span>
+                  <span className="text-sm text-muted-foreground">Caso {alerta.numero_caso}</span>
                   <span className="text-sm text-green-600 ml-auto font-medium">
                     Leída
                   </span>
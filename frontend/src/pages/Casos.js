@@ -30,7 +30,7 @@ const Casos = () => {
   const loadData = async () => {
     try {
       const [casosRes, motivosRes] = await Promise.all([
-        casosAPI.getAll(),
+        casosAPI.getList(),
         motivosAPI.getAll({ activo: true })
       ]);
       setCasos(casosRes.data);
@@ -52,7 +52,7 @@ const Casos = () => {
       if (prioridad) params.prioridad = prioridad;
       if (origen) params.origen = origen;
 
-      const response = await casosAPI.getAll(params);
+      const response = await casosAPI.getList(params);
       setCasos(response.data);
     } catch (error) {
       toast.error('Error al buscar casos');
@@ -195,9 +195,9 @@ const Casos = () => {
                   casos.map((caso) => (
                     <TableRow key={caso.id}>
                       <TableCell className="font-medium">{caso.numero_caso}</TableCell>
-                      <TableCell>{caso.paciente?.identificacion || '-'}</TableCell>
-                      <TableCell>{caso.paciente ? `${caso.paciente.nombre} ${caso.paciente.apellidos}` : '-'}</TableCell>
-                      <TableCell>{caso.motivo_obj?.nombre || '-'}</TableCell>
+                      <TableCell>{caso.paciente_identificacion || '-'}</TableCell>
+                      <TableCell>{`${caso.paciente_nombre} ${caso.paciente_apellidos}`}</TableCell>
+                      <TableCell>{caso.motivo_nombre || '-'}</TableCell>
                       <TableCell>
                         <span className={`px-2 py-1 rounded text-xs font-semibold ${
                           caso.origen === 'call'
@@ -1,6 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { casosAPI, pacientesAPI, motivosAPI, usuariosAPI, ubicacionesAPI } from '../services/api';
+import { casosAPI, pacientesAPI, motivosAPI, usuariosAPI, ubicacionesAPI, nuevaClaveIdempotencia } from '../services/api';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
@@ -14,6 +14,8 @@ import { Save, Search, Plus, UserPlus } from 'lucide-react';
 const CrearCaso = () => {
   const navigate = useNavigate();
   const [loading, setLoading] = useState(false);
+  // Una clave por caso: si se reenvía tras un timeout, el servidor no lo duplica
+  const claveIdempotencia = useRef(nuevaClaveIdempotencia());
   const [motivos, setMotivos] = useState([]);
   const [agentes, setAgentes] = useState([]);
   const [departamentos, setDepartamentos] = useState([]);
@@ -143,7 +145,7 @@ const CrearCaso = () => {
         agente_asignado_id: caso.agenteAsignadoId ? parseInt(caso.agenteAsignadoId) : null
       };
 
-      const response = await casosAPI.create(casoData);
+      const response = await casosAPI.create(casoData, claveIdempotencia.current);
       toast.success(`Caso ${response.data.numero_caso} creado exitosamente`);
       navigate(`/casos/${response.data.id}`);
     } catch (error) {
@@ -348,7 +350,7 @@ const CrearCaso = () => {
                 <Label>Asignar a Agente</Label>
                 <Select value={caso.agenteAsignadoId} onValueChange={(value) => setCaso({ ...caso, agenteAsignadoId: value })}>
                   <SelectTrigger data-testid="select-caso-agente">
-                    <SelectValue placeholder="Sin asignar" />
+                    <SelectValue placeholder="Asignación automática" />
                   </SelectTrigger>
                   <SelectContent>
                     {agentes.map((a) => (
@@ -1,9 +1,10 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { metricasAPI, alertasAPI } from '../services/api';
 import { Card, CardContent, CardHeader, CardTitle } from '../components/ui/card';
 import { Button } from '../components/ui/button';
 import { FileText, CheckCircle, Clock, TrendingUp, AlertTriangle, Bell } from 'lucide-react';
 import { toast } from 'sonner';
+import { useEventStream } from '../hooks/use-event-stream';
 import { Bar } from 'react-chartjs-2';
 import {
   Chart as ChartJS,
@@ -42,6 +43,62 @@ const Dashboard = () => {
     }
   };
 
+  // Los contadores se ajustan con los eventos del stream; las métricas derivadas
+  // (tasas, promedios, casos por hora) se recargan una vez agrupando los cambios
+  const recargaPendiente = useRef(null);
+  const programarRecarga = () => {
+    if (recargaPendiente.current) return;
+    recargaPendiente.current = setTimeout(() => {
+      recargaPendiente.current = null;
+      loadData();
+    }, 30000);
+  };
+
+  useEffect(() => () => clearTimeout(recargaPendiente.current), []);
+
+  const campoPorEstado = {
+    ABIERTO: 'casos_abiertos_hoy',
+    CERRADO: 'casos_cerrados_hoy',
+  };
+
+  const esDeHoy = (fecha) => fecha && fecha.slice(0, 10) === new Date().toISOString().slice(0, 10);
+
+  const ajustarMetricas = (cambios) => {
+    setMetrics((prev) => {
+      if (!prev) return prev;
+      const siguiente = { ...prev };
+      Object.entries(cambios).forEach(([campo, delta]) => {
+        siguiente[campo] = Math.max(0, (siguiente[campo] || 0) + delta);
+      });
+      return siguiente;
+    });
+  };
+
+  useEventStream({
+    caso_creado: (caso) => {
+      const cambios = { total_casos: 1 };
+      if (caso.estado === 'EN_PROCESO') cambios.casos_en_proceso = 1;
+      if (campoPorEstado[caso.estado] && esDeHoy(caso.fecha_creacion)) cambios[campoPorEstado[caso.estado]] = 1;
+      ajustarMetricas(cambios);
+      programarRecarga();
+    },
+    caso_actualizado: (caso) => {
+      if (caso.estado_anterior && caso.estado_anterior !== caso.estado) {
+        const cambios = {};
+        if (caso.estado_anterior === 'EN_PROCESO') cambios.casos_en_proceso = -1;
+        if (caso.estado === 'EN_PROCESO') cambios.casos_en_proceso = 1;
+        if (esDeHoy(caso.fecha_creacion)) {
+          if (campoPorEstado[caso.estado_anterior]) cambios[campoPorEstado[caso.estado_anterior]] = -1;
+          if (campoPorEstado[caso.estado]) cambios[campoPorEstado[caso.estado]] = 1;
+        }
+        ajustarMetricas(cambios);
+      }
+      programarRecarga();
+    },
+    alerta_creada: () => ajustarMetricas({ alertas_activas: 1 }),
+    alerta_leida: () => ajustarMetricas({ alertas_activas: -1 }),
+  });
+
   const chartData = {
     labels: Array.from({ length: 24 }, (_, i) => `${i}:00`),
     datasets: [
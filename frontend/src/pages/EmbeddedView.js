@@ -1,6 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
-import { casosAPI, motivosAPI } from '../services/api';
+import { casosAPI, motivosAPI, nuevaClaveIdempotencia } from '../services/api';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
@@ -64,6 +64,10 @@ const EmbeddedView = () => {
   const [numeroRadicacion, setNumeroRadicacion] = useState('');
 
   const [searchParams] = useSearchParams();
+  // Una clave por caso guardado: si se reenvía tras un timeout, el servidor no lo duplica
+  const claveIdempotencia = useRef(nuevaClaveIdempotencia());
+  // La campaña identifica el tráfico embebido en el control de admisión del backend
+  const configEmbebido = { headers: { 'X-Omnileads-Campana': searchParams.get('campaign_id') ?? '' } };
 
   useEffect(() => {
     loadMotivos();
@@ -169,7 +173,7 @@ const EmbeddedView = () => {
     try {
       const API_URL = process.env.REACT_APP_BACKEND_URL + '/api';
       // Usar endpoint embebido que no requiere autenticación
-      const response = await axios.get(`${API_URL}/embedded/paciente/${identificacion}`);
+      const response = await axios.get(`${API_URL}/embedded/paciente/${identificacion}`, configEmbebido);
 
       if (response.data.found) {
         const p = response.data.paciente;
@@ -277,7 +281,7 @@ const EmbeddedView = () => {
     try {
       const API_URL = process.env.REACT_APP_BACKEND_URL + '/api';
       // Usar endpoint embebido que no requiere autenticación
-      const response = await axios.get(`${API_URL}/embedded/paciente/${paciente.identificacion}/historial`);
+      const response = await axios.get(`${API_URL}/embedded/paciente/${paciente.identificacion}/historial`, configEmbebido);
       setCasosPaciente(response.data);
       setActiveTab('historial');
     } catch (error) {
@@ -355,7 +359,7 @@ const EmbeddedView = () => {
         omnileads: omnileadsFromUrl
       };
 
-      const response = await casosAPI.createEmbedded(casoData);
+      const response = await casosAPI.createEmbedded(casoData, configEmbebido, claveIdempotencia.current);
 
       // Extraer número de radicación de la respuesta
       const numeroRad = response.data.numero_caso;
@@ -376,6 +380,7 @@ const EmbeddedView = () => {
   };
 
   const limpiarFormulario = () => {
+    claveIdempotencia.current = nuevaClaveIdempotencia();
     setIdentificacion('');
     setPaciente(null);
     setNombre('');
@@ -27,6 +27,13 @@ api.interceptors.response.use(
   }
 );
 
+// Idempotency-Key: el servidor responde a los reintentos del mismo envío sin repetir el alta
+export const nuevaClaveIdempotencia = () =>
+  window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
+const conClaveIdempotencia = (clave, config = {}) =>
+  clave ? { ...config, headers: { ...config.headers, 'Idempotency-Key': clave } } : config;
+
 export const authAPI = {
   login: (credentials) => api.post('/auth/login', credentials),
   logout: () => api.post('/auth/logout'),
@@ -42,10 +49,14 @@ export const pacientesAPI = {
 
 export const casosAPI = {
   getAll: (params) => api.get('/casos', { params }),
+  // Filas planas con solo las columnas del listado (más livianas que getAll)
+  getList: (params) => api.get('/casos/lista', { params }),
   getById: (id) => api.get(`/casos/${id}`),
-  create: (data) => api.post('/casos', data),
+  create: (data, claveIdempotencia) => api.post('/casos', data, conClaveIdempotencia(claveIdempotencia)),
   update: (id, data) => api.put(`/casos/${id}`, data),
-  createEmbedded: (data) => api.post('/embedded/caso', data),
+  updateBatch: (actualizaciones) => api.put('/casos/lote', actualizaciones),
+  createEmbedded: (data, config, claveIdempotencia) =>
+    api.post('/embedded/caso', data, conClaveIdempotencia(claveIdempotencia, config)),
 };
 
 export const motivosAPI = {
@@ -56,12 +67,14 @@ export const motivosAPI = {
 
 export const interaccionesAPI = {
   getAll: (params) => api.get('/interacciones', { params }),
-  create: (data) => api.post('/interacciones', data),
+  create: (data, claveIdempotencia) => api.post('/interacciones', data, conClaveIdempotencia(claveIdempotencia)),
 };
 
 export const alertasAPI = {
   getAll: (params) => api.get('/alertas', { params }),
+  getUnreadCount: () => api.get('/alertas/no-leidas'),
   markAsRead: (id) => api.put(`/alertas/${id}/marcar-leida`),
+  markAllAsRead: () => api.put('/alertas/marcar-todas-leidas'),
   verifySLA: () => api.post('/alertas/verificar-sla'),
 };
 
@@ -92,4 +105,10 @@ export const ubicacionesAPI = {
   getCiudades: (departamentoId) => api.get('/ubicaciones/ciudades', { params: { departamento_id: departamentoId } }),
 };
 
+// Stream de eventos (SSE). EventSource no envía headers, el token va en la URL
+export const abrirStreamEventos = () => {
+  const token = localStorage.getItem('token');
+  return new EventSource(`${API_URL}/stream?token=${encodeURIComponent(token || '')}`);
+};
+
 export default api;
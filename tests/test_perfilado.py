@@ -0,0 +1,107 @@
+"""
+Registro de SQL lento: solo las lecturas simples se repiten con EXPLAIN ANALYZE
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import perfilado  # noqa: E402
+
+
+@pytest.mark.parametrize("sentencia", [
+    "SELECT casos.id FROM casos WHERE casos.estado = %(estado)s",
+    "  select count(*) from interacciones",
+    "SELECT * FROM casos ORDER BY fecha_creacion",  # "for" dentro de otra palabra
+])
+def test_lecturas_simples_se_explican(sentencia):
+    assert perfilado._es_lectura_simple(sentencia)
+
+
+@pytest.mark.parametrize("sentencia", [
+    "SELECT pg_advisory_lock(%(clave)s)",
+    "SELECT pg_try_advisory_lock(7301001)",
+    "SELECT pg_advisory_xact_lock(7301003)",
+    "SELECT pg_advisory_unlock(7301001)",
+    "SELECT pg_notify(%(canal)s, %(datos)s)",
+    "SELECT casos.id FROM casos WHERE casos.id = 1 FOR UPDATE",
+    "SELECT id FROM agentes FOR NO KEY UPDATE SKIP LOCKED",
+    "SELECT id FROM casos for share",
+    "SELECT id FROM casos FOR KEY SHARE",
+    "UPDATE casos SET estado = 'CERRADO'",
+    "INSERT INTO casos (id) VALUES (1)",
+])
+def test_sentencias_con_efectos_no_se_explican(sentencia):
+    assert not perfilado._es_lectura_simple(sentencia)
+
+
+class _EjecutorInmediato:
+    def __init__(self):
+        self.explicadas = []
+
+    def submit(self, fn, motor, registro, sentencia, parametros, explicar):
+        if explicar:
+            self.explicadas.append(sentencia)
+
+
+def test_solo_las_lecturas_simples_llegan_a_explain(monkeypatch):
+    ejecutor = _EjecutorInmediato()
+    monkeypatch.setattr(perfilado, "_ejecutor_explain", ejecutor)
+    monkeypatch.setattr(perfilado, "SQL_LENTO_UMBRAL_MS", 0)
+    monkeypatch.setattr(perfilado, "SQL_LENTO_EXPLAIN", True)
+    monkeypatch.setattr(perfilado, "_cupo_explain", lambda: True)
+
+    motor = create_engine("sqlite://")
+    motor.dialect.name = "postgresql"  # el EXPLAIN solo se pide en PostgreSQL
+
+    @event.listens_for(motor, "connect")
+    def _funciones(conexion, _):
+        conexion.create_function("pg_advisory_lock", 1, lambda clave: None)
+        conexion.create_function("pg_notify", 2, lambda canal, datos: None)
+
+    perfilado.instrumentar_engine(motor)
+    with motor.connect() as conexion:
+        conexion.execute(text("SELECT 1"))
+        conexion.execute(text("SELECT pg_advisory_lock(7301001)"))
+        conexion.execute(text("SELECT pg_notify('eventos', '{}')"))
+
+    assert ejecutor.explicadas == ["SELECT 1"]
+
+
+def test_explicar_descarta_la_conexion():
+    class _Cursor:
+        def execute(self, sentencia, parametros=None):
+            pass
+
+        def fetchone(self):
+            return [[{"Plan": {}}]]
+
+        def close(self):
+            pass
+
+    class _Conexion:
+        invalidada = cerrada = False
+
+        def cursor(self):
+            return _Cursor()
+
+        def rollback(self):
+            pass
+
+        def invalidate(self):
+            self.invalidada = True
+
+        def close(self):
+            self.cerrada = True
+
+    conexion = _Conexion()
+
+    class _Motor:
+        def raw_connection(self):
+            return conexion
+
+    assert perfilado._explicar(_Motor(), "SELECT 1", {}) == [{"Plan": {}}]
+    assert conexion.invalidada and not conexion.cerrada